@@ -1,7 +1,7 @@
 # amm_arbitrage_lfg.py
 
+import math
 import os
-import json
 import time
 import threading
 import traceback
@@ -15,143 +15,280 @@ import dotenv
 from helpful_functions import (
     initialize_web3,
     initialize_cex_object,
-    find_best_arbitrage_opportunity,
-    get_withdrawal_fee,
-    convert_format,
 )
-from telegram import send_message
+from telegram import send_message_async
 from config import constants
 from lfg_client import LFGclient
+from block_scheduler import BlockScheduler
+from binance_streams import BookTickerCache
+from order_book import OrderBookMirror
+from exchange_info_store import ExchangeInfoStore
+from balance_ledger import BalanceLedger
+from tx_manager import ConfirmationWatcher
+from lb_simulator import LBSimulator
+from size_optimizer import SizeOptimizer
+from opportunity_scoring import OpportunityScorer
+from execution_scheduler import ExecutionScheduler
+from unwind_pipeline import UnwindPipeline, UNWIND_JOBS_FILE
+from deposit_matcher import DepositMatcher, DepositTimeout
+from sell_executor import SellExecutor
+from route_graph import RouteGraph
+from records import ScanBuffer
+from mempool_watcher import MempoolWatcher
+from backtest import TickRecorder
 
 dotenv.load_dotenv()
 
 INFINITE = 1000000000
-BINANCE_WAITING_DEPOSITS_FILE = "data/binance_waiting_deposits.json"
 WITHDRAW_PRECISION = 5
 DEFAULT_AVALANCHE_GAS = 1000000
+# Итоги продажи, которые стадия sell копит в джобе
+SELL_TOTALS = ("total_usdt", "rebought_usdt", "bought")
 
-# Глобальная блокировка
-file_lock = threading.Lock()
+
+def floor_usdt(amount):
+    # Округление вниз до точности котировки USDT. round убирает ошибку float:
+    # 19.9 * 100 = 1989.9999...
+    return math.floor(round(amount * 100, 6)) / 100
 
 
 class AmmArbitrageLFG:
-    def __init__(self, tokens_to_arbitrage: list) -> None:
+    def __init__(
+        self,
+        tokens_to_arbitrage: list,
+        network="avalanche",
+        book_ticker_cache=None,
+        weight_budget=None,
+    ) -> None:
         self.running = False
+        self.network = network
 
-        # Инициализация Web3 для сети Avalanche
-        self.network = "avalanche"
-        self.w3 = initialize_web3(self.network)
-
-        # Инициализация клиента LFG DEX
-        self.lfg_client = LFGclient(self.w3)
+        # Сохраняем список токенов для арбитража
+        self.tokens = tokens_to_arbitrage
 
         # Инициализация Binance клиента
         self.cex = "binance"
-        self.cex_client = initialize_cex_object(self.cex)
+        # В мультипроцессном режиме вес запросов общий с другими процессами
+        self.cex_client = initialize_cex_object(self.cex, weight_budget)
+
+        # Данные биржи (сети, комиссии вывода) в памяти, обновляются в фоне
+        self.exchange_info = ExchangeInfoStore(self.cex_client, self.cex)
 
         # Получаем ключ к кошельку. Объект содержит address and _private_key
         private_key = os.environ.get("PRIVATE_KEY")
         self.account: LocalAccount = Account.from_key(private_key)
         logger.info(f"Wallet: {self.account.address}")
 
-        # Сохраняем список токенов для арбитража
-        self.tokens = tokens_to_arbitrage
+        # Баланс базового токена в памяти с резервами под свапы
+        self.balance_ledger = BalanceLedger(self.network)
+
+        # Запись тикеров и котировок для бэктеста
+        recorder = None
+        if constants.backtest_record_dir:
+            recorder = TickRecorder(
+                constants.backtest_record_dir, self.tokens, self.network
+            )
+
+        # Все, что нужно для скана: котирование, цены CEX, размер и скоринг
+        self.init_scanning(book_ticker_cache, recorder=recorder)
+
+        # Квитанции свапов ждем в отдельном потоке
+        self.confirmation_watcher = ConfirmationWatcher(self.w3)
+
+        # Продажа депозита частями по стакану. Фильтры символов грузятся в start()
+        self.sell_executor = SellExecutor(self.cex_client, self.order_books)
+
+        # Несколько сделок за скан с лимитами экспозиции
+        self.execution_scheduler = ExecutionScheduler(
+            self.network,
+            self.balance_ledger,
+            self.size_optimizer,
+            self.get_cex_sell_price,
+            self.make_trade,
+        )
+
+        # Back-run по pending свапам через отслеживаемые пары
+        self.mempool_watcher = MempoolWatcher(
+            self.network,
+            self.lfg_client,
+            self.lb_simulator,
+            lambda: self.last_cex_prices,
+            self.get_cex_sell_price,
+            self.on_backrun,
+        )
+
+        # Депозиты Binance по tx_hash свапа, один поток опроса на все ожидания
+        self.deposit_matcher = DepositMatcher(self.cex_client)
+
+        # Продажа на CEX после свапа на ограниченном числе потоков
+        self.unwind_pipeline = UnwindPipeline(
+            {
+                "deposit": self.binance_wait_for_deposit_confirmation,
+                "sell": self.binance_sell_token,
+                "buy_base": self.binance_buy_network_base_token,
+                "withdraw": self.binance_withdraw_network_base_token,
+            },
+            on_finished=self.on_unwind_finished,
+            filename=UNWIND_JOBS_FILE.format(network=self.network),
+        )
 
         # Проверяем совместимость с Binance
         if not self.check_cex_compatibility():
-            logger.error(f"Symbol check failed!")
+            logger.error("Symbol check failed!")
             time.sleep(INFINITE)
         else:
-            logger.info(f"Symbol check is successful.")
+            logger.info("Symbol check is successful.")
 
-    class ThreadWithErrorHandling(threading.Thread):
-        # Этот класс нужен, чтобы обрабатывать ошибки и исключения внутри thread
-        def run(self):
-            try:
-                self._target(*self._args, **self._kwargs)
-            except Exception as e:
-                logger.error(f"Error in CEX selling thread: {str(e)}")
-                logger.error(traceback.format_exc())
-                send_message(f"Error in CEX selling: {str(e)}")
+    def init_scanning(self, book_ticker_cache=None, order_books=None, recorder=None):
+        """
+        Состояние, которым пользуется arbitrage(). Вызывается из __init__ и из
+        ShardScanner, у которого нет кошелька и продажи на CEX, поэтому все
+        новое для скана создается здесь. До вызова нужны network, tokens, cex,
+        cex_client, exchange_info и balance_ledger. book_ticker_cache и
+        order_books передаются, если цены и стаканы общие с другим процессом.
+        """
+        # Инициализация Web3 для сети
+        self.w3 = initialize_web3(self.network)
 
-    def start(self, test_mode=True):
-        self.running = True
+        # Инициализация клиента LFG DEX
+        self.lfg_client = LFGclient(self.w3, self.network)
 
-        # Обновление балансов в отдельном потоке
-        update_balances = threading.Thread(target=self.update_balance, args=())
-        update_balances.start()
-        time.sleep(1)
+        # Офчейн копия состояния LB пар из котировок
+        self.lb_simulator = LBSimulator(self.lfg_client)
+
+        # Подбор размера свапа по ожидаемому профиту
+        self.size_optimizer = SizeOptimizer(
+            self.network, self.exchange_info, self.lfg_client.fee_oracle
+        )
+
+        # Маршруты свапа до нескольких хопов, ищутся в фоне
+        self.route_graph = RouteGraph(self.lfg_client, self.network, self.tokens)
+        self.last_cex_prices = {}
+
+        # Кэш лучших цен и стаканы Binance из websocket. Запускаются в start()
+        self.cex_symbols = [
+            f"{token}USDT"
+            for token in self.tokens + [constants.network_base_token[self.network]]
+        ]
+        self.recorder = recorder
+        self.book_ticker_cache = book_ticker_cache or BookTickerCache(
+            self.cex_symbols, recorder=recorder
+        )
+        self.order_books = order_books or OrderBookMirror(
+            self.cex_client, self.cex_symbols
+        )
+
+        # Векторный скоринг возможностей по всем токенам и CEX
+        self.scorer = OpportunityScorer(self.tokens, [self.cex])
+
+        # Записи котировок и возможностей по токенам, общие для всех сканов
+        self.scan_buffer = ScanBuffer(self.tokens, self.network)
 
-        # Запуск функции мониторинга депозитов
-        self.start_deposit_monitoring()
+    def start(self, test_mode=True, block_driven=True):
+        self.running = True
+        self.start_services(test_mode)
+
+        # Один скан на каждый новый блок Avalanche
+        if block_driven:
+            self.block_scheduler = BlockScheduler(
+                self.w3, lambda block_number: self.arbitrage(test_mode=test_mode)
+            )
+            self.block_scheduler.start()
+            return
 
         while self.running:
             try:
                 self.arbitrage(test_mode=test_mode)
+                time.sleep(constants.scan_interval)
             except Exception as e:
                 logger.error(e)
                 logger.error(traceback.format_exc())
                 time.sleep(2)
 
-    def arbitrage(self, test_mode):
-        # Сохраняем данные по бирже (депозиты, доступные сети). Обновляется только если предыдущие данные старше 60 секунд (указано в конфиге)
-        self.save_exchange_info()
+    def start_services(self, test_mode=True, scanning=True):
+        # Фоновые потоки движка. scanning=False - движок только исполняет
+        # сделки (шардированный режим), маршруты ищут процессы-сканеры.
 
+        # Обновление балансов в отдельном потоке
+        self.balance_ledger.start()
+        update_balances = threading.Thread(target=self.update_balance, args=())
+        update_balances.start()
+        time.sleep(1)
+
+        # Ожидание депозитов и незавершенные продажи прошлого запуска
+        self.deposit_matcher.start()
+        self.unwind_pipeline.start()
+
+        self.exchange_info.start()
+        self.sell_executor.load_filters(self.cex_symbols)
+        self.book_ticker_cache.start()
+        self.order_books.start()
+        self.lfg_client.fee_oracle.start()
+        self.confirmation_watcher.start()
+        if scanning:
+            self.route_graph.start()
+            # Состояние LB пар нужно только для back-run по мемпулу
+            if constants.mempool_watcher:
+                self.lb_simulator.start()
+                self.mempool_watcher.start(test_mode)
+
+    def arbitrage(self, test_mode):
         # Получаем цены CEX
         cex_prices = self.get_cex_prices()
 
-        # Получаем цены AMM
-        amm_prices = self.get_amm_prices()
+        # Получаем цены AMM с размером свапа под цены CEX
+        amm_prices = self.get_amm_prices(cex_prices)
+
+        self.handle_prices(cex_prices, amm_prices, test_mode)
 
-        # Ищем токен для арбитража
-        arbitrage_token = find_best_arbitrage_opportunity(cex_prices, amm_prices)
+    def handle_prices(self, cex_prices, amm_prices, test_mode):
+        # Новые маршруты и размеры кодируем в фоне, чтобы на сделке только подписать
+        self.prepare_swap_templates(amm_prices)
+        self.mempool_watcher.publish(amm_prices)
 
-        if not arbitrage_token:
-            time.sleep(1)
+        # Сравниваем с ценой, по которой реально продадим выход свапа, а не с лучшим бидом
+        cex_prices = self.get_realizable_cex_prices(cex_prices, amm_prices)
+
+        # Ищем токены для арбитража, по убыванию разницы цен
+        opportunities = self.scorer.rank_opportunities(cex_prices, amm_prices)
+        self.handle_opportunities(opportunities, cex_prices, test_mode)
+
+    def handle_opportunities(self, opportunities, cex_prices, test_mode):
+        # Решение по ранжированному списку возможностей: лог, лимиты, сделки
+        if not opportunities:
             return
+        arbitrage_token = opportunities[0]
 
         # Логгируем и отправляем сообщение в телеграм
-        difference = round(arbitrage_token["arbitrage_details"]["difference"] * 100, 1)
+        difference = round(arbitrage_token.difference * 100, 1)
         logger.warning(
-            f'Token found: {arbitrage_token["token_name"]}. Difference: {difference}%.'
+            f"Token found: {arbitrage_token.token_name}. Difference: {difference}%."
+        )
+        send_message_async(
+            f"Token found: #{arbitrage_token.token_name}. Difference: {difference}%."
         )
-        threading.Thread(
-            target=send_message(
-                f'Token found: #{arbitrage_token["token_name"]}. Difference: {difference}%.'
-            )
-        ).start()
 
         if test_mode:
             time.sleep(10)
             return
 
-        # Покупаем. Возвращает tx_hash в случае успеха и None в случае неудачи.
-        tx_hash = self.make_trade(arbitrage_token)
-        if not tx_hash:
+        # Продажи на CEX не успевают, новые позиции не открываем
+        if not self.unwind_pipeline.has_capacity():
+            logger.warning(
+                f"Unwind pipeline is full: {self.unwind_pipeline.get_queue_sizes()}."
+            )
             return
 
-        # Запускаем в отдельном потоке продажу на CEX (с обработкой исключений)
-        sell_on_cex = self.ThreadWithErrorHandling(
-            target=self.sell_on_cex, args=(tx_hash, self.cex)
-        )
-        sell_on_cex.start()
+        # Покупаем все, что помещается в баланс и лимиты. Ждем только отправки,
+        # продажа на CEX запустится из on_swap_confirmed после подтверждения.
+        self.execution_scheduler.execute(opportunities, cex_prices[self.cex])
 
-    def save_exchange_info(self):
-        """
-        Сохраняем данные по бирже, проверяем чтобы не старше 60 секунд.
-        """
-        try:
-            with open(f"data/{self.cex}_exchange_info.json", "r") as file:
-                data = json.load(file)
-                is_data_old = data["timestamp"] < time.time() - constants.data_is_old
-        except FileNotFoundError:
-            is_data_old = True
-
-        if is_data_old:
-            data = self.cex_client.get_all_coins_info()
-            data = convert_format(data, self.cex)
-            with open(f"data/{self.cex}_exchange_info.json", "w") as file:
-                json.dump({"timestamp": time.time(), "data": data}, file)
+    def on_backrun(self, opportunity):
+        # Back-run из mempool_watcher: тот же путь, что и у сделок скана
+        if not self.unwind_pipeline.has_capacity():
+            logger.warning("Unwind pipeline is full. Back-run skipped.")
+            return
+        self.execution_scheduler.execute([opportunity], self.get_cex_prices()[self.cex])
 
     def check_cex_compatibility(self):
         # Проверяем, есть ли токены на Binance
@@ -173,8 +310,15 @@ class AmmArbitrageLFG:
         return [item["symbol"] for item in data]
 
     def get_cex_prices(self):
-        # Получаем цены с Binance для нужных токенов
-        tickers = self.cex_client.get_orderbook_tickers()
+        # Получаем цены с Binance для нужных токенов. Сначала из websocket-кэша,
+        # если он устарел - полным запросом по REST
+        tickers = self.book_ticker_cache.get_tickers()
+        if tickers is None:
+            logger.debug("Book ticker stream is stale. Falling back to REST.")
+            tickers = self.cex_client.get_orderbook_tickers()
+        return self.format_cex_prices(tickers)
+
+    def format_cex_prices(self, tickers):
         tickers = {item["symbol"]: item for item in tickers}
 
         prices = {}
@@ -184,25 +328,112 @@ class AmmArbitrageLFG:
                 prices[token] = float(tickers[symbol]["bidPrice"])
             else:
                 logger.warning(f"Symbol {symbol} not found on Binance.")
+        self.last_cex_prices = prices
         return {self.cex: prices}
 
-    def get_amm_prices(self):
-        # Получаем цены с LFG DEX
+    def get_amm_prices(self, cex_prices):
+        # Котируем все токены и размеры одним eth_call и выбираем размер по профиту
+        return self.select_amm_prices(self.get_amm_quotes(), cex_prices)
+
+    def get_amm_quotes(self):
+        # {token: [(amount_in, quote), ...]} по всем кандидатам размера, одним Multicall3
+        requests = self.get_quote_requests()
+        if not requests:
+            logger.error("Not enough balance to perform swaps.")
+            return {}
+
+        quotes = self.lfg_client.get_best_paths_from_amount_in(
+            [(token_path, amount_in) for _, token_path, amount_in in requests],
+            self.scan_buffer.get_quotes([token for token, _, _ in requests]),
+        )
+        return self.group_quotes(requests, quotes)
+
+    def get_quote_requests(self):
+        # Список (token, token_path, amount_in) по всем токенам и размерам
+        balance = (
+            self.balance_ledger.available()
+            - constants.min_balance_for_gas[self.network]
+        )
+        sizes = self.size_optimizer.get_candidate_sizes(balance)
+        return [
+            (token, self.get_token_path(token), amount_in)
+            for token in self.tokens
+            for amount_in in sizes
+        ]
+
+    def group_quotes(self, requests, quotes):
+        amm_quotes = {}
+        for (token, _, amount_in), quote in zip(requests, quotes):
+            if quote is None:
+                logger.warning(f"LFG quote for {token} ({amount_in}) failed.")
+                continue
+            amm_quotes.setdefault(token, []).append((amount_in, quote))
+        if self.lb_simulator.running:
+            self.lb_simulator.on_scan([quote for quote in quotes if quote is not None])
+        if self.recorder is not None:
+            self.recorder.record_quotes(amm_quotes)
+        return amm_quotes
+
+    def select_amm_prices(self, amm_quotes, cex_prices):
         amm_prices = {}
-        for token in self.tokens:
-            price_data = self.get_lfg_price(token)
+        for token, candidates in amm_quotes.items():
+            amount_in, quote, profit = self.size_optimizer.select(
+                token, candidates, cex_prices[self.cex], self.get_cex_sell_price
+            )
+            price_data = self.build_price_data(token, amount_in, quote)
+            price_data.candidates = candidates
+            price_data.expected_profit = profit
             amm_prices[token] = price_data
         return amm_prices
 
+    def get_realizable_cex_prices(self, cex_prices, amm_prices):
+        prices = dict(cex_prices[self.cex])
+        for token, price_data in amm_prices.items():
+            if token in prices:
+                quantity = price_data.quote.amount_out / 10**18
+                prices[token] = self.get_cex_sell_price(token, quantity)
+        return {**cex_prices, self.cex: prices}
+
+    def get_cex_sell_price(self, token, quantity):
+        # Средняя цена продажи quantity токенов по локальному стакану
+        book = self.order_books.get_book(f"{token}USDT")
+        sell_price = book.get_sell_price(quantity) if book else None
+        if sell_price is not None:
+            return sell_price
+
+        # Стакан еще не синхронизирован: лучший бид на объем bidQty,
+        # остаток оцениваем с дисконтом
+        ticker = self.book_ticker_cache.get_snapshot().get(f"{token}USDT")
+        if ticker is None or quantity <= 0:
+            return self.last_cex_prices.get(token, 0)
+        if quantity <= ticker.bid_qty:
+            return ticker.bid_price
+        beyond_price = ticker.bid_price * (1 - constants.beyond_top_of_book_discount)
+        return (
+            ticker.bid_price * ticker.bid_qty
+            + beyond_price * (quantity - ticker.bid_qty)
+        ) / quantity
+
     def get_lfg_price(self, token):
         # Получаем цену с LFG DEX
-        token_address = constants.chain[self.network][token]
-        wavax_address = constants.chain[self.network]["WAVAX"]
+        amount_in = self.get_swap_amount_in()
+
+        if amount_in <= 0:
+            logger.error(f"Not enough balance to perform swap for {token}.")
+            return None
+
+        token_path = self.get_token_path(token)
+        quote = self.lfg_client.get_best_path_from_amount_in(token_path, amount_in)
+
+        return self.build_price_data(token, amount_in, quote)
+
+    def get_swap_amount_in(self):
+        # Размер свапа в wei: swap_size из конфига, но не больше баланса за вычетом газа
         balance = (
-            self.get_balance_from_file(self.network)
+            self.balance_ledger.available()
             - constants.min_balance_for_gas[self.network]
         )
-        amount_in = int(
+        return int(
             min(
                 constants.chain[self.network]["swap_size"],
                 balance,
@@ -210,206 +441,231 @@ class AmmArbitrageLFG:
             * 10**18
         )
 
-        if amount_in <= 0:
-            logger.error(f"Not enough balance to perform swap for {token}.")
-            return None
-
-        token_path = [wavax_address, token_address]
-        quote = self.lfg_client.get_best_path_from_amount_in(token_path, amount_in)
+    def get_token_path(self, token):
+        # Лучший найденный маршрут из кэша route_graph, до первой находки -
+        # настроенный route или прямой путь
+        return self.route_graph.get_path(token)
 
-        amount_out = quote["amounts"][-1]
-        price = amount_in / amount_out
-
-        return {
-            "price": price,
-            "network": self.network,
-            "data": {
-                "amount_in": amount_in,
-                "quote": quote,
-                "token_address": token_address,
-            },
-        }
+    def build_price_data(self, token, amount_in, quote):
+        # Запись токена из scan_buffer, перезаписывается каждый скан
+        return self.scan_buffer.get_opportunity(token).set_quote(amount_in, quote)
 
-    def make_trade(self, arbitrage_token):
+    def make_trade(self, arbitrage_token, position_id=None):
         # Получаем название токена
-        token_name = arbitrage_token["token_name"]
-        token_data = arbitrage_token["arbitrage_details"]["data"]
+        token_name = arbitrage_token.token_name
 
         # Получаем адрес токена
-        token_address = token_data["token_address"]
+        token_address = arbitrage_token.token_address
 
         # Получаем количество для свапа
-        amount_in = token_data["amount_in"]
+        amount_in = arbitrage_token.amount_in
 
         # Получаем recipient
         recipient = os.environ.get("BINANCE_DEPOSIT_ADDRESS")
 
-        # Выполняем свап
-        tx_receipt = self.swap_on_lfg(
-            amount_in=amount_in,
-            token_address=token_address,
-            recipient=recipient,
-            slippage_percent=constants.slippage * 100,  # Преобразуем в проценты
-        )
+        # Резервируем баланс под свап, чтобы параллельно его никто не потратил
+        reservation_id = self.balance_ledger.reserve(amount_in / 10**18)
+        if reservation_id is None:
+            logger.error(f"Not enough balance to reserve for {token_name}.")
+            return None
 
-        if tx_receipt and tx_receipt.status == 1:
-            # Обновляем баланс после успешного свапа
-            self.manual_update_balance(
-                self.network,
-                -amount_in / 10**18 + constants.min_balance_for_gas[self.network],
-            )
-            tx_hash = tx_receipt.transactionHash.hex()
-            logger.info(
-                f"Swap successful. TX: {constants.explorer[self.network]}/tx/{tx_hash}"
-            )
-            send_message(
-                f"Swap successful. TX: {constants.explorer[self.network]}/tx/{tx_hash}",
-                message_type="swap",
+        # Отправляем свап, квитанцию ждет confirmation_watcher
+        try:
+            tx_hash = self.swap_on_lfg(
+                amount_in=amount_in,
+                token_address=token_address,
+                recipient=recipient,
+                slippage_percent=constants.slippage * 100,  # Преобразуем в проценты
+                quote=arbitrage_token.quote,
             )
-            return tx_hash
-        else:
-            logger.error("Swap failed.")
+        except Exception as e:
+            self.balance_ledger.release(reservation_id)
+            logger.error(f"Swap failed: {e}")
             return None
 
+        logger.info(f"Swap sent. TX: {tx_hash}")
+        self.confirmation_watcher.watch(
+            tx_hash,
+            on_confirmed=lambda receipt: self.on_swap_confirmed(
+                receipt, reservation_id, amount_in, position_id
+            ),
+            on_failed=lambda receipt: self.on_swap_failed(
+                tx_hash, receipt, reservation_id, position_id
+            ),
+        )
+        return tx_hash
+
+    def on_swap_confirmed(
+        self, tx_receipt, reservation_id, amount_in, position_id=None
+    ):
+        # Списываем резерв после успешного свапа
+        self.balance_ledger.commit(reservation_id)
+        tx_hash = tx_receipt.transactionHash.hex()
+        logger.info(
+            f"Swap successful. TX: {constants.explorer[self.network]}/tx/{tx_hash}"
+        )
+        send_message_async(
+            f"Swap successful. TX: {constants.explorer[self.network]}/tx/{tx_hash}",
+            message_type="swap",
+        )
+
+        # Продажа на CEX. Не блокирует: при полной очереди джоб ждет в пайплайне
+        self.unwind_pipeline.submit(
+            tx_hash, amount_in, cex=self.cex, position_id=position_id
+        )
+
+    def on_swap_failed(self, tx_hash, tx_receipt, reservation_id, position_id=None):
+        self.balance_ledger.release(reservation_id)
+        self.execution_scheduler.close_position(position_id)
+        if tx_receipt is None:
+            # Транзакция потерялась, nonce мог остаться неиспользованным
+            self.lfg_client.nonce_manager.resync()
+        logger.error(f"Swap failed. TX: {tx_hash}")
+
+    def prepare_swap_templates(self, amm_prices):
+        recipient = os.environ.get("BINANCE_DEPOSIT_ADDRESS")
+        # Котировки копируем: записи буфера перезапишет следующий скан
+        missing = [
+            (price_data.amount_in, price_data.quote.copy())
+            for price_data in amm_prices.values()
+            if not self.lfg_client.swap_templates.has_template(
+                price_data.quote.route,
+                price_data.quote.bin_steps,
+                price_data.quote.versions,
+                price_data.amount_in,
+                recipient,
+            )
+        ]
+        if missing:
+            threading.Thread(
+                target=self.lfg_client.swap_templates.prepare,
+                args=(missing, recipient),
+                daemon=True,
+            ).start()
+
     def swap_on_lfg(
         self,
         amount_in: int,
         token_address: str,
         recipient: str,
         slippage_percent: float,
+        quote=None,
     ):
-        # Выполняем свап на LFG DEX
-        tx_receipt = self.lfg_client.swap_exact_avax_for_tokens(
+        # Отправляем свап на LFG DEX, возвращает tx_hash
+        return self.lfg_client.swap_exact_avax_for_tokens(
             amount_in_wei=amount_in,
             token_address=token_address,
             slippage_percent=slippage_percent,
             recipient=recipient,
+            quote=quote,
         )
-        return tx_receipt
-
-    def sell_on_cex(self, tx_hash, cex):
-        # Ждем депозита на Binance и продаем токены
-        token_name, deposit_amount = self.binance_wait_for_deposit_confirmation(tx_hash)
-        if not token_name:
-            return
 
-        # Продаем токены
-        self.binance_sell_token(token_name, deposit_amount, tx_hash)
+    def on_unwind_finished(self, job, success):
+        # Позиция закрыта, лимит экспозиции освобождается
+        self.execution_scheduler.close_position(job.get("position_id"))
+
+    def binance_wait_for_deposit_confirmation(self, job):
+        # Стадия deposit. Пока депозита нет, возвращаем Future из deposit_matcher:
+        # пайплайн вернет джоб в стадию, когда он завершится.
+        tx_hash = job["tx_hash"]
+        future = self.deposit_matcher.watch(
+            tx_hash,
+            since=job["created_at"],
+            timeout=job["created_at"] + constants.deposit_timeout - time.time(),
+        )
+        if not future.done():
+            return future
 
-    def binance_wait_for_deposit_confirmation(self, tx_hash):
-        # Ожидаем подтверждения депозита на Binance
-        start_time = time.time()
-        logger.info(f"Waiting for binance deposit. TX: {tx_hash}")
+        try:
+            deposit = future.result()
+        except DepositTimeout:
+            logger.error(f"Deposit didn't arrive. TX: {tx_hash}")
+            return False
 
-        # Добавляем хеш в файл
-        self.update_tx_hashes_file(cex_name="binance", tx_hash=tx_hash, add=True)
+        job["token"] = deposit["coin"]
+        job["quantity"] = float(deposit["amount"])
+        logger.info(
+            f'Deposit arrived. Token: {job["token"]}. Amount: {job["quantity"]}. TX: {tx_hash}'
+        )
+        send_message_async(f"Deposit arrived. TX: #{tx_hash[:8]}.")
+        return True
+
+    def binance_sell_token(self, job):
+        # Стадия sell: продаем пришедшие токены за USDT частями по стакану,
+        # выручку частей сразу тратим на базовый токен. Прогресс пишется в job
+        # после каждого ордера, после рестарта продается только остаток.
+        token, tx_hash = job["token"], job["tx_hash"]
+        network_base_token = constants.network_base_token[self.network]
+        sold_before = job.setdefault("sold_qty", 0)
+        totals_before = {field: job.setdefault(field, 0) for field in SELL_TOTALS}
 
-        filename = "data/binance_deposit_history.json"
-        while True:
-            if not os.path.exists(filename):
-                deposit_history = []
-            else:
-                with open(filename, "r") as file:
-                    deposit_history = json.load(file)
-
-            # Поиск депозита по хешу транзакции
-            for deposit in deposit_history:
-                if deposit["txId"] == tx_hash and deposit["status"] == 1:
-                    token = deposit["coin"]
-                    amount = float(deposit["amount"])
-                    logger.info(
-                        f"Deposit arrived. Token: {token}. Amount: {amount}. TX: {tx_hash}"
-                    )
-                    self.update_tx_hashes_file(
-                        cex_name="binance", tx_hash=tx_hash, add=False
-                    )
-                    send_message(f"Deposit arrived. TX: #{tx_hash[:8]}.")
-                    return token, amount
-
-            # Проверка, не прошел ли час с начала ожидания
-            if time.time() - start_time > 3600:
-                # Удаляем хеш из файла
-                self.update_tx_hashes_file(
-                    cex_name="binance", tx_hash=tx_hash, add=False
-                )
-                return None, None
-
-            # Пауза перед следующим запросом
-            time.sleep(2)
-
-    def binance_sell_token(self, token, quantity, tx_hash):
-        # Получение знаков после запятой для количества токена
-        precision = self.binance_get_asset_precision(f"{token}USDT")
-        logger.info(f"Token: {token}. Precision: {precision}")
-        if precision is None:
-            logger.error("Не удалось получить точность токена.")
-            return
+        def on_progress(result):
+            job["sold_qty"] = sold_before + result["sold"]
+            for field in SELL_TOTALS:
+                job[field] = totals_before[field] + result[field]
+            self.unwind_pipeline.save_jobs()
 
-        # Форматирование количества с учетом точности
-        part_quantity = round(quantity / 3 - 1 / 10**precision, precision)
-        logger.info(f"Token: {token}. Quantity: {quantity}. Part: {part_quantity}")
+        try:
+            self.sell_executor.sell(
+                f"{token}USDT",
+                job["quantity"] - sold_before,
+                rebuy_symbol=f"{network_base_token}USDT",
+                on_progress=on_progress,
+            )
+        except BinanceAPIException as e:
+            logger.error(f"Error when sent the market order: {e}")
+            return False
 
-        fills = []
-        for _ in range(3):
-            try:
-                # Создание маркет ордера на продажу
-                order = self.cex_client.order_market_sell(
-                    symbol=f"{token}USDT", quantity=part_quantity
-                )
-                fills.extend(order["fills"])
-                logger.info(f"The market order sent: {order}")
-            except BinanceAPIException as e:
-                logger.error(f"Error when sent the market order: {e}")
-                return
-
-            # Интервал между ордерами
-            time.sleep(1)
-
-        # Расчитываем сколько USDT получили
-        total_usdt = round(
-            sum(float(fill["price"]) * float(fill["qty"]) for fill in fills) - 0.1, 1
-        )
+        # Сколько USDT получили и сколько из них уже потратили на базовый токен
+        total_usdt = floor_usdt(job["total_usdt"])
         logger.info(f"Total: {total_usdt} USDT. TX: {tx_hash}")
-        send_message(f"Total: {total_usdt} #USDT. TX: #{tx_hash[:8]}")
+        send_message_async(f"Total: {total_usdt} #USDT. TX: #{tx_hash[:8]}")
+        return True
 
-        # Покупаем AVAX для последующего вывода
+    def binance_buy_network_base_token(self, job):
+        # Стадия buy_base: докупаем AVAX на выручку, не потраченную при продаже
+        tx_hash = job["tx_hash"]
         network_base_token = constants.network_base_token[self.network]
-        order = self.cex_client.order_market_buy(
-            symbol=f"{network_base_token}USDT", quoteOrderQty=total_usdt
-        )
-
-        logger.info(f"The market order sent: {order}")
-
-        # Всего куплено AVAX
-        total_bought_network_base_token = sum(
-            float(fill["qty"]) for fill in order["fills"]
+        symbol = f"{network_base_token}USDT"
+
+        # Вниз до центов и с запасом: округление вверх просит больше USDT,
+        # чем есть на балансе, и покупка падает
+        leftover = floor_usdt(
+            job["total_usdt"]
+            - job.get("rebought_usdt", 0)
+            - constants.rebuy_usdt_buffer
         )
+        if leftover > 0 and self.sell_executor.can_buy(symbol, leftover):
+            spent, bought = self.sell_executor.buy(symbol, leftover)
+            job["rebought_usdt"] = job.get("rebought_usdt", 0) + spent
+            job["bought"] = job.get("bought", 0) + bought
 
         # Считаем профит и логгируем
-        profit = round(
-            total_bought_network_base_token
-            - constants.chain[self.network]["swap_size"],
-            3,
-        )
+        profit = round(job.get("bought", 0) - job["amount_in"] / 10**18, 3)
 
         logger.info(f"Profit: {profit} {network_base_token}. TX: {tx_hash}")
-        send_message(f"Profit: {profit} #{network_base_token}. TX: #{tx_hash[:8]}")
+        send_message_async(
+            f"Profit: {profit} #{network_base_token}. TX: #{tx_hash[:8]}"
+        )
+        return True
 
-        time.sleep(1)
-        # Выводим AVAX с Binance
+    def binance_withdraw_network_base_token(self, job):
+        # Стадия withdraw: выводим AVAX с Binance, если набралось больше минимума
+        network_base_token = constants.network_base_token[self.network]
         network_base_token_balance = float(
             self.cex_client.get_asset_balance(network_base_token)["free"]
         )
         if network_base_token_balance > constants.min_withdraw[network_base_token]:
             self.binance_withdraw(
-                network_base_token, network_base_token_balance, tx_hash
+                network_base_token, network_base_token_balance, job["tx_hash"]
             )
+        return True
 
     def binance_withdraw(self, network_base_token, network_base_token_balance, tx_hash):
         # Получаем название сети на Binance и выводим
         binance_network_name = constants.cex_network_map[self.network]
-        withdrawal_fee = get_withdrawal_fee(
-            network_base_token, binance_network_name, "binance"
+        withdrawal_fee = self.exchange_info.get_withdrawal_fee(
+            network_base_token, binance_network_name
         )
         withdraw_amount = round(
             network_base_token_balance - withdrawal_fee - 1 / 10**WITHDRAW_PRECISION,
@@ -427,138 +683,25 @@ class AmmArbitrageLFG:
         logger.info(
             f"{network_base_token_balance} {network_base_token} withdrawn from Binance. TX: {tx_hash}"
         )
-        send_message(
+        send_message_async(
             f"{network_base_token_balance} #{network_base_token} withdrawn from #Binance. TX: #{tx_hash[:8]}"
         )
 
     def update_balance(self):
         while True:
             try:
+                version = self.balance_ledger.get_version()
                 balance = self.w3.eth.get_balance(self.account.address)
                 balance_in_eth = round(float(self.w3.from_wei(balance, "ether")), 3)
-                self.write_balance_to_file(self.network, balance_in_eth)
+                if self.balance_ledger.sync(balance_in_eth, version):
+                    GREEN = "\033[32m"
+                    RESET = "\033[0m"  # Сброс цвета в конце
+                    logger.info(f"{GREEN}Balance for {self.network} updated.{RESET}")
+                else:
+                    # Пока идет свап, баланс в сети неактуален. Пробуем позже.
+                    time.sleep(constants.balance_sync_retry_delay)
+                    continue
             except Exception as e:
                 logger.error(f"Error updating balance for {self.network}: {e}")
 
-            time.sleep(600)  # Задержка 10 минут
-
-    @staticmethod
-    def write_balance_to_file(network, balance):
-        filename = f"data/prices/{constants.network_base_token[network].lower()}_{network}.json"
-        with open(filename, "w") as file:
-            json.dump({"timestamp": time.time(), "balance": balance}, file)
-
-        GREEN = "\033[32m"
-        RESET = "\033[0m"  # Сброс цвета в конце
-        logger.info(f"{GREEN}Balance for {network} updated.{RESET}")
-
-    def manual_update_balance(self, network, balance_change):
-        try:
-            # Чтение текущего баланса из файла
-            filename = f"data/prices/{constants.network_base_token[network].lower()}_{network}.json"
-            with open(filename, "r") as file:
-                data = json.load(file)
-                current_balance = data.get("balance", 0)
-
-            # Обновление баланса
-            new_balance = current_balance + balance_change
-
-            # Запись обновленного баланса обратно в файл
-            self.write_balance_to_file(network, new_balance)
-            logger.info(f"Balance updated. New balance: {new_balance}")
-
-        except FileNotFoundError:
-            logger.error(
-                f"Balance file for {network} not found. Creating a new one with the balance change."
-            )
-            self.write_balance_to_file(network, balance_change)
-        except Exception as e:
-            logger.error(f"Error during manual balance update for {network}: {e}")
-
-    def get_balance_from_file(self, network):
-        try:
-            # Формирование пути к файлу
-            filename = f"data/prices/{constants.network_base_token[network].lower()}_{network}.json"
-
-            # Чтение данных из файла
-            with open(filename, "r") as file:
-                data = json.load(file)
-                return data.get("balance", 0)
-
-        except FileNotFoundError:
-            logger.error(f"Balance file for {network} not found.")
-            return 0
-        except Exception as e:
-            logger.error(f"Error reading balance for {network}: {e}")
-            return 0
-
-    def binance_deposit_monitoring(self):
-        while True:
-            # Чтение файла с ожидающими депозитами
-            waiting_deposits_filename = "data/binance_waiting_deposits.json"
-            if not os.path.exists(waiting_deposits_filename):
-                # Если файла нет, значит еще не было трейдов никогда.
-                waiting_deposits = []
-            else:
-                with open(waiting_deposits_filename, "r") as file:
-                    waiting_deposits = json.load(file)
-
-            # Если в файле есть данные, делаем запрос к API
-            if waiting_deposits:
-                try:
-                    deposit_history = self.cex_client.get_deposit_history()
-
-                    # Запись истории депозитов в файл
-                    with open("data/binance_deposit_history.json", "w") as file:
-                        json.dump(deposit_history, file)
-
-                except Exception as e:
-                    print(f"Ошибка при запросе к API Binance: {e}")
-
-            # Задержка перед следующим проверкой
-            time.sleep(5)  # Проверка каждые 5 секунд
-
-    @staticmethod
-    def update_tx_hashes_file(cex_name, tx_hash, add=True):
-        global file_lock
-        filename = f"data/{cex_name}_waiting_deposits.json"
-
-        with file_lock:
-            # Проверка существования файла и его создание, если он отсутствует
-            if not os.path.exists(filename):
-                with open(filename, "w") as file:
-                    json.dump([], file)
-
-            # Чтение текущих данных из файла
-            with open(filename, "r") as file:
-                tx_hashes = json.load(file)
-
-            # Обновление списка хешей
-            if add:
-                if tx_hash not in tx_hashes:
-                    tx_hashes.append(tx_hash)
-            else:
-                if tx_hash in tx_hashes:
-                    tx_hashes.remove(tx_hash)
-
-            # Запись обновленного списка обратно в файл
-            with open(filename, "w") as file:
-                json.dump(tx_hashes, file)
-
-    def start_deposit_monitoring(self):
-        # Создаем новый файл с пустыми ожидающими депозитами
-        with open(BINANCE_WAITING_DEPOSITS_FILE, "w") as file:
-            json.dump([], file)
-
-        binance_deposit_monitoring = threading.Thread(
-            target=self.binance_deposit_monitoring, args=()
-        )
-        binance_deposit_monitoring.start()
-
-    def binance_get_asset_precision(self, symbol):
-        try:
-            info = self.cex_client.get_symbol_info(symbol)
-            return info["filters"][1]["stepSize"].find("1") - 1
-        except BinanceAPIException as e:
-            logger.error(f"Ошибка при получении информации о символе: {e}")
-            return None
+            time.sleep(constants.balance_sync_interval)
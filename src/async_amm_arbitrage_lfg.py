@@ -0,0 +1,156 @@
+import asyncio
+import time
+import traceback
+from collections import deque
+
+from loguru import logger
+
+from amm_arbitrage_lfg import AmmArbitrageLFG
+from helpful_functions import initialize_async_web3
+from config import constants
+
+
+class AsyncAmmArbitrageLFG(AmmArbitrageLFG):
+    """
+    Асинхронный вариант AmmArbitrageLFG. В каждом цикле тикеры Binance и котировки
+    LFG запрашиваются одновременно, у каждой стадии свой таймаут, а задержки стадий
+    сохраняются в stage_latencies. Исполнение сделок и продажа на CEX остаются
+    синхронными и выполняются в отдельных потоках. REST Binance идет через тот
+    же BinanceScheduler, что и у синхронного движка, чтобы вес учитывался в
+    общем WeightBudget.
+    """
+
+    STAGES = ("cex", "amm", "decision")
+
+    def __init__(
+        self,
+        tokens_to_arbitrage: list,
+        network="avalanche",
+        book_ticker_cache=None,
+        weight_budget=None,
+    ) -> None:
+        super().__init__(tokens_to_arbitrage, network, book_ticker_cache, weight_budget)
+
+        self.async_w3 = initialize_async_web3(self.network)
+        self.async_multicall = self.async_w3.eth.contract(
+            address=self.lfg_client.multicall.address,
+            abi=self.lfg_client.multicall_abi,
+        )
+
+        self.stage_latencies = {
+            stage: deque(maxlen=constants.stage_latency_window)
+            for stage in self.STAGES
+        }
+        self.last_cycle_latency = {}
+
+    def start(self, test_mode=True, block_driven=True):
+        asyncio.run(self.run(test_mode=test_mode, block_driven=block_driven))
+
+    async def run(self, test_mode=True, block_driven=True):
+        self.running = True
+
+        # Те же фоновые потоки, что и у синхронного движка. Запуск делает
+        # блокирующие запросы, поэтому не в event loop
+        await asyncio.to_thread(self.start_services, test_mode)
+
+        last_block_number = None
+        while self.running:
+            try:
+                if block_driven:
+                    block_number = await self.async_w3.eth.block_number
+                    if block_number == last_block_number:
+                        await asyncio.sleep(constants.block_poll_interval)
+                        continue
+                    last_block_number = block_number
+
+                await self.async_arbitrage(test_mode=test_mode)
+
+                if not block_driven:
+                    await asyncio.sleep(constants.scan_interval)
+            except Exception as e:
+                logger.error(e)
+                logger.error(traceback.format_exc())
+                await asyncio.sleep(2)
+
+    async def async_arbitrage(self, test_mode):
+        # Цены CEX и котировки AMM запрашиваются одновременно
+        cex_prices, amm_quotes = await asyncio.gather(
+            self.run_stage("cex", self.async_get_cex_prices()),
+            self.run_stage("amm", self.async_get_amm_quotes()),
+        )
+
+        if not cex_prices or not amm_quotes:
+            return
+
+        # Размер свапа выбираем уже с ценами CEX, это локальный расчет
+        amm_prices = self.select_amm_prices(amm_quotes, cex_prices)
+
+        # Решение и исполнение блокирующие, поэтому уходят в поток
+        await self.run_stage(
+            "decision",
+            asyncio.to_thread(self.handle_prices, cex_prices, amm_prices, test_mode),
+            timeout=None,
+        )
+
+    async def run_stage(self, stage, coroutine, timeout=-1):
+        if timeout == -1:
+            timeout = constants.stage_timeout[stage]
+
+        start_time = time.perf_counter()
+        try:
+            return await asyncio.wait_for(coroutine, timeout)
+        except asyncio.TimeoutError:
+            logger.warning(f"Stage {stage} timed out after {timeout}s.")
+            return None
+        except Exception as e:
+            logger.error(f"Error in stage {stage}: {e}")
+            return None
+        finally:
+            latency = time.perf_counter() - start_time
+            self.stage_latencies[stage].append(latency)
+            self.last_cycle_latency[stage] = latency
+
+    def get_stage_latency_stats(self):
+        # p50/p99 задержки каждой стадии в секундах
+        stats = {}
+        for stage, latencies in self.stage_latencies.items():
+            if not latencies:
+                continue
+            latencies = sorted(latencies)
+            stats[stage] = {
+                "p50": latencies[len(latencies) // 2],
+                "p99": latencies[min(int(len(latencies) * 0.99), len(latencies) - 1)],
+            }
+        return stats
+
+    async def async_get_cex_prices(self):
+        tickers = self.book_ticker_cache.get_tickers()
+        if tickers is None:
+            # Через BinanceScheduler: вес учитывается, при нехватке запрос
+            # сбрасывается, а стадия вернет None
+            logger.debug("Book ticker stream is stale. Falling back to REST.")
+            tickers = await asyncio.to_thread(self.cex_client.get_orderbook_tickers)
+        return self.format_cex_prices(tickers)
+
+    async def async_get_amm_quotes(self):
+        requests = self.get_quote_requests()
+        if not requests:
+            logger.error("Not enough balance to perform swaps.")
+            return {}
+
+        # Все котировки одним aggregate3, как и в синхронной версии
+        calls = [
+            (
+                self.lfg_client.quoter.address,
+                True,
+                self.lfg_client.encode_quote_call(token_path, amount_in),
+            )
+            for _, token_path, amount_in in requests
+        ]
+        results = await self.async_multicall.functions.aggregate3(calls).call()
+        buffer = self.scan_buffer.get_quotes([token for token, _, _ in requests])
+        quotes = [
+            self.lfg_client.decode_quote_result(success, return_data, quote)
+            for (success, return_data), quote in zip(results, buffer)
+        ]
+        return self.group_quotes(requests, quotes)
@@ -0,0 +1,479 @@
+# backtest.py
+# Реплей записанных тикеров Binance и котировок LFG через логику решения.
+# Запуск: python backtest.py [папка с записью]
+
+import glob
+import os
+import sys
+import threading
+import time
+from array import array
+
+import numpy as np
+from loguru import logger
+
+from helpful_functions import (
+    find_best_arbitrage_opportunity,
+    load_min_differences,
+    DEFAULT_MIN_DIFFERENCE,
+)
+from records import Quote
+from size_optimizer import SizeOptimizer
+from config import constants
+
+TICKER_COLUMNS = ("time", "symbol", "bid_price", "bid_qty", "ask_price", "ask_qty")
+QUOTE_COLUMNS = ("time", "token", "amount_in", "amount_out")
+
+
+class TickRecorder:
+    """
+    Пишет тикеры bookTicker и котировки каждого скана в колонки (array) и
+    сбрасывает их на диск файлами npz по backtest_flush_rows строк:
+    tickers_*.npz и quotes_*.npz в directory. Символы и токены хранятся
+    в файле списком, в колонках - их индексы. Суммы в базовом токене и токенах,
+    а не в wei.
+    """
+
+    def __init__(self, directory, tokens, network):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        base_token = constants.network_base_token[network]
+        self.tokens = list(tokens)
+        self.token_index = {token: i for i, token in enumerate(self.tokens)}
+        self.symbols = [f"{token}USDT" for token in self.tokens + [base_token]]
+        self.symbol_index = {symbol: i for i, symbol in enumerate(self.symbols)}
+
+        self.lock = threading.Lock()
+        self.tickers = self.new_columns(TICKER_COLUMNS)
+        self.quotes = self.new_columns(QUOTE_COLUMNS)
+
+    @staticmethod
+    def new_columns(columns):
+        return {
+            column: array("i" if column in ("symbol", "token") else "d")
+            for column in columns
+        }
+
+    def record_ticker(self, symbol, ticker):
+        i = self.symbol_index.get(symbol)
+        if i is None:
+            return
+        with self.lock:
+            self.tickers["time"].append(ticker.timestamp)
+            self.tickers["symbol"].append(i)
+            self.tickers["bid_price"].append(ticker.bid_price)
+            self.tickers["bid_qty"].append(ticker.bid_qty)
+            self.tickers["ask_price"].append(ticker.ask_price)
+            self.tickers["ask_qty"].append(ticker.ask_qty)
+            full = len(self.tickers["time"]) >= constants.backtest_flush_rows
+        if full:
+            self.flush("tickers")
+
+    def record_quotes(self, amm_quotes):
+        # amm_quotes - {token: [(amount_in, quote), ...]} одного скана
+        timestamp = time.time()
+        with self.lock:
+            for token, candidates in amm_quotes.items():
+                for amount_in, quote in candidates:
+                    self.quotes["time"].append(timestamp)
+                    self.quotes["token"].append(self.token_index[token])
+                    self.quotes["amount_in"].append(amount_in / 10**18)
+                    self.quotes["amount_out"].append(quote.amount_out / 10**18)
+            full = len(self.quotes["time"]) >= constants.backtest_flush_rows
+        if full:
+            self.flush("quotes")
+
+    def flush(self, kind):
+        # Подменяем буфер под блокировкой, пишем на диск в фоне
+        with self.lock:
+            columns = getattr(self, kind)
+            if not columns["time"]:
+                return
+            setattr(self, kind, self.new_columns(columns))
+        threading.Thread(target=self.save, args=(kind, columns), daemon=True).start()
+
+    def save(self, kind, columns):
+        names = self.symbols if kind == "tickers" else self.tokens
+        filename = os.path.join(self.directory, f"{kind}_{int(time.time() * 1000)}.npz")
+        arrays = {
+            column: np.array(values, dtype=np.int32)
+            if values.typecode == "i"
+            else np.frombuffer(values)
+            for column, values in columns.items()
+        }
+        try:
+            np.savez(filename, names=np.array(names), **arrays)
+        except Exception as e:
+            logger.error(f"Error saving {kind} for backtest: {e}")
+
+
+def load_columns(directory, kind):
+    """
+    Склеивает все файлы kind ("tickers" или "quotes") из directory в одни
+    колонки, сортированные по времени. Индексы символов/токенов разных
+    файлов приводятся к общему списку names. Возвращает (columns, names).
+    """
+    id_column = "symbol" if kind == "tickers" else "token"
+    name_index = {}
+    parts = []
+    for filename in sorted(glob.glob(os.path.join(directory, f"{kind}_*.npz"))):
+        with np.load(filename) as data:
+            ids = np.array(
+                [
+                    name_index.setdefault(name, len(name_index))
+                    for name in data["names"].tolist()
+                ],
+                dtype=np.int32,
+            )
+            part = {column: data[column] for column in data.files if column != "names"}
+            part[id_column] = ids[part[id_column]]
+            parts.append(part)
+    names = sorted(name_index, key=name_index.get)
+
+    if not parts:
+        raise FileNotFoundError(f"No {kind} recorded in {directory}")
+    columns = {
+        column: np.concatenate([part[column] for part in parts])
+        for column in parts[0]
+    }
+    order = np.argsort(columns["time"], kind="stable")
+    return {column: values[order] for column, values in columns.items()}, names
+
+
+class FixedCosts:
+    """
+    Комиссия вывода и цена газа для реплея. Интерфейс ExchangeInfoStore и
+    FeeOracle в той части, которую использует SizeOptimizer.
+    """
+
+    def __init__(self, withdrawal_fee=None, gas_price=None):
+        if withdrawal_fee is None:
+            withdrawal_fee = constants.backtest_withdrawal_fee
+        if gas_price is None:
+            gas_price = constants.backtest_gas_price
+        self.withdrawal_fee = withdrawal_fee
+        self.gas_price = gas_price
+
+    def get_withdrawal_fee(self, currency, network):
+        return self.withdrawal_fee
+
+    def get_fees(self):
+        return self.gas_price, 0
+
+    def get_total(self):
+        # Комиссия вывода + газ свапа, в базовом токене
+        gas_cost = constants.default_swap_gas * self.gas_price / 10**18
+        return self.withdrawal_fee + gas_cost
+
+
+class Backtester:
+    """
+    Векторный реплей решений по записанным тикерам и котировкам.
+
+    Для каждой строки котировки берется последний тикер токена и базового
+    токена не позже нее (as-of через searchsorted), цена продажи считается
+    как в get_cex_sell_price без стакана: бид на bidQty, остаток с
+    дисконтом. Размер свапа - как в SizeOptimizer, решение - как в
+    find_best_arbitrage_opportunity: лучший токен скана выше порога.
+
+    Исполнение симулируется с задержкой latency: выход свапа - из первой
+    котировки того же токена и размера не раньше решения + latency; если он
+    ниже minOut, свап откатывается и теряется газ. minOut, как в make_trade,
+    считается с фиксированным constants.slippage; slippage_function(разница
+    в процентах), например calculate_slippage, заменяет его для сравнения.
+    Продажа на CEX - по тикерам через backtest_unwind_delay после свапа,
+    базовый токен докупается по аску. Баланс, лимиты экспозиции и пересечение
+    сделок не моделируются.
+    """
+
+    def __init__(
+        self,
+        tickers,
+        ticker_symbols,
+        quotes,
+        tokens,
+        network="avalanche",
+        min_differences=None,
+        slippage_function=None,
+        costs=None,
+    ):
+        self.network = network
+        self.base_token = constants.network_base_token[network]
+        self.tickers = tickers
+        self.quotes = quotes
+        self.tokens = list(tokens)
+        self.slippage_function = slippage_function
+        self.costs = costs or FixedCosts()
+        if min_differences is None:
+            min_differences = load_min_differences()
+        self.thresholds = np.array(
+            [min_differences.get(token, DEFAULT_MIN_DIFFERENCE) for token in tokens]
+        )
+
+        # Строки тикеров каждого символа по времени для as-of поиска
+        symbol_index = {symbol: i for i, symbol in enumerate(ticker_symbols)}
+        order = np.lexsort((tickers["time"], tickers["symbol"]))
+        bounds = np.searchsorted(
+            tickers["symbol"][order], np.arange(len(ticker_symbols) + 1)
+        )
+        self.ticker_rows = {
+            symbol: order[bounds[i] : bounds[i + 1]]
+            for symbol, i in symbol_index.items()
+        }
+
+        # Сканы: все котировки одного скана записаны с одним временем
+        self.scan_times, self.scan_ids = np.unique(
+            quotes["time"], return_inverse=True
+        )
+        # Серии (токен, размер) по времени для поиска котировки на исполнении
+        _, size_ids = np.unique(quotes["amount_in"], return_inverse=True)
+        self.series = quotes["token"].astype(np.int64) * (size_ids.max() + 1) + size_ids
+        self.series_order = np.lexsort((quotes["time"], self.series))
+        self.series_sorted = self.series[self.series_order]
+
+    def asof(self, symbol, times):
+        # Индексы строк последнего тикера symbol не позже times, -1 если не было
+        rows = self.ticker_rows.get(symbol)
+        if rows is None or not len(rows):
+            return np.full(len(times), -1)
+        positions = np.searchsorted(self.tickers["time"][rows], times, side="right") - 1
+        return np.where(positions >= 0, rows[np.maximum(positions, 0)], -1)
+
+    def sell_price(self, rows, quantity):
+        # Цена продажи quantity по тикеру без стакана, как в get_cex_sell_price
+        bid = self.tickers["bid_price"][rows]
+        bid_qty = self.tickers["bid_qty"][rows]
+        beyond = bid * (1 - constants.beyond_top_of_book_discount)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            partial = (bid * bid_qty + beyond * (quantity - bid_qty)) / quantity
+        return np.where(quantity <= bid_qty, bid, partial)
+
+    def lookup_prices(self, rows, times, quantities):
+        # (цена продажи токена, бид базового, аск базового, есть ли тикеры)
+        tokens = self.quotes["token"][rows]
+        sell = np.full(len(rows), np.nan)
+        token_found = np.zeros(len(rows), dtype=bool)
+        for token_id in np.unique(tokens):
+            mask = tokens == token_id
+            ticker = self.asof(f"{self.tokens[token_id]}USDT", times[mask])
+            token_found[mask] = ticker >= 0
+            sell[mask] = self.sell_price(np.maximum(ticker, 0), quantities[mask])
+
+        base = self.asof(f"{self.base_token}USDT", times)
+        base_bid = self.tickers["bid_price"][np.maximum(base, 0)]
+        base_ask = self.tickers["ask_price"][np.maximum(base, 0)]
+        return sell, base_bid, base_ask, token_found & (base >= 0)
+
+    def expected_profit(self, amount_in, amount_out, sell_price, base_price):
+        # SizeOptimizer.expected_profit по массивам
+        taker_fee = constants.cex_taker_fee
+        with np.errstate(divide="ignore", invalid="ignore"):
+            proceeds_base = (
+                amount_out * sell_price * (1 - taker_fee) / base_price * (1 - taker_fee)
+            )
+        return proceeds_base - amount_in - self.costs.get_total()
+
+    @staticmethod
+    def argmax_in_groups(keys, values, positions=None):
+        # Индекс строки с максимальным values в каждой группе keys, группы по
+        # возрастанию keys. При равенстве - строка с меньшей positions (по
+        # умолчанию порядок строк), как первый максимум в циклах живого кода.
+        if not len(keys):
+            return np.array([], dtype=np.int64)
+        if positions is None:
+            positions = np.arange(len(keys))
+        order = np.lexsort((-positions, values, keys))
+        sorted_keys = keys[order]
+        last = np.flatnonzero(np.append(sorted_keys[1:] != sorted_keys[:-1], True))
+        return order[last]
+
+    def decide(self):
+        """
+        Решения по всем сканам. Возвращает (строки котировок выбранных сделок,
+        разница цен на момент решения).
+        """
+        quotes = self.quotes
+        rows = np.arange(len(quotes["time"]))
+        sell, base_bid, _, found = self.lookup_prices(
+            rows, quotes["time"], quotes["amount_out"]
+        )
+
+        # Размер: максимум ожидаемого профита среди размеров токена в скане
+        profit = self.expected_profit(
+            quotes["amount_in"], quotes["amount_out"], sell, base_bid
+        )
+        profit = np.where(found & np.isfinite(profit), profit, -np.inf)
+        token_key = self.scan_ids.astype(np.int64) * len(self.tokens) + quotes["token"]
+        selected = self.argmax_in_groups(token_key, profit)
+        # Первая строка токена в скане - его место в порядке обхода токенов
+        _, first_rows = np.unique(token_key, return_index=True)
+        selected, first_rows = selected[found[selected]], first_rows[found[selected]]
+
+        # Разница с реализуемой ценой CEX и порог токена
+        dex_price = quotes["amount_in"][selected] / quotes["amount_out"][selected]
+        difference = (sell[selected] - dex_price * base_bid[selected]) / sell[selected]
+        passing = (difference > self.thresholds[quotes["token"][selected]]) & (
+            difference > 0
+        )
+        selected, difference = selected[passing], difference[passing]
+
+        # Один лучший токен на скан, как find_best_arbitrage_opportunity
+        best = self.argmax_in_groups(
+            self.scan_ids[selected], difference, first_rows[passing]
+        )
+        return selected[best], difference[best]
+
+    def find_fill_rows(self, rows, times):
+        # Первая котировка того же токена и размера не раньше times, -1 если нет
+        fills = np.full(len(rows), -1)
+        series = self.series[rows]
+        for series_id in np.unique(series):
+            mask = series == series_id
+            start, end = np.searchsorted(self.series_sorted, [series_id, series_id + 1])
+            group = self.series_order[start:end]
+            positions = np.searchsorted(self.quotes["time"][group], times[mask])
+            found = positions < len(group)
+            fills[np.flatnonzero(mask)[found]] = group[positions[found]]
+        return fills
+
+    def simulate(self, rows, difference, latency):
+        # PnL в базовом токене по каждой сделке и флаги откатов
+        quotes = self.quotes
+        exec_times = quotes["time"][rows] + latency
+        fills = self.find_fill_rows(rows, exec_times)
+        filled = fills >= 0
+        rows, difference, exec_times, fills = (
+            rows[filled],
+            difference[filled],
+            exec_times[filled],
+            fills[filled],
+        )
+
+        amount_in = quotes["amount_in"][rows]
+        fill_out = quotes["amount_out"][fills]
+        if self.slippage_function is None:
+            slippage = np.full(len(rows), constants.slippage)
+        else:
+            slippage = np.array(
+                [self.slippage_function(value * 100) for value in difference]
+            )
+        reverted = fill_out < quotes["amount_out"][rows] * (1 - slippage)
+
+        sell, _, base_ask, found = self.lookup_prices(
+            rows, exec_times + constants.backtest_unwind_delay, fill_out
+        )
+        pnl = self.expected_profit(amount_in, fill_out, sell, base_ask)
+        gas_cost = constants.default_swap_gas * self.costs.gas_price / 10**18
+        pnl = np.where(reverted, -gas_cost, pnl)
+        pnl = np.where(found | reverted, pnl, np.nan)
+        return pnl, reverted, int((~filled).sum())
+
+    def run(self, latencies=None):
+        """
+        Реплей для каждой задержки из latencies (секунды). Возвращает список
+        отчетов: сделки, откаты, hit rate, суммарный и средний PnL.
+        """
+        start_time = time.perf_counter()
+        rows, difference = self.decide()
+        decide_time = time.perf_counter() - start_time
+
+        reports = []
+        for latency in latencies or constants.backtest_latencies:
+            pnl, reverted, unfilled = self.simulate(rows, difference, latency)
+            settled = pnl[np.isfinite(pnl)]
+            reports.append(
+                {
+                    "latency": latency,
+                    "scans": len(self.scan_times),
+                    "trades": len(settled),
+                    "unfilled": unfilled,
+                    "reverted": int(reverted.sum()),
+                    "hit_rate": float((settled > 0).mean()) if len(settled) else 0.0,
+                    "pnl": float(settled.sum()),
+                    "avg_pnl": float(settled.mean()) if len(settled) else 0.0,
+                }
+            )
+        logger.info(
+            f"Backtest: {len(self.tickers['time'])} ticks, "
+            f"{len(self.quotes['time'])} quotes. Decisions in {decide_time:.3f} s, "
+            f"total {time.perf_counter() - start_time:.3f} s."
+        )
+        return reports
+
+    def reference_decisions(self, scans=None):
+        """
+        Те же решения через find_best_arbitrage_opportunity и SizeOptimizer
+        по одному скану за раз, для сверки с decide() на небольшой выборке.
+        Порог берется из config/min_difference.json, как в живом коде.
+        Возвращает {индекс скана: (токен, amount_in в базовом токене)}.
+        """
+        size_optimizer = SizeOptimizer(self.network, self.costs, self.costs)
+        quotes = self.quotes
+        decisions = {}
+        for scan_id in scans if scans is not None else range(len(self.scan_times)):
+            rows = np.flatnonzero(self.scan_ids == scan_id)
+            timestamp = self.scan_times[scan_id]
+            base = self.asof(f"{self.base_token}USDT", np.array([timestamp]))[0]
+            if base < 0:
+                continue
+
+            tickers = {}
+            for token_id in np.unique(quotes["token"][rows]):
+                token = self.tokens[token_id]
+                ticker = self.asof(f"{token}USDT", np.array([timestamp]))[0]
+                if ticker >= 0:
+                    tickers[token] = ticker
+
+            def get_sell_price(token, quantity):
+                return float(
+                    self.sell_price(np.array([tickers[token]]), np.array([quantity]))[0]
+                )
+
+            prices = {
+                token: self.tickers["bid_price"][row] for token, row in tickers.items()
+            }
+            prices[self.base_token] = self.tickers["bid_price"][base]
+
+            candidates = {}
+            for row in rows:
+                token = self.tokens[quotes["token"][row]]
+                if token not in tickers:
+                    continue
+                amount_in = int(round(quotes["amount_in"][row] * 10**18))
+                amount_out = int(round(quotes["amount_out"][row] * 10**18))
+                candidates.setdefault(token, []).append(
+                    (amount_in, Quote(amounts=(amount_in, amount_out)))
+                )
+
+            dex_prices = {}
+            realizable = dict(prices)
+            for token, token_candidates in candidates.items():
+                amount_in, quote, _ = size_optimizer.select(
+                    token, token_candidates, prices, get_sell_price
+                )
+                dex_prices[token] = {
+                    "price": amount_in / quote.amount_out,
+                    "network": self.network,
+                    "amount_in": amount_in,
+                }
+                realizable[token] = get_sell_price(token, quote.amount_out / 10**18)
+
+            best = find_best_arbitrage_opportunity({"binance": realizable}, dex_prices)
+            if best is not None:
+                decisions[scan_id] = (
+                    best["token_name"],
+                    best["arbitrage_details"]["amount_in"] / 10**18,
+                )
+        return decisions
+
+
+def load_backtester(directory, **kwargs):
+    tickers, ticker_symbols = load_columns(directory, "tickers")
+    quotes, tokens = load_columns(directory, "quotes")
+    return Backtester(tickers, ticker_symbols, quotes, tokens, **kwargs)
+
+
+if __name__ == "__main__":
+    directory = sys.argv[1] if len(sys.argv) > 1 else constants.backtest_record_dir
+    for report in load_backtester(directory).run():
+        logger.info(report)
@@ -0,0 +1,119 @@
+import itertools
+import json
+import threading
+import time
+
+from loguru import logger
+
+from helpful_functions import atomic_write_json
+from config import constants
+
+
+class BalanceLedger:
+    """
+    Баланс базового токена сети в памяти. Перед свапом сумма резервируется (reserve),
+    после успешного свапа резерв списывается (commit), при неудаче возвращается
+    (release). Все операции под одной блокировкой, поэтому поток синхронизации с
+    сетью и make_trade не теряют обновления друг друга.
+    Снапшот баланса пишется на диск в фоне через атомарный rename.
+    """
+
+    def __init__(self, network, filename=None):
+        self.network = network
+        self.filename = (
+            filename
+            or f"data/prices/{constants.network_base_token[network].lower()}_{network}.json"
+        )
+        self.lock = threading.Lock()
+        self.balance = 0
+        # reservation_id -> сумма
+        self.reservations = {}
+        self.reservation_ids = itertools.count(1)
+        # Увеличивается при каждом локальном изменении баланса. Нужна, чтобы
+        # баланс из сети, прочитанный до свапа, не затер списание после него.
+        self.version = 0
+        self.snapshot_needed = threading.Event()
+        self.running = False
+
+        self.load_snapshot()
+
+    def load_snapshot(self):
+        try:
+            with open(self.filename, "r") as file:
+                self.balance = json.load(file).get("balance", 0)
+        except FileNotFoundError:
+            logger.error(f"Balance file for {self.network} not found.")
+        except Exception as e:
+            logger.error(f"Error reading balance for {self.network}: {e}")
+
+    def start(self):
+        self.running = True
+        threading.Thread(target=self.snapshot_loop, args=(), daemon=True).start()
+
+    def stop(self):
+        self.running = False
+        self.snapshot_needed.set()
+
+    def available(self):
+        # Баланс за вычетом активных резервов
+        with self.lock:
+            return self.balance - sum(self.reservations.values())
+
+    def reserve(self, amount):
+        # Возвращает id резерва или None, если свободного баланса не хватает
+        with self.lock:
+            if self.balance - sum(self.reservations.values()) < amount:
+                return None
+            reservation_id = next(self.reservation_ids)
+            self.reservations[reservation_id] = amount
+            return reservation_id
+
+    def commit(self, reservation_id, amount=None):
+        # Списываем резерв. amount - фактически потраченная сумма, если она отличается.
+        with self.lock:
+            reserved = self.reservations.pop(reservation_id, 0)
+            self.balance -= reserved if amount is None else amount
+            self.version += 1
+        self.snapshot_needed.set()
+
+    def release(self, reservation_id):
+        with self.lock:
+            self.reservations.pop(reservation_id, None)
+
+    def adjust(self, balance_change):
+        with self.lock:
+            self.balance += balance_change
+            self.version += 1
+        self.snapshot_needed.set()
+
+    def get_version(self):
+        with self.lock:
+            return self.version
+
+    def sync(self, balance, version):
+        """
+        Подменяет баланс значением из сети. version берется через get_version() до
+        запроса в сеть. Если с тех пор были локальные списания или сейчас есть
+        активные резервы, значение из сети может быть устаревшим и не применяется.
+        """
+        with self.lock:
+            if self.version != version or self.reservations:
+                return False
+            self.balance = balance
+            self.version += 1
+        self.snapshot_needed.set()
+        return True
+
+    def snapshot_loop(self):
+        while self.running:
+            self.snapshot_needed.wait()
+            self.snapshot_needed.clear()
+
+            with self.lock:
+                balance = self.balance
+            try:
+                atomic_write_json(
+                    self.filename, {"timestamp": time.time(), "balance": balance}
+                )
+            except Exception as e:
+                logger.error(f"Error writing balance snapshot for {self.network}: {e}")
@@ -0,0 +1,350 @@
+# Микробенчмарки горячего пути. Сеть не нужна.
+# Запуск: python benchmark.py [имя бенчмарка]
+
+import os
+import sys
+import time
+
+from eth_account import Account
+from web3 import Web3
+
+from config import constants
+
+# Одноразовый ключ, чтобы LFGclient создавался без настоящего кошелька
+os.environ.setdefault("PRIVATE_KEY", Account.create().key.hex())
+
+from lfg_client import LFGclient
+
+
+def measure(function, iterations):
+    # Среднее время одного вызова в миллисекундах
+    start_time = time.perf_counter()
+    for _ in range(iterations):
+        function()
+    return (time.perf_counter() - start_time) / iterations * 1000
+
+
+def bench_swap_templates(iterations=500):
+    # Сборка и подпись свапа: build_transaction против готового шаблона.
+    # RPC вызовы старого пути (блок, газ, nonce, оценка газа) сюда не входят.
+    w3 = Web3()
+    client = LFGclient(w3)
+    client.swap_templates.estimate_gas = lambda calldata, amount_in: 500000
+
+    network = constants.chain["avalanche"]
+    token_path = [network["WAVAX"], network["QI"]]
+    amount_in = network["swap_size"] * 10**18
+    recipient = client.account.address
+    fees = (30 * 10**9, 5 * 10**9)
+
+    def build_transaction_path():
+        path = {
+            "tokenPath": [w3.to_checksum_address(addr) for addr in token_path],
+            "pairBinSteps": [20],
+            "versions": [2],
+        }
+        tx = client.router.functions.swapExactNATIVEForTokens(
+            10**18, path, recipient, int(time.time()) + 1200
+        ).build_transaction(
+            {
+                "from": recipient,
+                "value": amount_in,
+                "maxFeePerGas": fees[0],
+                "maxPriorityFeePerGas": fees[1],
+                "nonce": 1,
+                "chainId": 43114,
+                "gas": 500000,
+            }
+        )
+        w3.eth.account.sign_transaction(tx, client.account.key)
+
+    def template_path():
+        template = client.swap_templates.get_template(
+            token_path, [20], [2], amount_in, recipient
+        )
+        client.swap_templates.sign(
+            template, 10**18, int(time.time()) + 1200, 1, fees
+        )
+
+    print(f"build_transaction + sign: {measure(build_transaction_path, iterations):.3f} ms")
+    print(f"template + sign:          {measure(template_path, iterations):.3f} ms")
+
+
+def bench_opportunity_scoring(iterations=200, token_count=500):
+    # Поиск возможностей: find_best_arbitrage_opportunity против OpportunityScorer
+    # на синтетических ценах token_count токенов и четырех CEX
+    import random
+
+    from loguru import logger
+
+    from helpful_functions import find_best_arbitrage_opportunity
+    from opportunity_scoring import OpportunityScorer
+    from records import Opportunity
+
+    cexes = ["binance", "okx", "bybit", "gate"]
+    tokens = [f"TOKEN{i}" for i in range(token_count)]
+    cex_prices = {
+        cex: {
+            "AVAX": 30.0,
+            **{token: random.uniform(0.5, 2) for token in tokens},
+        }
+        for cex in cexes
+    }
+    dex_prices = {
+        token: {"price": random.uniform(0.5, 2) / 30, "network": "avalanche"}
+        for token in tokens
+    }
+    # Скорер работает с записями Opportunity, старый путь - со словарями
+    dex_records = {}
+    for token, dex_info in dex_prices.items():
+        dex_records[token] = Opportunity(token, "avalanche", token_address="0x0")
+        dex_records[token].price = dex_info["price"]
+    scorer = OpportunityScorer(tokens, cexes)
+    # Старый путь логгирует каждую пару токен/CEX
+    logger.remove()
+
+    def loop_path():
+        find_best_arbitrage_opportunity(cex_prices, dict(dex_prices))
+
+    def vectorized_path():
+        scorer.rank_opportunities(cex_prices, dex_records)
+
+    def score_only():
+        scorer.rank(constants.top_k_opportunities)
+
+    print(f"find_best_arbitrage_opportunity: {measure(loop_path, iterations):.3f} ms")
+    print(f"rank_opportunities:              {measure(vectorized_path, iterations):.3f} ms")
+    print(f"  of which scoring:              {measure(score_only, iterations):.3f} ms")
+
+
+def bench_quote_records(iterations=200, token_count=500):
+    # Котировки скана: словари format_quote / build_price_data против записей
+    # Quote / Opportunity из ScanBuffer. Время, память по tracemalloc и
+    # сборки мусора за iterations сканов.
+    import gc
+    import tracemalloc
+
+    from records import ScanBuffer
+
+    network = "avalanche"
+    sizes = [int(size * 10**18) for size in constants.chain[network]["swap_sizes"]]
+    tokens = [f"TOKEN{i}" for i in range(token_count)]
+    for token in tokens:
+        constants.chain[network].setdefault(token, f"0x{len(token):040x}")
+
+    def decoded_quote(amount_in):
+        # Результат декодера ABI для двуххопового маршрута
+        return (
+            ("0x" + "1" * 40, "0x" + "2" * 40),
+            ("0x" + "3" * 40,),
+            (20,),
+            (2,),
+            (amount_in, amount_in * 30),
+            (amount_in, amount_in * 30),
+            (10**15,),
+        )
+
+    # Декодер отдает новые tuple каждый скан, это общее для обоих путей
+    decoded = [[decoded_quote(amount_in) for amount_in in sizes] for _ in tokens]
+
+    def dict_path():
+        amm_prices = {}
+        for token, token_quotes in zip(tokens, decoded):
+            candidates = [
+                (
+                    amount_in,
+                    {
+                        "route": quote[0],
+                        "pairs": quote[1],
+                        "bin_steps": quote[2],
+                        "versions": quote[3],
+                        "amounts": quote[4],
+                        "virtual_amounts": quote[5],
+                        "fees": quote[6],
+                    },
+                )
+                for amount_in, quote in zip(sizes, token_quotes)
+            ]
+            amount_in, quote = candidates[-1]
+            amm_prices[token] = {
+                "price": amount_in / quote["amounts"][-1],
+                "network": network,
+                "data": {
+                    "amount_in": amount_in,
+                    "quote": quote,
+                    "token_address": constants.chain[network][token],
+                    "candidates": candidates,
+                    "expected_profit": 0,
+                },
+            }
+        return [
+            {
+                "token_name": token,
+                "cex": "binance",
+                "arbitrage_details": {**amm_prices[token], "difference": 0.01},
+            }
+            for token in tokens[: constants.top_k_opportunities]
+        ]
+
+    buffer = ScanBuffer(tokens, network)
+    buffer_tokens = [token for token in tokens for _ in sizes]
+
+    def records_path():
+        quotes = iter(buffer.get_quotes(buffer_tokens))
+        amm_prices = {}
+        for token, token_quotes in zip(tokens, decoded):
+            candidates = [
+                (amount_in, next(quotes).load(quote))
+                for amount_in, quote in zip(sizes, token_quotes)
+            ]
+            amount_in, quote = candidates[-1]
+            opportunity = buffer.get_opportunity(token).set_quote(amount_in, quote)
+            opportunity.candidates = candidates
+            opportunity.expected_profit = 0
+            amm_prices[token] = opportunity
+        opportunities = []
+        for token in tokens[: constants.top_k_opportunities]:
+            amm_prices[token].cex = "binance"
+            amm_prices[token].difference = 0.01
+            opportunities.append(amm_prices[token])
+        return opportunities
+
+    def memory(function):
+        # (выделено за скан, пик за скан) в КБ и число сборок мусора за все сканы
+        function()
+        gc.collect()
+        collections = sum(stats["collections"] for stats in gc.get_stats())
+        tracemalloc.start()
+        before, _ = tracemalloc.get_traced_memory()
+        for _ in range(iterations):
+            result = function()
+        after, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        del result
+        collections = (
+            sum(stats["collections"] for stats in gc.get_stats()) - collections
+        )
+        return (after - before) / 1024, (peak - before) / 1024, collections
+
+    for name, function in (("dicts", dict_path), ("records", records_path)):
+        retained, peak, collections = memory(function)
+        print(
+            f"{name:8} {measure(function, iterations):.3f} ms. "
+            f"Retained: {retained:.0f} KB. Peak: {peak:.0f} KB. "
+            f"GC runs: {collections}"
+        )
+
+
+def start_stub_rpc(delay=0):
+    # Локальный JSON-RPC, который на все отвечает номером блока после паузы delay
+    import json
+    import threading
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def do_POST(self):
+            request = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+            time.sleep(delay)
+            body = json.dumps(
+                {"jsonrpc": "2.0", "id": request["id"], "result": "0x1"}
+            ).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return f"http://127.0.0.1:{server.server_port}"
+
+
+def bench_rpc_provider(iterations=300):
+    # Один HTTPProvider против MultiEndpointProvider на двух локальных RPC,
+    # один из которых отвечает на 20 мс медленнее
+    from rpc_provider import MultiEndpointProvider
+
+    fast_url = start_stub_rpc()
+    slow_url = start_stub_rpc(delay=0.02)
+
+    plain = Web3(Web3.HTTPProvider(slow_url))
+    provider = MultiEndpointProvider([slow_url, fast_url])
+    pooled = Web3(provider)
+
+    print(f"HTTPProvider (slow RPC):  {measure(lambda: plain.eth.block_number, iterations):.3f} ms")
+    print(f"MultiEndpointProvider:    {measure(lambda: pooled.eth.block_number, iterations):.3f} ms")
+    print(f"Endpoint stats: {provider.get_stats()}")
+
+
+def bench_backtest(ticks=2_000_000, token_count=20, scans=20000, sample=200):
+    # Векторный реплей Backtester.run против поскановых решений через
+    # find_best_arbitrage_opportunity на синтетических тиках и котировках
+    import numpy as np
+    from loguru import logger
+
+    from backtest import Backtester
+
+    network = "avalanche"
+    rng = np.random.default_rng(0)
+    tokens = [f"TOKEN{i}" for i in range(token_count)]
+    for token in tokens:
+        constants.chain[network].setdefault(token, f"0x{len(token):040x}")
+    base_token = constants.network_base_token[network]
+    symbols = [f"{token}USDT" for token in tokens] + [f"{base_token}USDT"]
+
+    symbol = rng.integers(0, len(symbols), ticks).astype(np.int32)
+    bid = np.where(symbol == len(symbols) - 1, 30.0, 1.0)
+    bid = bid * (1 + rng.normal(0, 0.003, ticks))
+    tickers = {
+        "time": np.sort(rng.uniform(0, scans, ticks)),
+        "symbol": symbol,
+        "bid_price": bid,
+        "bid_qty": np.full(ticks, 1000.0),
+        "ask_price": bid * 1.001,
+        "ask_qty": np.full(ticks, 1000.0),
+    }
+
+    sizes = np.array(constants.chain[network]["swap_sizes"], dtype=float)
+    count = scans * token_count * len(sizes)
+    amount_in = np.tile(sizes, scans * token_count)
+    quotes = {
+        "time": np.repeat(np.arange(scans, dtype=float), token_count * len(sizes)),
+        "token": np.tile(
+            np.repeat(np.arange(token_count, dtype=np.int32), len(sizes)), scans
+        ),
+        "amount_in": amount_in,
+        "amount_out": amount_in * 30 * (1 + rng.normal(0, 0.01, count)),
+    }
+
+    backtester = Backtester(tickers, symbols, quotes, tokens, network)
+    logger.remove()
+    start_time = time.perf_counter()
+    reports = backtester.run()
+    vectorized = (time.perf_counter() - start_time) * 1000 / scans
+    start_time = time.perf_counter()
+    backtester.reference_decisions(range(sample))
+    reference = (time.perf_counter() - start_time) * 1000 / sample
+    print(
+        f"{ticks} ticks, {count} quotes. Vectorized: {vectorized:.4f} ms per scan "
+        f"for {len(reports)} latencies. Reference: {reference:.3f} ms per scan"
+    )
+
+
+BENCHMARKS = {
+    "swap_templates": bench_swap_templates,
+    "opportunity_scoring": bench_opportunity_scoring,
+    "quote_records": bench_quote_records,
+    "rpc_provider": bench_rpc_provider,
+    "backtest": bench_backtest,
+}
+
+if __name__ == "__main__":
+    names = sys.argv[1:] or list(BENCHMARKS)
+    for name in names:
+        print(f"== {name}")
+        BENCHMARKS[name]()
@@ -0,0 +1,213 @@
+import multiprocessing
+import threading
+import time
+from concurrent.futures import Future
+
+from binance.exceptions import BinanceAPIException
+from loguru import logger
+
+from config import constants
+
+
+class BinanceRateLimited(Exception):
+    # Запрос с низким приоритетом отброшен, чтобы не упереться в лимит веса
+    pass
+
+
+class WeightBudget:
+    """
+    Вес REST запросов за текущую минуту и пауза после 429/418. Лимит Binance
+    считается на IP, поэтому в многопроцессном режиме бюджет один на все
+    процессы: главный процесс создает его и передает процессам сетей и
+    шардов, общие поля лежат в multiprocessing.Array.
+    """
+
+    # Поля массива: минута, использованный вес, до какого времени пауза
+    MINUTE, USED_WEIGHT, BANNED_UNTIL = range(3)
+
+    def __init__(self, context=multiprocessing):
+        # context - контекст multiprocessing, в котором запускаются процессы
+        self.array = context.Array("d", 3)
+
+    def reserve(self, weight, limit):
+        # Учитывает вес и возвращает 0 или сколько секунд ждать без учета
+        now = time.time()
+        with self.array.get_lock():
+            self.roll_minute(now)
+            banned_until = self.array[self.BANNED_UNTIL]
+            if now < banned_until:
+                return banned_until - now
+            if self.array[self.USED_WEIGHT] + weight > limit:
+                return 60 - now % 60
+            self.array[self.USED_WEIGHT] += weight
+            return 0
+
+    def report_used_weight(self, used_weight):
+        # Вес из ответа точнее нашей таблицы: учитывает и чужие запросы с IP
+        with self.array.get_lock():
+            self.roll_minute(time.time())
+            self.array[self.USED_WEIGHT] = max(
+                self.array[self.USED_WEIGHT], used_weight
+            )
+
+    def ban(self, until):
+        with self.array.get_lock():
+            self.array[self.BANNED_UNTIL] = max(self.array[self.BANNED_UNTIL], until)
+
+    def get_used_weight(self):
+        with self.array.get_lock():
+            self.roll_minute(time.time())
+            return int(self.array[self.USED_WEIGHT])
+
+    def roll_minute(self, now):
+        # Лимит веса у Binance считается по календарной минуте
+        minute = now // 60
+        if minute != self.array[self.MINUTE]:
+            self.array[self.MINUTE] = minute
+            self.array[self.USED_WEIGHT] = 0
+
+
+class BinanceScheduler:
+    """
+    Обертка над binance.Client, через которую идут все REST запросы процесса.
+    Считает вес запросов за текущую минуту: по своей таблице весов и по
+    заголовку x-mbx-used-weight-1m из ответов. Торговые вызовы (ордера, вывод)
+    идут первыми, информационные ждут, пока торговые в очереди. Когда вес
+    подходит к binance_low_priority_weight_share от лимита, информационные
+    запросы из binance_sheddable_calls отбрасываются (BinanceRateLimited),
+    остальные ждут следующей минуты. Одинаковые информационные запросы,
+    которые уже выполняются, не дублируются: второй вызов ждет результат
+    первого. После 429/418 все запросы ждут Retry-After. Вес и пауза
+    хранятся в WeightBudget, общем для всех процессов, если его передали.
+    """
+
+    def __init__(self, client, budget=None):
+        self.client = client
+        self.budget = budget or WeightBudget()
+        self.lock = threading.Condition()
+        self.trading_waiting = 0
+        # Ключ запроса -> Future с результатом
+        self.in_flight = {}
+        self.stats = {"requests": 0, "coalesced": 0, "shed": 0, "delayed": 0}
+
+    def __getattr__(self, name):
+        attribute = getattr(self.client, name)
+        if not callable(attribute) or name in constants.binance_unscheduled_calls:
+            return attribute
+
+        def call(*args, **kwargs):
+            return self.request(name, attribute, args, kwargs)
+
+        return call
+
+    @staticmethod
+    def is_trading(name):
+        return name in constants.binance_trading_calls or name.startswith("order_")
+
+    @staticmethod
+    def get_weight(name, kwargs):
+        if name == "get_order_book":
+            # Вес стакана зависит от глубины
+            limit = kwargs.get("limit", 100)
+            for max_limit, weight in constants.binance_order_book_weights:
+                if limit <= max_limit:
+                    return weight
+        return constants.binance_request_weights.get(name, 1)
+
+    def request(self, name, method, args, kwargs):
+        if self.is_trading(name):
+            return self.send(name, method, args, kwargs, trading=True)
+
+        # Одинаковый запрос уже выполняется - ждем его результат
+        key = (name, repr(args), repr(sorted(kwargs.items())))
+        with self.lock:
+            future = self.in_flight.get(key)
+            owner = future is None
+            if owner:
+                future = self.in_flight[key] = Future()
+            else:
+                self.stats["coalesced"] += 1
+        if not owner:
+            return future.result()
+
+        try:
+            result = self.send(name, method, args, kwargs, trading=False)
+        except Exception as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            with self.lock:
+                self.in_flight.pop(key, None)
+
+    def send(self, name, method, args, kwargs, trading):
+        weight = self.get_weight(name, kwargs)
+        self.acquire(name, weight, trading)
+        try:
+            response = method(*args, **kwargs)
+        except BinanceAPIException as e:
+            if e.status_code in (418, 429):
+                self.on_rate_limited(e)
+            raise
+        finally:
+            if trading:
+                with self.lock:
+                    self.trading_waiting -= 1
+                    self.lock.notify_all()
+        self.update_used_weight()
+        return response
+
+    def acquire(self, name, weight, trading):
+        # Ждет, пока запрос можно отправить, и учитывает его вес
+        with self.lock:
+            if trading:
+                self.trading_waiting += 1
+            limit = constants.binance_weight_limit
+            if not trading:
+                limit *= constants.binance_low_priority_weight_share
+
+            while True:
+                if not trading and self.trading_waiting:
+                    # Пропускаем торговые вызовы вперед
+                    self.lock.wait()
+                    continue
+                # Другие процессы не будят наш Condition, поэтому ждем по таймауту
+                wait = self.budget.reserve(weight, limit)
+                if not wait:
+                    break
+
+                if not trading and name in constants.binance_sheddable_calls:
+                    self.stats["shed"] += 1
+                    raise BinanceRateLimited(name)
+                self.stats["delayed"] += 1
+                self.lock.wait(wait)
+
+            self.stats["requests"] += 1
+
+    def update_used_weight(self):
+        response = getattr(self.client, "response", None)
+        if response is None:
+            return
+        used_weight = response.headers.get("x-mbx-used-weight-1m")
+        if used_weight is None:
+            return
+        self.budget.report_used_weight(int(used_weight))
+
+    def on_rate_limited(self, error):
+        retry_after = None
+        if error.response is not None:
+            retry_after = error.response.headers.get("Retry-After")
+        retry_after = int(retry_after) if retry_after else 60
+        logger.error(
+            f"Binance rate limit ({error.status_code}). Pausing for {retry_after} s."
+        )
+        self.budget.ban(time.time() + retry_after)
+        with self.lock:
+            self.lock.notify_all()
+
+    def get_stats(self):
+        with self.lock:
+            stats = dict(self.stats)
+        return {**stats, "used_weight": self.budget.get_used_weight()}
@@ -0,0 +1,121 @@
+import asyncio
+import json
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import namedtuple
+
+import websockets
+from loguru import logger
+
+from config import constants
+
+BookTicker = namedtuple(
+    "BookTicker", ["bid_price", "bid_qty", "ask_price", "ask_qty", "timestamp"]
+)
+
+
+class BinanceStream(ABC):
+    """
+    Базовый класс для combined stream Binance. Читает websocket в фоновом потоке
+    со своим event loop и переподключается при обрыве. Адрес можно подменить,
+    чтобы подключиться к локальной заглушке.
+    """
+
+    def __init__(self, streams, url=None):
+        self.streams = streams
+        self.url = url or constants.binance_stream_url
+        self.running = False
+        self.thread = None
+        self.last_message_time = 0
+
+    def start(self):
+        self.running = True
+        self.thread = threading.Thread(
+            target=lambda: asyncio.run(self.listen()), daemon=True
+        )
+        self.thread.start()
+
+    def stop(self):
+        self.running = False
+
+    async def listen(self):
+        url = f"{self.url}/stream?streams={'/'.join(self.streams)}"
+        while self.running:
+            try:
+                async with websockets.connect(url) as websocket:
+                    logger.info(f"Binance stream connected: {url}")
+                    self.on_connect()
+                    async for message in websocket:
+                        if not self.running:
+                            break
+                        self.last_message_time = time.time()
+                        message = json.loads(message)
+                        self.on_message(message.get("data", message))
+            except Exception as e:
+                logger.error(f"Binance stream error: {e}")
+                await asyncio.sleep(constants.binance_stream_reconnect_delay)
+
+    def on_connect(self):
+        pass
+
+    @abstractmethod
+    def on_message(self, data):
+        pass
+
+
+class BookTickerCache(BinanceStream):
+    """
+    Кэш лучших цен (bookTicker) только для нужных символов.
+    Пишет один поток, а снапшот заменяется целиком (copy-on-write), поэтому читатели
+    получают согласованный словарь без блокировок.
+    """
+
+    def __init__(self, symbols, url=None, stale_after=None, recorder=None):
+        super().__init__([f"{symbol.lower()}@bookTicker" for symbol in symbols], url)
+        self.symbols = symbols
+        self.stale_after = stale_after or constants.book_ticker_stale_after
+        self.snapshot = {}
+        # TickRecorder для бэктеста, если запись включена
+        self.recorder = recorder
+
+    def on_message(self, data):
+        ticker = BookTicker(
+            bid_price=float(data["b"]),
+            bid_qty=float(data["B"]),
+            ask_price=float(data["a"]),
+            ask_qty=float(data["A"]),
+            timestamp=time.time(),
+        )
+        snapshot = dict(self.snapshot)
+        snapshot[data["s"]] = ticker
+        self.snapshot = snapshot
+        if self.recorder is not None:
+            self.recorder.record_ticker(data["s"], ticker)
+
+    def get_snapshot(self):
+        # Словарь symbol -> BookTicker. Не изменяется после публикации.
+        return self.snapshot
+
+    def is_stale(self):
+        # bookTicker приходит только при изменении лучшей цены, поэтому свежесть
+        # считаем по соединению целиком, а не по каждому символу
+        if time.time() - self.last_message_time > self.stale_after:
+            return True
+        snapshot = self.snapshot
+        return any(symbol not in snapshot for symbol in self.symbols)
+
+    def get_tickers(self):
+        # Тикеры в формате REST get_orderbook_tickers или None, если стрим устарел
+        if self.is_stale():
+            return None
+        return [
+            {
+                "symbol": symbol,
+                "bidPrice": ticker.bid_price,
+                "bidQty": ticker.bid_qty,
+                "askPrice": ticker.ask_price,
+                "askQty": ticker.ask_qty,
+            }
+            for symbol, ticker in self.snapshot.items()
+        ]
@@ -0,0 +1,94 @@
+import time
+import traceback
+from collections import deque
+
+from loguru import logger
+
+from config import constants
+
+
+class BlockScheduler:
+    """
+    Запускает ровно один скан на каждый новый блок вместо фиксированных пауз.
+    Новые блоки отслеживаются поллингом eth_blockNumber, поэтому планировщик работает
+    с любым провайдером, включая локальную заглушку. Если за время скана пришло
+    несколько блоков, следующий скан делается один раз по самому свежему.
+    """
+
+    def __init__(self, w3, on_block, poll_interval=None, latency_window=None):
+        self.w3 = w3
+        self.on_block = on_block
+        self.poll_interval = poll_interval or constants.block_poll_interval
+        self.latencies = deque(
+            maxlen=latency_window or constants.block_latency_window
+        )
+        self.last_block_number = None
+        self.scans_count = 0
+        self.running = False
+
+    def start(self):
+        self.running = True
+        while self.running:
+            block_number = self.wait_for_new_block()
+            if block_number is None:
+                continue
+            self.run_scan(block_number)
+
+    def stop(self):
+        self.running = False
+
+    def wait_for_new_block(self):
+        # Возвращает номер нового блока или None, если новых блоков пока нет
+        try:
+            block_number = self.w3.eth.block_number
+        except Exception as e:
+            logger.error(f"Error getting block number: {e}")
+            time.sleep(self.poll_interval)
+            return None
+
+        last_block_number = self.last_block_number
+        if last_block_number is not None and block_number <= last_block_number:
+            time.sleep(self.poll_interval)
+            return None
+
+        self.last_block_number = block_number
+        return block_number
+
+    def run_scan(self, block_number):
+        try:
+            self.on_block(block_number)
+        except Exception as e:
+            logger.error(e)
+            logger.error(traceback.format_exc())
+
+        # Время от метки блока до окончания скана. Заголовок блока берем уже после скана,
+        # чтобы лишний запрос не задерживал реакцию.
+        finished_at = time.time()
+        try:
+            block_timestamp = self.w3.eth.get_block(block_number)["timestamp"]
+        except Exception as e:
+            logger.error(f"Error getting block {block_number}: {e}")
+            return
+        self.latencies.append(finished_at - block_timestamp)
+
+        self.scans_count += 1
+        if self.scans_count % constants.block_latency_log_every == 0:
+            logger.info(f"Block reaction latency: {self.get_latency_stats()}")
+
+    def get_latency_stats(self):
+        # Распределение задержки реакции на блок в секундах
+        if not self.latencies:
+            return {}
+
+        latencies = sorted(self.latencies)
+
+        def percentile(p):
+            return latencies[min(int(len(latencies) * p), len(latencies) - 1)]
+
+        return {
+            "count": len(latencies),
+            "p50": percentile(0.5),
+            "p90": percentile(0.9),
+            "p99": percentile(0.99),
+            "max": latencies[-1],
+        }
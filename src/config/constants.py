@@ -3,9 +3,94 @@ import os
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 ROUTER_ABI_PATH = os.path.join(BASE_DIR, "config", "abis", "lfg22_router.json")
 QUOTER_ABI_PATH = os.path.join(BASE_DIR, "config", "abis", "lfg22_quoter.json")
+LB_PAIR_ABI_PATH = os.path.join(BASE_DIR, "config", "abis", "lb_pair.json")
+MULTICALL3_ABI_PATH = os.path.join(BASE_DIR, "config", "abis", "multicall3.json")
+
+# Multicall3 задеплоен по одному и тому же адресу во всех EVM сетях
+multicall3_address = "0xcA11bde05977b3631167028862bE2a173976CA11"
 
 zero_address = "0x0000000000000000000000000000000000000000"
 data_is_old = 60
+exchange_info_retry_delay = 5
+
+# Лимит веса REST запросов Binance на IP в минуту и веса наших запросов
+binance_weight_limit = 6000
+# Доля лимита, после которой информационные запросы ждут или отбрасываются
+binance_low_priority_weight_share = 0.8
+binance_request_weights = {
+    "get_orderbook_tickers": 4,
+    "get_all_tickers": 4,
+    "get_exchange_info": 20,
+    "get_symbol_info": 20,
+    "get_all_coins_info": 10,
+    "get_deposit_history": 1,
+    "get_asset_balance": 20,
+    "withdraw": 1,
+}
+binance_order_book_weights = [(100, 5), (500, 25), (1000, 50), (5000, 250)]
+binance_trading_calls = {"create_order", "withdraw"}  # Плюс все order_*
+# Информационные запросы, у которых есть замена (websocket) или повтор по циклу
+binance_sheddable_calls = {"get_orderbook_tickers", "get_all_tickers"}
+# Методы клиента, которые не ходят в REST
+binance_unscheduled_calls = {"close_connection"}
+
+block_poll_interval = 0.1  # Как часто спрашиваем eth_blockNumber, секунды
+block_latency_window = 1000  # Сколько последних задержек реакции на блок храним
+block_latency_log_every = 100  # Раз в сколько сканов логируем распределение задержки
+scan_interval = 1  # Пауза между сканами, если работаем без привязки к блокам
+
+# Таймауты стадий асинхронного цикла, секунды. Медленный источник не держит решение.
+stage_timeout = {"cex": 1.5, "amm": 1.5}
+stage_latency_window = 1000
+
+# RPC провайдер с несколькими эндпоинтами
+rpc_pool_size = 20  # Keep-alive соединений на эндпоинт
+rpc_timeout = 10
+rpc_ewma_alpha = 0.1  # Вес нового замера в скользящих задержке и доле ошибок
+rpc_max_error_rate = 0.2  # Выше этой доли ошибок эндпоинт не используется для чтения
+rpc_probe_interval = 5  # Как часто проверяем эндпоинты без запросов, секунды
+rpc_broadcast_workers = 4
+rpc_latency_window = 200  # Сколько последних задержек эндпоинта храним для перцентилей
+# Хеджирование eth_call котировок: второй запрос, если первый дольше перцентиля
+quote_hedging = True
+rpc_hedge_percentile = 0.9
+rpc_hedge_min_samples = 20
+rpc_hedge_default_delay = 0.3  # Пока замеров мало, секунды
+rpc_hedge_log_every = 100
+
+binance_stream_url = "wss://stream.binance.com:9443"
+binance_stream_reconnect_delay = 1
+order_book_update_speed = "100ms"
+order_book_snapshot_limit = 1000
+book_ticker_stale_after = 10  # Если из стрима ничего не было дольше, берем цены по REST
+
+# Мультичейн режим: процесс на сеть, общие цены Binance в разделяемой памяти
+shared_feed_interval = 0.01  # Как часто главный процесс публикует цены, секунды
+multichain_check_interval = 5  # Как часто проверяем, живы ли процессы сетей
+
+# Шардированный режим: токены делятся между процессами-сканерами
+shard_count = 4  # Сколько процессов-сканеров
+shard_queue_size = 100  # Очередь кандидатов от сканеров к исполнителю
+shard_poll_interval = 0.5  # Сколько исполнитель ждет кандидатов за раз, секунды
+shard_candidate_max_age = 2  # Кандидаты старше (примерно блок) не исполняем
+shared_order_book_depth = 50  # Сколько уровней бидов стакана видят сканеры
+shared_order_book_interval = 0.1  # Как часто координатор публикует стаканы
+
+# Мемпул: back-run по pending свапам через отслеживаемые пары LB
+mempool_watcher = False  # Нужна нода с eth_newPendingTransactionFilter
+mempool_poll_interval = 0.05  # Как часто забираем новые pending хэши, секунды
+mempool_fetch_workers = 8  # Потоки для eth_getTransactionByHash
+mempool_queue_size = 20  # Очередь готовых back-run
+mempool_backrun_ttl = 2  # Back-run старше (примерно блок) не отправляем
+mempool_record_file = None  # Путь JSON Lines, куда писать транзакции к роутеру
+
+# Бэктест: запись тикеров и котировок и реплей (backtest.py)
+backtest_record_dir = None  # Папка для записи, например "data/backtest". None - не пишем
+backtest_flush_rows = 100000  # Сколько строк копить в памяти до сброса в файл
+backtest_unwind_delay = 60  # Через сколько секунд после свапа продаем на CEX
+backtest_latencies = [0, 0.5, 1, 2, 5]  # Задержки исполнения для сравнения, секунды
+backtest_withdrawal_fee = 0.01  # Комиссия вывода базового токена в реплее
+backtest_gas_price = 30 * 10**9  # Цена газа в реплее, wei
 explorer = {
     "avalanche": "https://snowtrace.io",
     "arbitrum": "https://arbiscan.io",
@@ -43,14 +128,77 @@ fee = {"ARB": 500, "GMX": 3000, "RNDR": 10000}
 
 default_gas = {"avalanche": 1500000, "arbitrum": 20000000}
 min_balance_for_gas = {"avalanche": 0.5, "arbitrum": 0.01}
+balance_sync_interval = 600  # Как часто сверяем баланс с сетью, секунды
+balance_sync_retry_delay = 5
 
 slippage = 0.005
+top_k_opportunities = 5  # Сколько лучших возможностей возвращает скоринг
+max_concurrent_trades = 3  # Сколько свапов отправляем за один скан
+cex_taker_fee = 0.001  # Комиссия Binance за маркет ордер
+# Во сколько дешевле лучшего бида оцениваем объем сверх bidQty, если стакана нет
+beyond_top_of_book_discount = 0.005
+
+# Поиск маршрутов свапа
+route_max_hops = 3
+route_hub_tokens = {"avalanche": ["USDC", "USDT", "BTC.B"]}  # Промежуточные токены
+route_ttl = 600  # Сколько живет найденный маршрут, секунды
+route_check_interval = 30
+route_quote_batch_size = 50  # Котировок в одном eth_call
+
+# Офчейн симулятор Liquidity Book
+lb_bins_window = 50  # Сколько бинов по обе стороны от активного держим в кэше
+lb_full_refresh_interval = 300  # Полная перезагрузка состояния пар, секунды
+lb_cross_check_every = 100  # Раз в сколько сканов сверяем симулятор с квотером
+lb_cross_check_tolerance = 0.001  # Расхождение, при котором сверка предупреждает
+lb_cross_check_file = None  # JSON Lines для tests/data: пары и котировки сверки
+
+default_swap_gas = 500000  # Если оценка газа не удалась
+swap_template_cache_size = 1000  # Шаблонов свапа и лимитов газа в LRU кэше
+fee_oracle_ttl = 2  # Как часто обновляем gas_price в фоне, секунды
+priority_fee_share = 0.2  # Приоритетная комиссия как доля от baseFee
+receipt_poll_interval = 0.5
+receipt_timeout = 300  # Если транзакция не смайнилась за это время, считаем ее потерянной
+
+# Разворот позиции на CEX: депозит -> продажа -> покупка базового токена -> вывод
+unwind_workers = {"deposit": 2, "sell": 2, "buy_base": 1, "withdraw": 1}
+unwind_queue_size = 20  # Размер очереди каждой стадии
+unwind_max_jobs = 20  # Предел незавершенных разворотов для новых сделок
+unwind_poll_interval = 2  # Как часто проверяем, пришел ли депозит, секунды
+deposit_timeout = 3600  # Сколько ждем депозит, секунды
+# Опрос истории депозитов: интервал растет от min до max, пока ничего не меняется
+deposit_poll_min_interval = 1
+deposit_poll_max_interval = 10
+deposit_poll_backoff = 1.5
+deposit_history_margin = 600  # Запас окна запроса на расхождение часов, секунды
+unwind_latency_window = 1000
+unwind_latency_log_every = 10
+
+# Продажа депозита на Binance частями
+sell_mode = "market"  # "market" или "ioc"
+sell_book_depth = 20  # Сколько уровней бидов смотрим при выборе размера части
+sell_slice_max_impact = 0.002  # Часть не уходит глубже этой доли от лучшего бида
+sell_default_slices = 3  # Если стакан не синхронизирован
+sell_max_slices = 10
+sell_max_parallel_orders = 4
+sell_order_interval = 0.1  # Минимальная пауза между ордерами, секунды
+sell_ioc_price_offset = 0.001  # Запас цены IOC ордера ниже VWAP части
+rebuy_usdt_buffer = 0.1  # Сколько USDT не тратим при докупке базового токена
+
+telegram_workers = 2
+telegram_queue_size = 100
 
 chain = {
     "avalanche": {
         "network_base_token": "0xB31f66AA3C1e785363F0875A1B74E27b85FD66c7",  # WAVAX
         "WAVAX": "0xB31f66AA3C1e785363F0875A1B74E27b85FD66c7",
+        # LFJ Liquidity Book v2.2
+        "lfg_router": "0x18556DA13313f3532c54711497A8FedAC273220E",
+        "lfg_quoter": "0x9A550a522BBaDFB69019b0432800Ed17855A51C3",
         "swap_size": 50,
+        "swap_sizes": [5, 10, 20, 35, 50, 75, 100],  # Кандидаты для подбора размера
+        # Лимиты базового токена в свапах, которые еще не проданы на CEX
+        "max_token_exposure": 100,
+        "max_total_exposure": 250,
         "USDC": "0xB97EF9Ef8734C71904D8002F8b6Bc66Dd9c48a6E",
         "USDT": "0x9702230A8Ea53601f5cD2dc00fDBc13d4dF4A8c7",
         "STG": "0x2F6F07CDcf3588944Bf4C42aC74ff24bF56e7590",
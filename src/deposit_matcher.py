@@ -0,0 +1,155 @@
+import threading
+import time
+from concurrent.futures import Future
+
+from loguru import logger
+
+from config import constants
+
+
+class DepositTimeout(Exception):
+    pass
+
+
+class DepositMatcher:
+    """
+    Сопоставляет депозиты Binance с ожидающими их свапами в памяти.
+    watch(tx_hash) возвращает Future, который резолвится записью депозита, как
+    только у него status == 1. История депозитов запрашивается одним потоком
+    и только за окно с момента самого старого ожидаемого депозита. Пока есть
+    новые ожидания или депозиты меняют статус, опрос частый, без изменений
+    интервал растет, а без ожиданий поток спит до следующего watch.
+    Завершенный Future хранится, пока его не заберет следующий watch того же
+    tx_hash: стадия пайплайна вызывает watch заново после каждого повтора.
+    """
+
+    def __init__(self, cex_client):
+        self.cex_client = cex_client
+        self.lock = threading.Lock()
+        # tx_hash -> {"future", "since", "deadline"}
+        self.waiters = {}
+        # tx_hash -> завершенный Future, который еще не забрали через watch
+        self.finished = {}
+        # Статусы уже виденных депозитов, чтобы замечать изменения
+        self.statuses = {}
+        self.interval = constants.deposit_poll_min_interval
+        self.wakeup = threading.Event()
+        self.running = False
+
+    def start(self):
+        self.running = True
+        threading.Thread(target=self.poll_loop, args=(), daemon=True).start()
+
+    def stop(self):
+        self.running = False
+        self.wakeup.set()
+
+    def watch(self, tx_hash, since=None, timeout=None):
+        """
+        since - время отправки свапа (unix, секунды), с него начинается окно
+        запроса. Повторный watch того же tx_hash возвращает тот же Future,
+        в том числе один раз после его завершения. По истечении timeout Future
+        завершается с DepositTimeout.
+        """
+        with self.lock:
+            future = self.finished.get(tx_hash)
+            if future is not None:
+                # Результат ставится вне блокировки, до этого Future не отдаем
+                if future.done():
+                    del self.finished[tx_hash]
+                return future
+            waiter = self.waiters.get(tx_hash)
+            if waiter is not None:
+                return waiter["future"]
+
+            now = time.time()
+            waiter = {
+                "future": Future(),
+                "since": since or now,
+                "deadline": now + (timeout or constants.deposit_timeout),
+            }
+            self.waiters[tx_hash] = waiter
+            self.interval = constants.deposit_poll_min_interval
+        self.wakeup.set()
+        return waiter["future"]
+
+    def cancel(self, tx_hash):
+        with self.lock:
+            waiter = self.waiters.pop(tx_hash, None)
+            self.finished.pop(tx_hash, None)
+        if waiter is not None:
+            waiter["future"].cancel()
+
+    def get_pending_count(self):
+        with self.lock:
+            return len(self.waiters)
+
+    def poll_loop(self):
+        while self.running:
+            if not self.get_pending_count():
+                self.wakeup.wait()
+                self.wakeup.clear()
+                continue
+
+            try:
+                changed = self.poll()
+            except Exception as e:
+                logger.error(f"Error requesting Binance deposit history: {e}")
+                changed = False
+
+            with self.lock:
+                if changed:
+                    self.interval = constants.deposit_poll_min_interval
+                else:
+                    self.interval = min(
+                        self.interval * constants.deposit_poll_backoff,
+                        constants.deposit_poll_max_interval,
+                    )
+                interval = self.interval
+
+            self.wakeup.wait(interval)
+            self.wakeup.clear()
+
+    def poll(self):
+        # Возвращает True, если появились новые депозиты или сменился статус
+        with self.lock:
+            if not self.waiters:
+                return False
+            since = min(waiter["since"] for waiter in self.waiters.values())
+
+        start_time = int((since - constants.deposit_history_margin) * 1000)
+        deposits = self.cex_client.get_deposit_history(startTime=start_time)
+
+        changed = False
+        resolved = []
+        with self.lock:
+            for deposit in deposits:
+                tx_hash = deposit["txId"]
+                if self.statuses.get(tx_hash) != deposit["status"]:
+                    self.statuses[tx_hash] = deposit["status"]
+                    changed = True
+                if deposit["status"] == 1 and tx_hash in self.waiters:
+                    waiter = self.waiters.pop(tx_hash)
+                    self.finished[tx_hash] = waiter["future"]
+                    resolved.append((waiter, deposit))
+
+            now = time.time()
+            expired = [
+                tx_hash
+                for tx_hash, waiter in self.waiters.items()
+                if waiter["deadline"] < now
+            ]
+            expired = [(self.waiters.pop(tx_hash), tx_hash) for tx_hash in expired]
+            for waiter, tx_hash in expired:
+                self.finished[tx_hash] = waiter["future"]
+
+            # Статусы нужны только по депозитам в окне ожидания
+            if not self.waiters:
+                self.statuses = {}
+
+        # Future резолвим вне блокировки: колбэки могут вызвать watch
+        for waiter, deposit in resolved:
+            waiter["future"].set_result(deposit)
+        for waiter, tx_hash in expired:
+            waiter["future"].set_exception(DepositTimeout(tx_hash))
+        return changed
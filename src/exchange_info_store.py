@@ -0,0 +1,99 @@
+import json
+import threading
+import time
+
+from loguru import logger
+
+from helpful_functions import convert_format, atomic_write_json
+from config import constants
+
+
+class ExchangeInfoStore:
+    """
+    Данные биржи по монетам и сетям в памяти с индексом по (currency, chainId).
+    Файл data/{cex}_exchange_info.json остается только кэшем между перезапусками:
+    он читается один раз при создании и перезаписывается после обновления.
+    """
+
+    def __init__(self, cex_client, cex):
+        self.cex_client = cex_client
+        self.cex = cex
+        self.filename = f"data/{cex}_exchange_info.json"
+        self.timestamp = 0
+        # (currency, chainId) -> chain
+        self.chains = {}
+        # currency -> [chainId, ...]
+        self.networks = {}
+        self.running = False
+
+        self.load_from_file()
+
+    def load_from_file(self):
+        try:
+            with open(self.filename, "r") as file:
+                data = json.load(file)
+        except FileNotFoundError:
+            return
+        self.build_index(data["data"], data["timestamp"])
+
+    def build_index(self, data, timestamp):
+        chains = {}
+        networks = {}
+        for asset in data:
+            currency = asset["currency"]
+            networks[currency] = []
+            for chain in asset.get("chains", []):
+                chains[(currency, chain["chainId"])] = chain
+                networks[currency].append(chain["chainId"])
+
+        # Подменяем индексы целиком, чтобы читатели не видели половину обновления
+        self.chains, self.networks, self.timestamp = chains, networks, timestamp
+
+    def is_old(self):
+        return self.timestamp < time.time() - constants.data_is_old
+
+    def refresh(self):
+        data = convert_format(self.cex_client.get_all_coins_info(), self.cex)
+        timestamp = time.time()
+        self.build_index(data, timestamp)
+        atomic_write_json(self.filename, {"timestamp": timestamp, "data": data})
+
+    def start(self):
+        # Обновление в фоне, как только данные старше data_is_old
+        self.running = True
+        threading.Thread(target=self.refresh_loop, args=(), daemon=True).start()
+
+    def stop(self):
+        self.running = False
+
+    def refresh_loop(self):
+        while self.running:
+            if self.is_old():
+                try:
+                    self.refresh()
+                except Exception as e:
+                    logger.error(f"Error updating {self.cex} exchange info: {e}")
+                    time.sleep(constants.exchange_info_retry_delay)
+                    continue
+
+            time.sleep(
+                max(self.timestamp + constants.data_is_old - time.time(), 0) + 0.1
+            )
+
+    def get_chain(self, currency, network):
+        return self.chains.get((currency, network))
+
+    def get_withdrawal_fee(self, currency, network):
+        chain = self.get_chain(currency, network)
+        return float(chain["withdrawalMinFee"]) if chain else None
+
+    def get_min_withdraw(self, currency, network):
+        chain = self.get_chain(currency, network)
+        return float(chain["withdrawalMinSize"]) if chain else None
+
+    def get_available_networks(self, currency):
+        return self.networks.get(currency, [])
+
+    def deposit_is_open(self, currency, network):
+        chain = self.get_chain(currency, network)
+        return bool(chain and chain["isDepositEnabled"])
@@ -0,0 +1,182 @@
+import itertools
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from loguru import logger
+
+from config import constants
+
+
+class ExecutionScheduler:
+    """
+    Исполняет несколько возможностей из ранжированного списка за один скан.
+    Свободный баланс делится между сделками по порядку ранга, с лимитами
+    экспозиции на токен и в сумме. Экспозиция - базовый токен, ушедший в свап
+    и еще не вернувшийся с CEX, она держится до конца продажи на CEX.
+    Сделки через общую пару LB в один скан не берутся: первая сдвинет цену
+    для второй. Возможности без положительного ожидаемого профита на текущих
+    ценах не исполняются. Отправка идет параллельно, nonce подряд выдает
+    NonceManager.
+    """
+
+    def __init__(
+        self, network, balance_ledger, size_optimizer, get_sell_price, make_trade
+    ):
+        self.network = network
+        self.balance_ledger = balance_ledger
+        self.size_optimizer = size_optimizer
+        self.get_sell_price = get_sell_price
+        self.make_trade = make_trade
+
+        self.max_token_exposure = constants.chain[network]["max_token_exposure"]
+        self.max_total_exposure = constants.chain[network]["max_total_exposure"]
+
+        self.lock = threading.Lock()
+        # position_id -> (token, amount в базовом токене)
+        self.positions = {}
+        self.position_ids = itertools.count(1)
+        self.executor = ThreadPoolExecutor(
+            max_workers=constants.max_concurrent_trades,
+            thread_name_prefix="execution",
+        )
+
+    def get_exposure(self, token=None):
+        # Экспозиция по токену или общая, в базовом токене
+        with self.lock:
+            return self.exposure(token)
+
+    def exposure(self, token=None):
+        return sum(
+            amount
+            for position_token, amount in self.positions.values()
+            if token is None or position_token == token
+        )
+
+    def close_position(self, position_id):
+        # Вызывается после продажи на CEX или если свап не прошел
+        if position_id is None:
+            return
+        with self.lock:
+            self.positions.pop(position_id, None)
+
+    def execute(self, opportunities, cex_prices):
+        """
+        Распределяет баланс и отправляет свапы. Ждет только отправки, не квитанций.
+        Возвращает список tx_hash отправленных свапов.
+        """
+        plan = self.allocate(opportunities, cex_prices)
+        if not plan:
+            return []
+
+        logger.info(
+            "Executing: "
+            + ", ".join(
+                f"{opportunity.token_name} {opportunity.amount_in / 10**18}"
+                for opportunity, _ in plan
+            )
+        )
+        futures = [
+            self.executor.submit(self.submit, opportunity, position_id)
+            for opportunity, position_id in plan
+        ]
+        return [tx_hash for tx_hash in (f.result() for f in futures) if tx_hash]
+
+    def submit(self, opportunity, position_id):
+        try:
+            tx_hash = self.make_trade(opportunity, position_id)
+        except Exception as e:
+            logger.error(f"Trade for {opportunity.token_name} failed: {e}")
+            tx_hash = None
+        if tx_hash is None:
+            self.close_position(position_id)
+        return tx_hash
+
+    def allocate(self, opportunities, cex_prices):
+        # Список (opportunity с выбранным размером, position_id). Размеры
+        # выбираются без блокировки: size_optimizer может ходить в RPC за газом.
+        # Под блокировкой только проверка лимитов и запись позиций, которые
+        # за это время могли занять другие потоки.
+        selected_sizes = self.select_sizes(opportunities, cex_prices)
+        plan = []
+        with self.lock:
+            budget = self.get_budget()
+            for planned in selected_sizes:
+                token = planned.token_name
+                # Та же проверка, что в select_size: amount_in <= limit * 10**18
+                limit = min(budget, self.max_token_exposure - self.exposure(token))
+                if planned.amount_in > limit * 10**18:
+                    logger.debug(f"{token} no longer fits the exposure limits.")
+                    continue
+                position_id = next(self.position_ids)
+                self.positions[position_id] = (token, planned.amount_in / 10**18)
+                budget -= planned.amount_in / 10**18
+                plan.append((planned, position_id))
+        return plan
+
+    def get_budget(self):
+        # Вызывается под self.lock
+        return min(
+            self.balance_ledger.available()
+            - constants.min_balance_for_gas[self.network],
+            self.max_total_exposure - self.exposure(),
+        )
+
+    def select_sizes(self, opportunities, cex_prices):
+        # Копии возможностей с выбранным размером по снимку лимитов
+        with self.lock:
+            budget = self.get_budget()
+            exposures = {
+                opportunity.token_name: self.exposure(opportunity.token_name)
+                for opportunity in opportunities
+            }
+
+        selected_sizes = []
+        used_pairs = set()
+        for opportunity in opportunities:
+            if len(selected_sizes) >= constants.max_concurrent_trades or budget <= 0:
+                break
+
+            token = opportunity.token_name
+            limit = min(budget, self.max_token_exposure - exposures[token])
+            selected = self.select_size(opportunity, limit, cex_prices)
+            if selected is None:
+                continue
+            amount_in, quote, profit = selected
+            if profit is None or profit <= 0:
+                logger.debug(f"{token} has no expected profit: {profit}.")
+                continue
+
+            pairs = {pair.lower() for pair in quote.pairs}
+            if pairs & used_pairs:
+                logger.debug(f"{token} shares a pair with a better trade.")
+                continue
+
+            budget -= amount_in / 10**18
+            exposures[token] += amount_in / 10**18
+            used_pairs |= pairs
+            # Копия: запись скана перезапишется, пока сделка отправляется
+            planned = opportunity.copy(amount_in, quote)
+            planned.expected_profit = profit
+            selected_sizes.append(planned)
+        return selected_sizes
+
+    def select_size(self, opportunity, limit, cex_prices):
+        """
+        Размер, выбранный при скане, если влезает в лимит, иначе лучший из
+        меньших. Возвращает (amount_in, quote, profit) или None. Профит
+        пересчитывается по текущим ценам: у back-run котировка уже не та,
+        что при скане.
+        """
+        if opportunity.amount_in <= limit * 10**18:
+            candidates = [(opportunity.amount_in, opportunity.quote)]
+        else:
+            candidates = [
+                (amount_in, quote)
+                for amount_in, quote in opportunity.candidates or []
+                if amount_in <= limit * 10**18
+            ]
+        if not candidates:
+            return None
+        return self.size_optimizer.select(
+            opportunity.token_name, candidates, cex_prices, self.get_sell_price
+        )
@@ -1,4 +1,4 @@
-from web3 import Web3
+from web3 import Web3, AsyncWeb3
 from web3.exceptions import TransactionNotFound
 
 from binance import Client
@@ -10,27 +10,53 @@ import time
 from loguru import logger
 import os
 import dotenv
+import tempfile
 import threading
 
 import config.constants as constants
+from binance_scheduler import BinanceScheduler
+from rpc_provider import AsyncMultiEndpointProvider, MultiEndpointProvider
 
 dotenv.load_dotenv()
 
 
 logger.add("logs.log", level="DEBUG")
 
-AVALANCHE_RPC = os.environ.get("AVALANCHE_RPC")
+
+def get_rpc_urls(network):
+    # Несколько RPC через запятую в {NETWORK}_RPCS. {NETWORK}_RPC - старое имя
+    # для одного URL.
+    urls = os.environ.get(f"{network.upper()}_RPCS") or os.environ.get(
+        f"{network.upper()}_RPC"
+    )
+    return [url.strip() for url in (urls or "").split(",") if url.strip()]
+
+
+RPC_URLS = {network: get_rpc_urls(network) for network in constants.network_base_token}
 
 
 def initialize_web3(network):
-    rpc_urls = {
-        "avalanche": AVALANCHE_RPC,
-    }
-    rpc_url = rpc_urls.get(network)
-    web3 = Web3(Web3.HTTPProvider(rpc_url))
+    # Пул соединений на каждый RPC, чтение с самого быстрого, рассылка транзакций во все
+    provider = MultiEndpointProvider(RPC_URLS.get(network))
+    provider.start()
+    web3 = Web3(provider)
     return web3
 
 
+def initialize_mempool_web3(network):
+    # Фильтр pending транзакций живет на одной ноде, поэтому без пула RPC.
+    # {NETWORK}_MEMPOOL_RPC или первый RPC сети.
+    rpc_url = (
+        os.environ.get(f"{network.upper()}_MEMPOOL_RPC") or RPC_URLS[network][0]
+    )
+    return Web3(Web3.HTTPProvider(rpc_url))
+
+
+def initialize_async_web3(network):
+    # Тот же пул RPC с переходом на следующий эндпоинт при ошибке
+    return AsyncWeb3(AsyncMultiEndpointProvider(RPC_URLS.get(network)))
+
+
 def initialize_amm_objects(w3: Web3, name, network, type):
     # У всех uniswap один и тот же abi. А адрес контракта сохранен в настройках сети, то есть путаницы не будет.
     if "uniswap" in name:
@@ -54,10 +80,13 @@ def initialize_amm_objects(w3: Web3, name, network, type):
     return contract
 
 
-def initialize_cex_object(cex):
+def initialize_cex_object(cex, weight_budget=None):
+    # Все REST запросы к Binance идут через общий планировщик с учетом веса.
+    # weight_budget - WeightBudget главного процесса, если процессов несколько
     if cex == "binance":
-        return Client(
-            os.environ.get("BINANCE_PUBLIC"), os.environ.get("BINANCE_SECRET")
+        return BinanceScheduler(
+            Client(os.environ.get("BINANCE_PUBLIC"), os.environ.get("BINANCE_SECRET")),
+            weight_budget,
         )
 
 
@@ -132,16 +161,31 @@ def get_list_of_network_base_tokens(config: dict) -> list:
     return network_base_tokens
 
 
-def get_min_difference(token):
-    # Получаем минимальный порог для арбитража по токену. Если в файле нет, ставим 1%
-    with open("config/min_difference.json") as f:
-        data = json.load(f)
+MIN_DIFFERENCE_FILE = "config/min_difference.json"
+DEFAULT_MIN_DIFFERENCE = 0.01
+min_differences_cache = {"mtime": None, "data": {}}
+
+
+def load_min_differences():
+    # Пороги по токенам. Файл перечитывается, только если он изменился на диске.
+    mtime = os.path.getmtime(MIN_DIFFERENCE_FILE)
+    if mtime != min_differences_cache["mtime"]:
+        with open(MIN_DIFFERENCE_FILE) as f:
+            min_differences_cache["data"] = json.load(f)
+        min_differences_cache["mtime"] = mtime
+    return min_differences_cache["data"]
+
 
-    return data.get(token, 0.01)
+def get_min_difference(token, min_differences=None):
+    # Получаем минимальный порог для арбитража по токену. Если в файле нет, ставим 1%
+    if min_differences is None:
+        min_differences = load_min_differences()
+    return min_differences.get(token, DEFAULT_MIN_DIFFERENCE)
 
 
 def find_best_arbitrage_opportunity(cex_prices, dex_prices):
     discrepancies = []
+    min_differences = load_min_differences()
 
     for token, dex_info in dex_prices.items():
         max_price_difference = 0
@@ -165,7 +209,7 @@ def find_best_arbitrage_opportunity(cex_prices, dex_prices):
                 )
 
                 price_difference = (cex_price - dex_price_in_usdt) / cex_price
-                min_difference = get_min_difference(token)
+                min_difference = get_min_difference(token, min_differences)
 
                 if (
                     price_difference > max_price_difference
@@ -255,33 +299,6 @@ def wait_for_transaction_receipt(w3: Web3, tx_hash, timeout=300):
             time.sleep(1)
 
 
-def deposit_is_open(token, network):
-    with open("data/all_coins_info.json", "r") as file:
-        data = json.load(file)
-    data = data["data"]
-
-    binance_network = constants.binance_network_map[network]
-    for i in data:
-        if i["coin"] == token:
-            for j in i["networkList"]:
-                if j["network"] == binance_network:
-                    return j["depositEnable"]
-
-
-def get_available_networks(token, cex_name):
-    # Возвращает список всех доступных сетей для депозита токена на конкретном СЕХ
-    with open(f"data/{cex_name}_exchange_info.json", "r") as file:
-        data = json.load(file)
-
-    for i in data["data"]:
-        if i["currency"] == token:
-            chains = i.get("chains", [])
-            return [chain["chainId"] for chain in chains]
-
-    # Возвращаем пустой список, если токен не найден
-    return []
-
-
 def get_tokens_for_cex(config: dict, cex_name: str) -> list:
     # Создаем список для хранения токенов, связанных с заданным CEX
     tokens_for_cex = []
@@ -336,28 +353,25 @@ def convert_format(data, cex):
     return converted_data
 
 
-def get_withdrawal_fee(currency, network, cex_name):
-    if cex_name == "binance":
-        with open("data/binance_exchange_info.json") as file:
-            exchange_info = json.load(file)
-            for asset in exchange_info["data"]:
-                if asset["currency"] == currency:
-                    for chain in asset["chains"]:
-                        if chain["chainId"] == network:
-                            return float(chain["withdrawalMinFee"])
-    return None
-
-
-def get_min_withdraw(currency, network, cex_name):
-    if cex_name == "binance":
-        with open("data/binance_exchange_info.json") as file:
-            exchange_info = json.load(file)
-            for asset in exchange_info["data"]:
-                if asset["currency"] == currency:
-                    for chain in asset["chains"]:
-                        if chain["chainId"] == network:
-                            return float(chain["withdrawalMinSize"])
-    return None
+def atomic_write_json(filename, data):
+    # Пишем во временный файл и подменяем через rename, чтобы при падении
+    # на диске остался либо старый, либо новый файл целиком. Имя временного
+    # файла уникальное: один и тот же файл могут писать несколько процессов.
+    with tempfile.NamedTemporaryFile(
+        "w",
+        dir=os.path.dirname(filename) or ".",
+        prefix=f"{os.path.basename(filename)}.",
+        suffix=".tmp",
+        delete=False,
+    ) as file:
+        json.dump(data, file)
+        file.flush()
+        os.fsync(file.fileno())
+    try:
+        os.replace(file.name, filename)
+    except Exception:
+        os.remove(file.name)
+        raise
 
 
 def calculate_slippage(difference):
@@ -1,13 +1,32 @@
 import json
+import time
+from contextlib import nullcontext
+from loguru import logger
 from web3 import Web3
 from web3.middleware import geth_poa_middleware
 import os
 from config import constants
+from helpful_functions import get_chain_id
+from records import Quote
+from tx_manager import NonceManager, FeeOracle
+from swap_templates import SwapTemplateCache
+
+# Тип возвращаемой структуры LBQuoter.Quote для ручного декодирования
+QUOTE_OUTPUT_TYPE = (
+    "(address[],address[],uint256[],uint8[],uint128[],uint128[],uint128[])"
+)
+
+
+def format_quote(quote):
+    # Приводим tuple LBQuoter.Quote к записи Quote
+    return Quote(*quote)
 
 
 class LFGclient:
-    def __init__(self, web3_object):
+    def __init__(self, web3_object, network="avalanche"):
         self.web3 = web3_object
+        self.network = network
+        self.chain_id = get_chain_id(network)
 
         # Добавляем Middleware для поддержки PoA сетей
         self.web3.middleware_onion.inject(geth_poa_middleware, layer=0)
@@ -18,14 +37,20 @@ class LFGclient:
             raise ValueError("PRIVATE_KEY environment variable not set")
         self.account = self.web3.eth.account.from_key(private_key)
 
-        self.router_address = "0x18556DA13313f3532c54711497A8FedAC273220E"
-        self.quoter_address = "0x9A550a522BBaDFB69019b0432800Ed17855A51C3"
+        # Локальные nonce и кэш комиссии, чтобы не ходить в RPC перед отправкой
+        self.nonce_manager = NonceManager(self.web3, self.account.address)
+        self.fee_oracle = FeeOracle(self.web3)
+
+        self.router_address = constants.chain[network]["lfg_router"]
+        self.quoter_address = constants.chain[network]["lfg_quoter"]
 
         # Load ABIs
         with open(constants.ROUTER_ABI_PATH) as f:
             self.router_abi = json.load(f)
         with open(constants.QUOTER_ABI_PATH) as f:
             self.quoter_abi = json.load(f)
+        with open(constants.MULTICALL3_ABI_PATH) as f:
+            self.multicall_abi = json.load(f)
 
         self.router = self.web3.eth.contract(
             address=self.web3.to_checksum_address(self.router_address),
@@ -35,23 +60,84 @@ class LFGclient:
             address=self.web3.to_checksum_address(self.quoter_address),
             abi=self.quoter_abi,
         )
+        self.multicall = self.web3.eth.contract(
+            address=self.web3.to_checksum_address(constants.multicall3_address),
+            abi=self.multicall_abi,
+        )
+
+        # Заранее закодированные свапы, в которых меняются только minOut и deadline
+        self.swap_templates = SwapTemplateCache(self)
+
+    def hedged(self):
+        # Хеджирование eth_call котировок, если провайдер его поддерживает
+        hedging = getattr(self.web3.provider, "hedging", None)
+        if hedging is None or not constants.quote_hedging:
+            return nullcontext()
+        return hedging()
 
     def get_best_path_from_amount_in(self, token_path, amount_in):
         token_path = [self.web3.to_checksum_address(addr) for addr in token_path]
 
-        quote = self.quoter.functions.findBestPathFromAmountIn(
-            token_path, amount_in
-        ).call()
+        with self.hedged():
+            quote = self.quoter.functions.findBestPathFromAmountIn(
+                token_path, amount_in
+            ).call()
+
+        return format_quote(quote)
+
+    def get_best_paths_from_amount_in(self, requests, quotes=None):
+        """
+        Квотирует сразу много пар (token_path, amount_in) одним eth_call через
+        Multicall3.aggregate3. Возвращает котировки в том же порядке, что и requests.
+        Если подвызов ревертнулся или вернул нулевой выход, на его месте будет None,
+        остальные котировки не теряются. quotes - записи Quote под каждый запрос
+        (из ScanBuffer), в которые декодируются результаты вместо новых.
+        """
+        calls = [
+            (self.quoter.address, True, self.encode_quote_call(token_path, amount_in))
+            for token_path, amount_in in requests
+        ]
+        with self.hedged():
+            results = self.aggregate3(calls)
+        if quotes is None:
+            quotes = [None] * len(results)
+        return [
+            self.decode_quote_result(success, return_data, quote)
+            for (success, return_data), quote in zip(results, quotes)
+        ]
 
-        return {
-            "route": quote[0],
-            "pairs": quote[1],
-            "bin_steps": quote[2],
-            "versions": quote[3],
-            "amounts": quote[4],
-            "virtual_amounts": quote[5],
-            "fees": quote[6],
-        }
+    def encode_quote_call(self, token_path, amount_in):
+        token_path = [self.web3.to_checksum_address(addr) for addr in token_path]
+        return self.quoter.encodeABI(
+            fn_name="findBestPathFromAmountIn", args=[token_path, amount_in]
+        )
+
+    def decode_quote_result(self, success, return_data, quote=None):
+        # quote - запись, которую заполнить на месте, иначе создается новая
+        if not success or not return_data:
+            return None
+        try:
+            decoded = self.web3.codec.decode([QUOTE_OUTPUT_TYPE], return_data)
+            if quote is None:
+                quote = format_quote(decoded[0])
+            else:
+                quote.load(decoded[0])
+        except Exception as e:
+            logger.warning(f"Quote decoding failed: {e}")
+            return None
+
+        # Квотер не ревертит при отсутствии пула, а возвращает нули
+        if not quote.amounts or quote.amount_out == 0:
+            return None
+        return quote
+
+    def aggregate3(self, calls, block_identifier="latest"):
+        # calls: список (target, allow_failure, call_data). Возвращает список (success, return_data)
+        if not calls:
+            return []
+        return self.multicall.functions.aggregate3(calls).call(
+            block_identifier=block_identifier
+        )
 
     def swap_exact_avax_for_tokens(
         self,
@@ -60,69 +146,53 @@ class LFGclient:
         slippage_percent=1.0,
         recipient=None,
         deadline_minutes=20,
+        quote=None,
     ):
+        """
+        Подписывает и отправляет свап, не дожидаясь квитанции. Возвращает tx_hash.
+        Если передана quote из скана, повторного квотирования нет.
+        """
         # Prepare token path (WAVAX -> token)
-        wavax_address = constants.chain["avalanche"]["WAVAX"]
+        base_token_address = constants.chain[self.network]["network_base_token"]
         token_path = [
-            self.web3.to_checksum_address(wavax_address),
+            self.web3.to_checksum_address(base_token_address),
             self.web3.to_checksum_address(token_address),
         ]
 
         # Get quote for the swap
-        quote = self.get_best_path_from_amount_in(token_path, amount_in_wei)
+        if quote is None:
+            quote = self.get_best_path_from_amount_in(token_path, amount_in_wei)
+        token_path = quote["route"]
 
         # Calculate minimum amount out with slippage
         amount_out = quote["amounts"][-1]  # Last amount is the output amount
         min_amount_out = int(amount_out * (100 - slippage_percent) / 100)
 
-        # Calculate deadline
-        deadline = self.web3.eth.get_block("latest").timestamp + (deadline_minutes * 60)
-
-        # Prepare path struct
-        path = {
-            "tokenPath": token_path,
-            "pairBinSteps": quote["bin_steps"],
-            "versions": quote["versions"],
-        }
-
-        base_fee = self.web3.eth.gas_price
-        max_priority_fee = int(
-            base_fee * 0.2
-        )  # Установите приоритетную комиссию (например, 20% от baseFee)
-        max_fee_per_gas = base_fee + max_priority_fee
+        # Deadline по локальным часам, без запроса последнего блока
+        deadline = int(time.time()) + deadline_minutes * 60
 
         if recipient is None:
             recipient = self.account.address
 
-        # Build transaction
-        tx = self.router.functions.swapExactNATIVEForTokens(
-            min_amount_out, path, recipient, deadline
-        ).build_transaction(
-            {
-                "from": self.account.address,
-                "value": amount_in_wei,
-                "maxFeePerGas": max_fee_per_gas,
-                "maxPriorityFeePerGas": max_priority_fee,
-                "nonce": self.web3.eth.get_transaction_count(self.account.address),
-                "chainId": 43114,  # Avalanche C-Chain ID
-            }
+        # Готовый calldata и лимит газа по маршруту и размеру
+        template = self.swap_templates.get_template(
+            token_path, quote["bin_steps"], quote["versions"], amount_in_wei, recipient
         )
 
-        # Estimate gas
-        try:
-            gas_estimate = self.web3.eth.estimate_gas(tx)
-            tx["gas"] = int(gas_estimate * 1.2)  # Add 20% buffer
-        except Exception as e:
-            print(f"Gas estimation failed: {e}")
-            tx["gas"] = 500000  # Fallback gas limit
-
         # Sign transaction
-        signed_tx = self.web3.eth.account.sign_transaction(tx, self.account.key)
-
-        # Send transaction
-        tx_hash = self.web3.eth.send_raw_transaction(signed_tx.rawTransaction)
+        signed_tx = self.swap_templates.sign(
+            template,
+            min_amount_out,
+            deadline,
+            self.nonce_manager.get_nonce(),
+            self.fee_oracle.get_fees(),
+        )
 
-        # Wait for transaction receipt
-        tx_receipt = self.web3.eth.wait_for_transaction_receipt(tx_hash)
+        # Send transaction. При ошибке nonce мог не использоваться - перечитываем.
+        try:
+            tx_hash = self.web3.eth.send_raw_transaction(signed_tx.rawTransaction)
+        except Exception:
+            self.nonce_manager.resync()
+            raise
 
-        return tx_receipt
+        return tx_hash.hex()
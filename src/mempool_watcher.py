@@ -0,0 +1,294 @@
+import json
+import os
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from loguru import logger
+from web3 import Web3
+
+from helpful_functions import get_min_difference, initialize_mempool_web3
+from lb_simulator import LB_VERSIONS
+from records import Quote
+from telegram import send_message_async
+from config import constants
+
+
+def to_hex(value):
+    # HexBytes из web3 или уже hex-строка из JSON-RPC и записанного потока
+    return value if isinstance(value, str) else Web3.to_hex(value)
+
+
+class MempoolWatcher:
+    """
+    Смотрит pending транзакции к роутеру LFG. Свапы swapExact* через пары,
+    которые отслеживает LBSimulator, проигрываются на копии состояния пар,
+    и по этому состоянию пересчитываются маршруты токенов из последнего скана
+    (снимок, который сканер передает в publish). Если разница с CEX выше
+    порога, готовится шаблон свапа и back-run ставится в очередь, из которой
+    его отправляет on_backrun, не дожидаясь блока. Ордер в блоке не
+    гарантирован: если наш свап пройдет раньше целевого, он откатится по
+    amountOutMin.
+
+    process_transaction(tx) не зависит от источника, поэтому записанный поток
+    (mempool_record_file) можно прогнать через replay().
+    """
+
+    def __init__(
+        self,
+        network,
+        lfg_client,
+        lb_simulator,
+        get_cex_prices,
+        get_sell_price,
+        on_backrun,
+    ):
+        self.network = network
+        self.lfg_client = lfg_client
+        self.lb_simulator = lb_simulator
+        # token -> копия Opportunity последнего скана, заменяется целиком
+        self.opportunities = {}
+        self.get_cex_prices = get_cex_prices
+        self.get_sell_price = get_sell_price
+        self.on_backrun = on_backrun
+        self.base_token = constants.network_base_token[network]
+        self.router_address = lfg_client.router.address.lower()
+
+        self.w3 = None
+        self.executor = ThreadPoolExecutor(
+            max_workers=constants.mempool_fetch_workers,
+            thread_name_prefix="mempool",
+        )
+        self.backruns = queue.Queue(maxsize=constants.mempool_queue_size)
+        self.record_lock = threading.Lock()
+        self.test_mode = True
+        self.running = False
+
+    def start(self, test_mode=True):
+        self.test_mode = test_mode
+        self.w3 = initialize_mempool_web3(self.network)
+        self.running = True
+        threading.Thread(target=self.watch_loop, args=(), daemon=True).start()
+        threading.Thread(target=self.backrun_loop, args=(), daemon=True).start()
+
+    def stop(self):
+        self.running = False
+
+    def publish(self, amm_prices):
+        # Записи scan_buffer перезаписываются следующим сканом, поэтому потокам
+        # мемпула отдаем их копии
+        if not self.running:
+            return
+        self.opportunities = {
+            token: opportunity.copy() for token, opportunity in amm_prices.items()
+        }
+
+    def watch_loop(self):
+        pending_filter = None
+        while self.running:
+            try:
+                if pending_filter is None:
+                    pending_filter = self.w3.eth.filter("pending")
+                for tx_hash in pending_filter.get_new_entries():
+                    self.executor.submit(self.fetch_and_process, tx_hash)
+            except Exception as e:
+                # Нода могла забыть фильтр, создаем заново
+                logger.error(f"Error polling pending transactions: {e}")
+                pending_filter = None
+                time.sleep(1)
+            time.sleep(constants.mempool_poll_interval)
+
+    def fetch_and_process(self, tx_hash):
+        try:
+            tx = self.w3.eth.get_transaction(tx_hash)
+        except Exception as e:
+            # Транзакция уже в блоке или выкинута из мемпула
+            logger.debug(f"Pending transaction {Web3.to_hex(tx_hash)} not found: {e}")
+            return
+        if not tx.get("to") or tx["to"].lower() != self.router_address:
+            return
+
+        self.record(tx)
+        try:
+            backruns = self.process_transaction(tx)
+        except Exception as e:
+            logger.error(f"Error processing pending transaction: {e}")
+            return
+        for opportunity in backruns:
+            self.queue_backrun(tx, opportunity)
+
+    def process_transaction(self, tx):
+        """
+        tx - словарь с to, input, value (как из eth_getTransactionByHash или
+        из записанного потока). Возвращает список Opportunity для back-run.
+        """
+        if not tx.get("to") or tx["to"].lower() != self.router_address:
+            return []
+        swap = self.decode_swap(tx)
+        if swap is None:
+            return []
+
+        states = self.simulate_swap(*swap)
+        if not states:
+            return []
+        return self.find_backruns(states)
+
+    def decode_swap(self, tx):
+        # (amount_in, token_path, bin_steps, versions) для swapExact* или None
+        try:
+            function, params = self.lfg_client.router.decode_function_input(
+                tx["input"]
+            )
+        except ValueError:
+            return None
+        if not function.fn_name.startswith("swapExact"):
+            return None
+
+        if function.fn_name.startswith("swapExactNATIVE"):
+            amount_in = int(tx["value"])
+        else:
+            amount_in = params["amountIn"]
+        path = params["path"]
+        return amount_in, path["tokenPath"], path["pairBinSteps"], path["versions"]
+
+    def simulate_swap(self, amount_in, token_path, bin_steps, versions):
+        # Копии отслеживаемых пар после чужого свапа: {адрес пары: LBPairState}.
+        # Хопы считаем по порядку до первой пары, которой нет в кэше.
+        states = {}
+        for i, (bin_step, version) in enumerate(zip(bin_steps, versions)):
+            token_in, token_out = token_path[i], token_path[i + 1]
+            state = self.lb_simulator.find_pair(token_in, token_out, bin_step)
+            if version not in LB_VERSIONS or state is None:
+                break
+            # find_pair отдает копию, но пара могла встретиться в пути раньше
+            state = states.setdefault(state.address.lower(), state)
+            amount_in = state.swap(amount_in, token_in.lower() == state.token_x.lower())
+            if amount_in is None:
+                break
+        return states
+
+    def find_backruns(self, states):
+        # Маршруты последнего скана через затронутые пары, пересчитанные по states
+        cex_prices = self.get_cex_prices()
+        base_price = cex_prices.get(self.base_token)
+        if not base_price:
+            return []
+
+        backruns = []
+        for token, record in self.opportunities.items():
+            quote = record.quote
+            if quote is None or token not in cex_prices:
+                continue
+            if not {pair.lower() for pair in quote.pairs} & states.keys():
+                continue
+
+            amounts = self.simulate_route(quote, record.amount_in, states)
+            if amounts is None:
+                continue
+            opportunity = record.copy(
+                record.amount_in,
+                Quote(
+                    quote.route,
+                    quote.pairs,
+                    quote.bin_steps,
+                    quote.versions,
+                    tuple(amounts),
+                    quote.virtual_amounts,
+                    quote.fees,
+                ),
+            )
+
+            cex_price = self.get_sell_price(token, amounts[-1] / 10**18)
+            if not cex_price:
+                continue
+            difference = (cex_price - opportunity.price * base_price) / cex_price
+            if difference > get_min_difference(token) and difference > 0:
+                opportunity.cex = "binance"
+                opportunity.difference = difference
+                backruns.append(opportunity)
+        return sorted(
+            backruns, key=lambda opportunity: opportunity.difference, reverse=True
+        )
+
+    def simulate_route(self, quote, amount_in, states):
+        # amounts по хопам нашего маршрута поверх состояния после чужого свапа
+        return self.lb_simulator.simulate_quote(quote, amount_in, states)
+
+    def queue_backrun(self, tx, opportunity):
+        # Шаблон готовим здесь, чтобы при отправке осталась только подпись
+        quote = opportunity.quote
+        try:
+            self.lfg_client.swap_templates.get_template(
+                quote.route,
+                quote.bin_steps,
+                quote.versions,
+                opportunity.amount_in,
+                os.environ.get("BINANCE_DEPOSIT_ADDRESS"),
+            )
+        except Exception as e:
+            logger.error(f"Error preparing back-run template: {e}")
+            return
+
+        tx_hash = to_hex(tx["hash"])
+        try:
+            self.backruns.put_nowait((time.time(), tx_hash, opportunity))
+        except queue.Full:
+            logger.warning(f"Back-run queue is full. Dropped back-run of {tx_hash}.")
+
+    def backrun_loop(self):
+        while self.running:
+            try:
+                queued_at, tx_hash, opportunity = self.backruns.get(timeout=1)
+            except queue.Empty:
+                continue
+            if time.time() - queued_at > constants.mempool_backrun_ttl:
+                logger.debug(f"Back-run of {tx_hash} expired.")
+                continue
+
+            difference = round(opportunity.difference * 100, 1)
+            logger.warning(
+                f"Back-run found: {opportunity.token_name}. "
+                f"Difference: {difference}%. Target TX: {tx_hash}"
+            )
+            send_message_async(
+                f"Back-run found: #{opportunity.token_name}. "
+                f"Difference: {difference}%."
+            )
+            if self.test_mode:
+                continue
+            try:
+                self.on_backrun(opportunity)
+            except Exception as e:
+                logger.error(f"Back-run failed: {e}")
+
+    def record(self, tx):
+        # Пишем транзакции к роутеру в JSON Lines для replay()
+        if not constants.mempool_record_file:
+            return
+        line = json.dumps(
+            {
+                "hash": to_hex(tx["hash"]),
+                "to": tx["to"],
+                "value": int(tx["value"]),
+                "input": to_hex(tx["input"]),
+                "seen_at": time.time(),
+            }
+        )
+        with self.record_lock:
+            with open(constants.mempool_record_file, "a") as file:
+                file.write(line + "\n")
+
+    def replay(self, filename):
+        # Прогоняет записанный поток через process_transaction без отправки.
+        # Возвращает [(tx_hash, [Opportunity, ...]), ...] с найденными back-run.
+        results = []
+        with open(filename) as file:
+            for line in file:
+                if not line.strip():
+                    continue
+                tx = json.loads(line)
+                backruns = self.process_transaction(tx)
+                if backruns:
+                    results.append((tx["hash"], backruns))
+        return results
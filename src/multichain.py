@@ -0,0 +1,354 @@
+# multichain.py
+
+import multiprocessing
+import time
+from multiprocessing import resource_tracker, shared_memory
+
+import numpy as np
+from loguru import logger
+
+from binance_scheduler import WeightBudget
+from binance_streams import BookTicker, BookTickerCache
+from config import constants
+
+# Поля тикера в общей памяти: есть ли тикер, bid, bidQty, ask, askQty, время
+TICKER_FIELDS = 6
+# Заголовок: счетчик seqlock и время последнего сообщения стрима
+HEADER_FIELDS = 2
+
+
+class SharedPriceFeed:
+    """
+    Лучшие цены Binance в разделяемой памяти (multiprocessing.shared_memory).
+    Пишет один процесс, читают процессы сетей. Согласованность через seqlock:
+    писатель делает счетчик нечетным, пишет и делает четным, читатель копирует
+    массив и повторяет, если счетчик был нечетным или изменился за время копии.
+    """
+
+    def __init__(self, symbols, name=None):
+        self.symbols = list(symbols)
+        self.index = {symbol: i for i, symbol in enumerate(self.symbols)}
+        size = (HEADER_FIELDS + len(self.symbols) * TICKER_FIELDS) * 8
+
+        # Без name создаем новый блок, с name подключаемся к существующему
+        self.owner = name is None
+        self.shm = shared_memory.SharedMemory(name=name, create=self.owner, size=size)
+        self.array = np.ndarray(
+            HEADER_FIELDS + len(self.symbols) * TICKER_FIELDS,
+            dtype=np.float64,
+            buffer=self.shm.buf,
+        )
+        if self.owner:
+            self.array.fill(0)
+        else:
+            # Иначе resource_tracker процесса сети удалит блок при его выходе
+            resource_tracker.unregister(self.shm._name, "shared_memory")
+
+    @property
+    def name(self):
+        return self.shm.name
+
+    def publish(self, snapshot, last_message_time):
+        values = np.zeros(len(self.symbols) * TICKER_FIELDS)
+        for symbol, ticker in snapshot.items():
+            i = self.index.get(symbol)
+            if i is None:
+                continue
+            values[i * TICKER_FIELDS : (i + 1) * TICKER_FIELDS] = (
+                1,
+                ticker.bid_price,
+                ticker.bid_qty,
+                ticker.ask_price,
+                ticker.ask_qty,
+                ticker.timestamp,
+            )
+
+        self.array[0] += 1
+        self.array[1] = last_message_time
+        self.array[HEADER_FIELDS:] = values
+        self.array[0] += 1
+
+    def read(self):
+        # (snapshot, last_message_time), согласованный снимок всех тикеров
+        while True:
+            sequence = self.array[0]
+            if sequence % 2:
+                continue
+            data = self.array.copy()
+            if self.array[0] == sequence:
+                break
+
+        snapshot = {}
+        for symbol, i in self.index.items():
+            fields = data[HEADER_FIELDS + i * TICKER_FIELDS :][:TICKER_FIELDS]
+            if fields[0]:
+                snapshot[symbol] = BookTicker(*fields[1:].tolist())
+        return snapshot, data[1]
+
+    def close(self):
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+
+
+class SharedOrderBook:
+    """
+    Биды одного стакана из SharedOrderBooks. get_sell_price как у OrderBook:
+    объем сверх опубликованных уровней оценивается в 0.
+    """
+
+    def __init__(self, prices, quantities):
+        self.prices = prices
+        self.quantities = quantities
+
+    def get_sell_price(self, quantity):
+        if quantity <= 0:
+            return None
+        before = np.cumsum(self.quantities) - self.quantities
+        filled = np.clip(quantity - before, 0, self.quantities)
+        notional = float(filled @ self.prices)
+        return notional / quantity if notional else None
+
+
+class SharedOrderBooks:
+    """
+    Лучшие depth уровней бидов стаканов OrderBookMirror в разделяемой памяти.
+    Стаканы держит один процесс (снапшоты по REST стоят 50 веса на символ),
+    процессы-сканеры читают отсюда цену продажи объема через get_book.
+    Согласованность через seqlock, как в SharedPriceFeed.
+    """
+
+    def __init__(self, symbols, name=None, depth=None):
+        self.symbols = list(symbols)
+        self.index = {symbol: i for i, symbol in enumerate(self.symbols)}
+        self.depth = depth or constants.shared_order_book_depth
+        # Строка символа: синхронизирован ли стакан, число уровней, цены, объемы
+        self.row_size = 2 + 2 * self.depth
+        size = (HEADER_FIELDS + len(self.symbols) * self.row_size) * 8
+
+        self.owner = name is None
+        self.shm = shared_memory.SharedMemory(name=name, create=self.owner, size=size)
+        self.array = np.ndarray(
+            HEADER_FIELDS + len(self.symbols) * self.row_size,
+            dtype=np.float64,
+            buffer=self.shm.buf,
+        )
+        if self.owner:
+            self.array.fill(0)
+        else:
+            resource_tracker.unregister(self.shm._name, "shared_memory")
+
+    @property
+    def name(self):
+        return self.shm.name
+
+    def start(self):
+        pass
+
+    def stop(self):
+        pass
+
+    def publish(self, order_books):
+        values = np.zeros((len(self.symbols), self.row_size))
+        for symbol, i in self.index.items():
+            book = order_books.get_book(symbol)
+            if book is None or not book.synced:
+                continue
+            levels = book.get_levels("bids", self.depth)
+            values[i, 0] = 1
+            values[i, 1] = len(levels)
+            if levels:
+                prices, quantities = zip(*levels)
+                values[i, 2 : 2 + len(levels)] = prices
+                values[i, 2 + self.depth : 2 + self.depth + len(levels)] = quantities
+
+        self.array[0] += 1
+        self.array[1] = time.time()
+        self.array[HEADER_FIELDS:] = values.ravel()
+        self.array[0] += 1
+
+    def get_book(self, symbol):
+        # SharedOrderBook или None, если стакан еще не синхронизирован
+        i = self.index.get(symbol)
+        if i is None:
+            return None
+        start = HEADER_FIELDS + i * self.row_size
+        while True:
+            sequence = self.array[0]
+            if sequence % 2:
+                continue
+            row = self.array[start : start + self.row_size].copy()
+            if self.array[0] == sequence:
+                break
+
+        if not row[0]:
+            return None
+        count = int(row[1])
+        return SharedOrderBook(
+            row[2 : 2 + count], row[2 + self.depth : 2 + self.depth + count]
+        )
+
+    def close(self):
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+
+
+class SharedBookTickerCache:
+    """
+    BookTickerCache для процесса сети: тот же интерфейс, но цены читаются
+    из SharedPriceFeed, а не из своего websocket.
+    """
+
+    def __init__(self, feed, symbols, stale_after=None):
+        self.feed = feed
+        self.symbols = symbols
+        self.stale_after = stale_after or constants.book_ticker_stale_after
+
+    def start(self):
+        pass
+
+    def stop(self):
+        pass
+
+    def get_snapshot(self):
+        snapshot, _ = self.feed.read()
+        return {
+            symbol: snapshot[symbol] for symbol in self.symbols if symbol in snapshot
+        }
+
+    def is_stale(self):
+        snapshot, last_message_time = self.feed.read()
+        if time.time() - last_message_time > self.stale_after:
+            return True
+        return any(symbol not in snapshot for symbol in self.symbols)
+
+    def get_tickers(self):
+        # Тикеры в формате REST get_orderbook_tickers или None, если стрим устарел
+        snapshot, last_message_time = self.feed.read()
+        if time.time() - last_message_time > self.stale_after or any(
+            symbol not in snapshot for symbol in self.symbols
+        ):
+            return None
+        return [
+            {
+                "symbol": symbol,
+                "bidPrice": snapshot[symbol].bid_price,
+                "bidQty": snapshot[symbol].bid_qty,
+                "askPrice": snapshot[symbol].ask_price,
+                "askQty": snapshot[symbol].ask_qty,
+            }
+            for symbol in self.symbols
+        ]
+
+
+def get_cex_symbols(network, tokens):
+    return [
+        f"{token}USDT" for token in tokens + [constants.network_base_token[network]]
+    ]
+
+
+def run_network(network, tokens, feed_name, feed_symbols, weight_budget, test_mode):
+    # Точка входа процесса одной сети
+    from async_amm_arbitrage_lfg import AsyncAmmArbitrageLFG
+
+    feed = SharedPriceFeed(feed_symbols, name=feed_name)
+    book_ticker_cache = SharedBookTickerCache(feed, get_cex_symbols(network, tokens))
+    engine = AsyncAmmArbitrageLFG(
+        tokens,
+        network=network,
+        book_ticker_cache=book_ticker_cache,
+        weight_budget=weight_budget,
+    )
+    engine.start(test_mode=test_mode)
+
+
+class MultiChainRunner:
+    """
+    Запускает по процессу-сканеру на каждую сеть из networks ({сеть: токены}).
+    Главный процесс держит один websocket bookTicker на все символы и
+    публикует его в SharedPriceFeed, процессы сетей только читают. Лимит
+    веса REST Binance на IP общий: процессы сетей делят один WeightBudget.
+    Добавить сеть - добавить ее в networks и в constants.chain.
+    """
+
+    def __init__(self, networks):
+        self.networks = networks
+        self.symbols = sorted(
+            {
+                symbol
+                for network, tokens in networks.items()
+                for symbol in get_cex_symbols(network, tokens)
+            }
+        )
+        self.book_ticker_cache = BookTickerCache(self.symbols)
+        self.feed = SharedPriceFeed(self.symbols)
+        # spawn, а не fork: к моменту старта сетей websocket уже крутит поток
+        self.context = multiprocessing.get_context("spawn")
+        self.weight_budget = WeightBudget(self.context)
+        self.processes = {}
+        self.running = False
+
+    def start(self, test_mode=True):
+        self.running = True
+        self.book_ticker_cache.start()
+        for network in self.networks:
+            self.start_network(network, test_mode)
+
+        try:
+            self.publish_loop(test_mode)
+        finally:
+            self.stop()
+
+    def start_network(self, network, test_mode):
+        process = self.context.Process(
+            target=run_network,
+            args=(
+                network,
+                self.networks[network],
+                self.feed.name,
+                self.symbols,
+                self.weight_budget,
+                test_mode,
+            ),
+            name=f"scanner-{network}",
+            daemon=True,
+        )
+        process.start()
+        self.processes[network] = process
+        logger.info(f"Scanner for {network} started. PID: {process.pid}")
+
+    def publish_loop(self, test_mode):
+        # Публикуем новый снапшот, как только он сменился, и следим за процессами
+        last_snapshot, last_message_time = None, None
+        last_check = 0
+        while self.running:
+            # Снапшот copy-on-write, поэтому смену видно по идентичности
+            snapshot = self.book_ticker_cache.get_snapshot()
+            message_time = self.book_ticker_cache.last_message_time
+            if snapshot is not last_snapshot or message_time != last_message_time:
+                self.feed.publish(snapshot, message_time)
+                last_snapshot, last_message_time = snapshot, message_time
+
+            if time.time() - last_check > constants.multichain_check_interval:
+                last_check = time.time()
+                for network, process in self.processes.items():
+                    if not process.is_alive():
+                        logger.error(f"Scanner for {network} died. Restarting.")
+                        self.start_network(network, test_mode)
+
+            time.sleep(constants.shared_feed_interval)
+
+    def stop(self):
+        self.running = False
+        self.book_ticker_cache.stop()
+        for process in self.processes.values():
+            process.terminate()
+        for process in self.processes.values():
+            process.join()
+        self.feed.close()
+
+
+if __name__ == "__main__":
+    networks = {"avalanche": ["QI", "JOE"]}  # Сеть -> токены для арбитража
+    MultiChainRunner(networks).start(test_mode=False)
@@ -0,0 +1,110 @@
+import numpy as np
+
+from helpful_functions import load_min_differences, DEFAULT_MIN_DIFFERENCE
+from config import constants
+
+
+class OpportunityScorer:
+    """
+    Векторная версия find_best_arbitrage_opportunity. Цены CEX, цены DEX, курс
+    базового токена и пороги по токенам лежат в массивах NumPy, разница цен
+    считается сразу по всем токенам и всем CEX, а на выходе ранжированный
+    список из top_k возможностей, а не только лучшая.
+    """
+
+    def __init__(self, tokens, cexes):
+        self.tokens = list(tokens)
+        self.cexes = list(cexes)
+        self.token_index = {token: i for i, token in enumerate(self.tokens)}
+        self.token_positions = np.arange(len(self.tokens))
+
+        shape = (len(self.cexes), len(self.tokens))
+        self.cex_prices = np.full(shape, np.nan)
+        # Цена базового токена сети токена на каждом CEX
+        self.base_prices = np.full(shape, np.nan)
+        # Цена токена на DEX в базовом токене
+        self.dex_prices = np.full(len(self.tokens), np.nan)
+        self.thresholds = np.full(len(self.tokens), DEFAULT_MIN_DIFFERENCE)
+        self.min_differences = None
+
+    def load_thresholds(self):
+        min_differences = load_min_differences()
+        if min_differences is not self.min_differences:
+            self.thresholds = np.array(
+                [
+                    min_differences.get(token, DEFAULT_MIN_DIFFERENCE)
+                    for token in self.tokens
+                ]
+            )
+            self.min_differences = min_differences
+
+    def load_prices(self, cex_prices, dex_prices):
+        # Нет цены токена или базового токена на CEX - NaN, score() такую
+        # пару не выберет
+        self.cex_prices.fill(np.nan)
+        self.base_prices.fill(np.nan)
+        self.dex_prices.fill(np.nan)
+
+        tokens = list(dex_prices)
+        count = len(tokens)
+        positions = np.fromiter(
+            (self.token_index[token] for token in tokens), dtype=np.intp, count=count
+        )
+        self.dex_prices[positions] = np.fromiter(
+            (dex_prices[token].price for token in tokens), dtype=float, count=count
+        )
+        base_tokens = [
+            constants.network_base_token.get(dex_prices[token].network)
+            for token in tokens
+        ]
+        for c, cex in enumerate(self.cexes):
+            prices = cex_prices.get(cex, {})
+            self.cex_prices[c, positions] = np.fromiter(
+                (prices.get(token, np.nan) for token in tokens),
+                dtype=float,
+                count=count,
+            )
+            self.base_prices[c, positions] = np.fromiter(
+                (prices.get(base_token, np.nan) for base_token in base_tokens),
+                dtype=float,
+                count=count,
+            )
+
+    def score(self):
+        # Для каждого токена: (лучшая относительная разница, индекс CEX)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            differences = (
+                self.cex_prices - self.dex_prices * self.base_prices
+            ) / self.cex_prices
+        # Без положительной цены базового токена разница бессмысленна
+        valid = np.isfinite(differences) & (self.base_prices > 0)
+        differences = np.where(valid, differences, -np.inf)
+        best_cex = differences.argmax(axis=0)
+        return differences[best_cex, self.token_positions], best_cex
+
+    def rank(self, top_k):
+        # Индексы токенов выше порога, по убыванию разницы
+        best, best_cex = self.score()
+        candidates = np.flatnonzero((best > self.thresholds) & (best > 0))
+        if len(candidates) > top_k:
+            top = np.argpartition(-best[candidates], top_k - 1)[:top_k]
+            candidates = candidates[top]
+        order = candidates[np.argsort(-best[candidates], kind="stable")]
+        return order, best, best_cex
+
+    def rank_opportunities(self, cex_prices, dex_prices, top_k=None):
+        """
+        dex_prices - {token: Opportunity} из скана. Возвращает записи
+        возможностей по убыванию разницы, с заполненными cex и difference.
+        """
+        self.load_thresholds()
+        self.load_prices(cex_prices, dex_prices)
+        order, best, best_cex = self.rank(top_k or constants.top_k_opportunities)
+
+        opportunities = []
+        for i in order:
+            opportunity = dex_prices[self.tokens[i]]
+            opportunity.cex = self.cexes[best_cex[i]]
+            opportunity.difference = float(best[i])
+            opportunities.append(opportunity)
+        return opportunities
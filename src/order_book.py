@@ -0,0 +1,177 @@
+import threading
+import time
+from bisect import bisect_left, insort
+
+from loguru import logger
+
+from binance_streams import BinanceStream
+from config import constants
+
+
+class OrderBook:
+    """
+    Локальная копия L2 стакана одного символа. Снапшот берется по REST, дальше
+    применяются diff-depth события по правилам Binance (U/u и lastUpdateId).
+    Цены уровней хранятся в отсортированных списках, поэтому средняя цена на объем
+    считается проходом от лучшего уровня без сортировки.
+    """
+
+    def __init__(self, symbol):
+        self.symbol = symbol
+        self.lock = threading.Lock()
+        self.bids = {}
+        self.asks = {}
+        # По возрастанию. Лучший бид - последний, лучший аск - первый.
+        self.bid_prices = []
+        self.ask_prices = []
+        self.last_update_id = 0
+        self.synced = False
+        # События, пришедшие до снапшота
+        self.buffer = []
+
+    def reset(self):
+        with self.lock:
+            self.synced = False
+            self.buffer = []
+
+    def apply_snapshot(self, snapshot):
+        # Возвращает False, если после снапшота в событиях есть разрыв
+        with self.lock:
+            self.bids, self.bid_prices = self.build_side(snapshot["bids"])
+            self.asks, self.ask_prices = self.build_side(snapshot["asks"])
+            self.last_update_id = snapshot["lastUpdateId"]
+            self.synced = True
+
+            buffer, self.buffer = self.buffer, []
+            for event in buffer:
+                if not self.apply_event(event):
+                    return False
+            return self.synced
+
+    @staticmethod
+    def build_side(levels):
+        side = {}
+        for price, quantity in levels:
+            quantity = float(quantity)
+            if quantity > 0:
+                side[float(price)] = quantity
+        return side, sorted(side)
+
+    def apply_diff(self, event):
+        # Возвращает False, если нужна пересинхронизация
+        with self.lock:
+            if not self.synced:
+                self.buffer.append(event)
+                return True
+            return self.apply_event(event)
+
+    def apply_event(self, event):
+        if event["u"] <= self.last_update_id:
+            return True
+        if event["U"] > self.last_update_id + 1:
+            logger.warning(f"Order book gap for {self.symbol}. Resyncing.")
+            self.synced = False
+            return False
+
+        self.update_side(self.bids, self.bid_prices, event["b"])
+        self.update_side(self.asks, self.ask_prices, event["a"])
+        self.last_update_id = event["u"]
+        return True
+
+    @staticmethod
+    def update_side(side, prices, levels):
+        for price, quantity in levels:
+            price, quantity = float(price), float(quantity)
+            if quantity == 0:
+                if side.pop(price, None) is not None:
+                    del prices[bisect_left(prices, price)]
+            else:
+                if price not in side:
+                    insort(prices, price)
+                side[price] = quantity
+
+    def get_sell_price(self, quantity):
+        # Средняя цена продажи quantity по бидам. Объем сверх стакана оценивается в 0.
+        with self.lock:
+            if not self.synced:
+                return None
+            return self.walk(self.bids, reversed(self.bid_prices), quantity)
+
+    def get_buy_price(self, quantity):
+        # Средняя цена покупки quantity по аскам
+        with self.lock:
+            if not self.synced:
+                return None
+            return self.walk(self.asks, self.ask_prices, quantity)
+
+    def get_levels(self, side, depth):
+        # Лучшие depth уровней [(price, quantity), ...]
+        with self.lock:
+            if side == "bids":
+                prices = self.bid_prices[: -depth - 1 : -1]
+                return [(price, self.bids[price]) for price in prices]
+            return [(price, self.asks[price]) for price in self.ask_prices[:depth]]
+
+    @staticmethod
+    def walk(side, prices, quantity):
+        if quantity <= 0:
+            return None
+        left = quantity
+        notional = 0
+        for price in prices:
+            filled = min(left, side[price])
+            notional += filled * price
+            left -= filled
+            if left <= 0:
+                break
+        return notional / quantity if notional else None
+
+
+class OrderBookMirror(BinanceStream):
+    """
+    Стаканы для набора символов, обновляемые diff-depth стримом. После
+    подключения или разрыва последовательности стакан заново берется по REST.
+    """
+
+    def __init__(self, cex_client, symbols, url=None):
+        super().__init__(
+            [
+                f"{symbol.lower()}@depth@{constants.order_book_update_speed}"
+                for symbol in symbols
+            ],
+            url,
+        )
+        self.cex_client = cex_client
+        self.books = {symbol: OrderBook(symbol) for symbol in symbols}
+
+    def on_connect(self):
+        for symbol in self.books:
+            self.resync(symbol)
+
+    def on_message(self, data):
+        book = self.books.get(data["s"])
+        if book is not None and not book.apply_diff(data):
+            self.resync(book.symbol)
+
+    def resync(self, symbol):
+        # Снапшот по REST в отдельном потоке, чтобы не блокировать чтение стрима
+        self.books[symbol].reset()
+        threading.Thread(
+            target=self.load_snapshot, args=(symbol,), daemon=True
+        ).start()
+
+    def load_snapshot(self, symbol):
+        try:
+            snapshot = self.cex_client.get_order_book(
+                symbol=symbol, limit=constants.order_book_snapshot_limit
+            )
+        except Exception as e:
+            logger.error(f"Error loading order book for {symbol}: {e}")
+            time.sleep(constants.binance_stream_reconnect_delay)
+            self.resync(symbol)
+            return
+        if not self.books[symbol].apply_snapshot(snapshot):
+            self.resync(symbol)
+
+    def get_book(self, symbol):
+        return self.books.get(symbol)
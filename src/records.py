@@ -0,0 +1,161 @@
+from config import constants
+
+# Поля структуры LBQuoter.Quote в порядке ABI
+QUOTE_FIELDS = (
+    "route",
+    "pairs",
+    "bin_steps",
+    "versions",
+    "amounts",
+    "virtual_amounts",
+    "fees",
+)
+
+
+class Quote:
+    """
+    Котировка LBQuoter.findBestPathFromAmountIn. Запись на __slots__ вместо
+    словаря; quote["amounts"] по-прежнему работает. load() заполняет запись
+    на месте, поэтому записи из ScanBuffer переиспользуются между сканами.
+    """
+
+    __slots__ = QUOTE_FIELDS
+
+    def __init__(
+        self,
+        route=(),
+        pairs=(),
+        bin_steps=(),
+        versions=(),
+        amounts=(),
+        virtual_amounts=(),
+        fees=(),
+    ):
+        self.load((route, pairs, bin_steps, versions, amounts, virtual_amounts, fees))
+
+    def load(self, decoded):
+        # decoded - tuple структуры Quote из декодера ABI
+        (
+            self.route,
+            self.pairs,
+            self.bin_steps,
+            self.versions,
+            self.amounts,
+            self.virtual_amounts,
+            self.fees,
+        ) = decoded
+        return self
+
+    def __getitem__(self, key):
+        return getattr(self, key)
+
+    def __repr__(self):
+        return f"Quote(route={self.route}, amounts={self.amounts})"
+
+    @property
+    def amount_out(self):
+        return self.amounts[-1]
+
+    def copy(self):
+        # Поля - tuple из декодера, поэтому достаточно поверхностной копии
+        return Quote(*(getattr(self, field) for field in QUOTE_FIELDS))
+
+
+class Opportunity:
+    """
+    Цена токена на DEX за скан и, после скоринга, возможность арбитража.
+    Заменяет словари price_data ({"price", "network", "data": {...}}) и
+    {"token_name", "cex", "arbitrage_details"}. Запись из ScanBuffer живет
+    до следующего скана; то, что уходит дальше скана, берется через copy().
+    """
+
+    __slots__ = (
+        "token_name",
+        "network",
+        "token_address",
+        "price",
+        "amount_in",
+        "quote",
+        "candidates",
+        "expected_profit",
+        "cex",
+        "difference",
+    )
+
+    def __init__(self, token_name, network, token_address=None):
+        self.token_name = token_name
+        self.network = network
+        self.token_address = token_address or constants.chain[network][token_name]
+        self.price = None
+        self.amount_in = None
+        self.quote = None
+        self.candidates = None
+        self.expected_profit = None
+        self.cex = None
+        self.difference = None
+
+    def __repr__(self):
+        return (
+            f"Opportunity({self.token_name}, amount_in={self.amount_in}, "
+            f"price={self.price}, cex={self.cex}, difference={self.difference})"
+        )
+
+    def set_quote(self, amount_in, quote):
+        # Размер свапа и котировка под него, цена - в базовом токене за токен
+        self.amount_in = amount_in
+        self.quote = quote
+        self.price = amount_in / quote.amount_out
+        self.candidates = None
+        self.expected_profit = None
+        self.cex = None
+        self.difference = None
+        return self
+
+    def copy(self, amount_in=None, quote=None, with_candidates=False):
+        # Независимая копия, опционально с другим размером. Кандидаты
+        # ссылаются на котировки буфера и копируются, только если попросить.
+        opportunity = Opportunity(self.token_name, self.network, self.token_address)
+        if amount_in is None:
+            amount_in, quote = self.amount_in, self.quote
+        opportunity.set_quote(amount_in, quote.copy())
+        if with_candidates and self.candidates is not None:
+            opportunity.candidates = [
+                (candidate_amount_in, candidate.copy())
+                for candidate_amount_in, candidate in self.candidates
+            ]
+        opportunity.expected_profit = self.expected_profit
+        opportunity.cex = self.cex
+        opportunity.difference = self.difference
+        return opportunity
+
+
+class ScanBuffer:
+    """
+    Записи Quote и Opportunity на каждый токен, выделенные один раз и
+    переиспользуемые в каждом скане. Котировки декодируются прямо в них.
+    """
+
+    def __init__(self, tokens, network):
+        self.network = network
+        sizes_count = len(constants.chain[network]["swap_sizes"])
+        self.quotes = {token: [Quote() for _ in range(sizes_count)] for token in tokens}
+        self.opportunities = {token: Opportunity(token, network) for token in tokens}
+
+    def get_quotes(self, tokens):
+        # Записи под список запросов: i-я котировка токена в скане - его i-я запись
+        counts = {}
+        quotes = []
+        for token in tokens:
+            i = counts.get(token, 0)
+            counts[token] = i + 1
+            slots = self.quotes.setdefault(token, [])
+            if i == len(slots):
+                slots.append(Quote())
+            quotes.append(slots[i])
+        return quotes
+
+    def get_opportunity(self, token):
+        opportunity = self.opportunities.get(token)
+        if opportunity is None:
+            opportunity = self.opportunities[token] = Opportunity(token, self.network)
+        return opportunity
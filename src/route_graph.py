@@ -0,0 +1,156 @@
+import itertools
+import threading
+import time
+
+from loguru import logger
+
+from config import constants
+
+
+class RouteGraph:
+    """
+    Граф токенов сети для поиска маршрута свапа. Вершины - токены из
+    constants.chain[network], ребра - соседние токены из настроенных route,
+    пары из маршрутов, которые вернул квотер, и ребра от базового токена и
+    хабов (route_hub_tokens) ко всем токенам. Для каждого токена перебираются
+    пути до route_max_hops свапов, все котируются одним батчем, лучший маршрут
+    кэшируется на route_ttl. Скан берет маршрут из кэша, поиск идет в фоне.
+    """
+
+    def __init__(self, lfg_client, network, tokens):
+        self.lfg_client = lfg_client
+        self.network = network
+        self.tokens = list(tokens)
+        self.base_token = constants.network_base_token[network]
+
+        # Символ -> адрес (нижний регистр) и обратно
+        self.addresses = {
+            symbol: value.lower()
+            for symbol, value in constants.chain[network].items()
+            if symbol.isupper() and isinstance(value, str) and value.startswith("0x")
+        }
+        self.addresses[self.base_token] = constants.chain[network][
+            "network_base_token"
+        ].lower()
+        self.symbols = {address: symbol for symbol, address in self.addresses.items()}
+
+        self.lock = threading.Lock()
+        self.edges = set()
+        self.build_edges()
+        # token -> (путь адресов, время находки)
+        self.routes = {}
+        self.running = False
+
+    def build_edges(self):
+        for route in constants.chain[self.network].get("route", {}).values():
+            for a, b in zip(route, route[1:]):
+                self.add_edge(self.get_address(a), self.get_address(b))
+        hubs = [self.base_token] + constants.route_hub_tokens.get(self.network, [])
+        for hub in hubs:
+            for symbol in self.addresses:
+                if symbol != hub:
+                    self.add_edge(self.get_address(hub), self.addresses[symbol])
+
+    def get_address(self, symbol):
+        # В настроенных route базовый токен записан как WAVAX
+        return self.addresses.get(symbol) or self.addresses[self.base_token]
+
+    def add_edge(self, a, b):
+        if a and b and a != b:
+            self.edges.add(frozenset((a.lower(), b.lower())))
+
+    def get_candidate_paths(self, token):
+        # Все простые пути от базового токена до token не длиннее route_max_hops
+        start = self.addresses[self.base_token]
+        target = self.addresses[token]
+        with self.lock:
+            edges = set(self.edges)
+        middle = [
+            address for address in self.symbols if address not in (start, target)
+        ]
+
+        paths = []
+        for hops in range(1, constants.route_max_hops + 1):
+            for via in itertools.permutations(middle, hops - 1):
+                path = [start, *via, target]
+                if all(frozenset(pair) in edges for pair in zip(path, path[1:])):
+                    paths.append(path)
+        return paths
+
+    def discover(self, tokens, amount_in):
+        # Котирует все пути всех токенов одним батчем и запоминает лучшие
+        requests = [
+            (token, path)
+            for token in tokens
+            for path in self.get_candidate_paths(token)
+        ]
+        # Батчами, чтобы один eth_call не упирался в лимит газа RPC
+        quotes = []
+        batch_size = constants.route_quote_batch_size
+        for i in range(0, len(requests), batch_size):
+            quotes += self.lfg_client.get_best_paths_from_amount_in(
+                [(path, amount_in) for _, path in requests[i : i + batch_size]]
+            )
+
+        best = {}
+        for (token, path), quote in zip(requests, quotes):
+            if quote is None:
+                continue
+            with self.lock:
+                for a, b in zip(quote["route"], quote["route"][1:]):
+                    self.add_edge(a, b)
+            amount_out = quote["amounts"][-1]
+            if token not in best or amount_out > best[token]["amounts"][-1]:
+                best[token] = quote
+
+        now = time.time()
+        with self.lock:
+            for token, quote in best.items():
+                route = [address.lower() for address in quote["route"]]
+                if self.routes.get(token, (None,))[0] != route:
+                    logger.info(
+                        f"Route for {token}: "
+                        f"{' -> '.join(self.symbols.get(a, a) for a in route)}"
+                    )
+                self.routes[token] = (route, now)
+        return best
+
+    def get_path(self, token):
+        # Маршрут из кэша, иначе настроенный route или прямой путь
+        with self.lock:
+            cached = self.routes.get(token)
+        if cached is not None:
+            return cached[0]
+
+        route = constants.chain[self.network].get("route", {}).get(token)
+        if route:
+            return [self.get_address(symbol) for symbol in route]
+        return [self.addresses[self.base_token], self.addresses[token]]
+
+    def get_stale_tokens(self):
+        now = time.time()
+        with self.lock:
+            return [
+                token
+                for token in self.tokens
+                if token not in self.routes
+                or now - self.routes[token][1] > constants.route_ttl
+            ]
+
+    def start(self):
+        self.running = True
+        threading.Thread(target=self.discover_loop, args=(), daemon=True).start()
+
+    def stop(self):
+        self.running = False
+
+    def discover_loop(self):
+        amount_in = int(constants.chain[self.network]["swap_size"] * 10**18)
+        while self.running:
+            tokens = self.get_stale_tokens()
+            if tokens:
+                try:
+                    self.discover(tokens, amount_in)
+                except Exception as e:
+                    logger.error(f"Error discovering routes: {e}")
+            time.sleep(constants.route_check_interval)
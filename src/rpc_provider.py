@@ -0,0 +1,352 @@
+import asyncio
+import threading
+import time
+from collections import deque
+from concurrent.futures import (
+    FIRST_COMPLETED,
+    ThreadPoolExecutor,
+    TimeoutError,
+    as_completed,
+    wait,
+)
+from contextlib import contextmanager
+
+import requests
+from aiohttp import ClientTimeout
+from loguru import logger
+from requests.adapters import HTTPAdapter
+from web3 import AsyncWeb3, Web3
+from web3.providers import JSONBaseProvider
+from web3.providers.async_base import AsyncJSONBaseProvider
+
+from config import constants
+
+# Эти запросы уходят во все эндпоинты сразу
+BROADCAST_METHODS = {"eth_sendRawTransaction"}
+# Эти запросы внутри hedging() дублируются во второй эндпоинт, если первый медлит
+HEDGED_METHODS = {"eth_call"}
+
+
+class RPCEndpoint:
+    """
+    Один RPC URL со своим пулом keep-alive соединений и скользящими
+    (EWMA) задержкой и долей ошибок.
+    """
+
+    def __init__(self, url):
+        self.url = url
+        self.provider = self.create_provider(url)
+        self.lock = threading.Lock()
+        self.latency = None
+        self.error_rate = 0
+        self.last_used = 0
+        # Последние задержки для перцентилей
+        self.latencies = deque(maxlen=constants.rpc_latency_window)
+
+    def create_provider(self, url):
+        session = requests.Session()
+        adapter = HTTPAdapter(
+            pool_connections=1,
+            pool_maxsize=constants.rpc_pool_size,
+            max_retries=0,
+        )
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        return Web3.HTTPProvider(
+            url,
+            request_kwargs={"timeout": constants.rpc_timeout},
+            session=session,
+        )
+
+    def make_request(self, method, params):
+        start_time = time.perf_counter()
+        try:
+            response = self.provider.make_request(method, params)
+        except Exception:
+            self.record(None)
+            raise
+        self.record(time.perf_counter() - start_time)
+        return response
+
+    def record(self, latency):
+        # latency=None - ошибка соединения или таймаут
+        alpha = constants.rpc_ewma_alpha
+        with self.lock:
+            self.last_used = time.time()
+            failed = latency is None
+            self.error_rate = (1 - alpha) * self.error_rate + alpha * failed
+            if latency is None:
+                return
+            self.latencies.append(latency)
+            if self.latency is None:
+                self.latency = latency
+            else:
+                self.latency = (1 - alpha) * self.latency + alpha * latency
+
+    def is_healthy(self):
+        return self.error_rate < constants.rpc_max_error_rate
+
+    def get_latency_percentile(self, p):
+        # None, пока замеров меньше rpc_hedge_min_samples
+        with self.lock:
+            if len(self.latencies) < constants.rpc_hedge_min_samples:
+                return None
+            latencies = sorted(self.latencies)
+        return latencies[min(int(len(latencies) * p), len(latencies) - 1)]
+
+    def get_stats(self):
+        with self.lock:
+            return {"latency": self.latency, "error_rate": self.error_rate}
+
+
+class AsyncRPCEndpoint(RPCEndpoint):
+    # То же для AsyncWeb3: aiohttp сессия web3 держит keep-alive соединения
+
+    def create_provider(self, url):
+        return AsyncWeb3.AsyncHTTPProvider(
+            url, request_kwargs={"timeout": ClientTimeout(total=constants.rpc_timeout)}
+        )
+
+    async def make_request(self, method, params):
+        start_time = time.perf_counter()
+        try:
+            response = await self.provider.make_request(method, params)
+        except Exception:
+            self.record(None)
+            raise
+        self.record(time.perf_counter() - start_time)
+        return response
+
+
+def sort_endpoints(endpoints):
+    # Здоровые по возрастанию задержки (еще не измеренные - первыми), потом
+    # остальные по доле ошибок
+    healthy, unhealthy = [], []
+    for endpoint in endpoints:
+        (healthy if endpoint.is_healthy() else unhealthy).append(endpoint)
+    healthy.sort(key=lambda endpoint: endpoint.latency or 0)
+    unhealthy.sort(key=lambda endpoint: endpoint.error_rate)
+    return healthy + unhealthy
+
+
+class MultiEndpointProvider(JSONBaseProvider):
+    """
+    Провайдер web3 поверх нескольких RPC. Чтение идет в самый быстрый здоровый
+    эндпоинт, при ошибке соединения - в следующий. eth_sendRawTransaction
+    рассылается во все эндпоинты параллельно, возвращается первый успешный
+    ответ. Эндпоинты, на которые не было запросов, фоном опрашиваются
+    eth_blockNumber, чтобы их задержка и здоровье не устаревали.
+
+    Внутри with provider.hedging() eth_call хеджируется: если основной
+    эндпоинт не ответил за rpc_hedge_percentile своих последних задержек,
+    тот же запрос уходит во второй, берется первый ответ. Проигравший
+    запрос отменяется, если еще не отправлен, иначе его ответ отбрасывается.
+    """
+
+    def __init__(self, urls):
+        super().__init__()
+        if not urls:
+            raise ValueError("No RPC URLs configured")
+        self.endpoints = [RPCEndpoint(url) for url in urls]
+        self.executor = ThreadPoolExecutor(
+            max_workers=len(self.endpoints) * constants.rpc_broadcast_workers,
+            thread_name_prefix="rpc",
+        )
+        self.running = False
+        self.local = threading.local()
+        self.hedge_lock = threading.Lock()
+        self.hedge_stats = {"requests": 0, "hedged": 0, "hedge_won": 0}
+
+    def __str__(self):
+        urls = [endpoint.url for endpoint in self.endpoints]
+        return f"MultiEndpointProvider({urls})"
+
+    def start(self):
+        if len(self.endpoints) > 1:
+            self.running = True
+            threading.Thread(target=self.probe_loop, args=(), daemon=True).start()
+
+    def stop(self):
+        self.running = False
+
+    def get_endpoints(self):
+        return sort_endpoints(self.endpoints)
+
+    @contextmanager
+    def hedging(self):
+        # Хеджирование для запросов из текущего потока
+        previous = getattr(self.local, "hedging", False)
+        self.local.hedging = True
+        try:
+            yield
+        finally:
+            self.local.hedging = previous
+
+    def make_request(self, method, params):
+        if method in BROADCAST_METHODS and len(self.endpoints) > 1:
+            return self.broadcast(method, params)
+        if (
+            method in HEDGED_METHODS
+            and getattr(self.local, "hedging", False)
+            and len(self.endpoints) > 1
+        ):
+            return self.make_hedged_request(method, params)
+
+        last_error = None
+        for endpoint in self.get_endpoints():
+            try:
+                return endpoint.make_request(method, params)
+            except Exception as e:
+                logger.warning(f"RPC {endpoint.url} failed on {method}: {e}")
+                last_error = e
+        raise last_error
+
+    def broadcast(self, method, params):
+        futures = [
+            self.executor.submit(endpoint.make_request, method, params)
+            for endpoint in self.endpoints
+        ]
+        # Ошибки RPC ("already known" и т.п.) от остальных не важны,
+        # если хоть один эндпоинт принял транзакцию
+        responses = []
+        last_error = None
+        for future in as_completed(futures):
+            try:
+                response = future.result()
+            except Exception as e:
+                last_error = e
+                continue
+            if "error" not in response:
+                return response
+            responses.append(response)
+        if responses:
+            return responses[0]
+        raise last_error
+
+    def make_hedged_request(self, method, params):
+        primary, backup = self.get_endpoints()[:2]
+        delay = primary.get_latency_percentile(constants.rpc_hedge_percentile)
+        if delay is None:
+            delay = constants.rpc_hedge_default_delay
+
+        first = self.executor.submit(primary.make_request, method, params)
+        try:
+            response = first.result(timeout=delay)
+            self.record_hedge(hedged=False, hedge_won=False)
+            return response
+        except TimeoutError:
+            pass
+        except Exception as e:
+            # Основной упал быстрее порога - сразу идем во второй
+            logger.warning(f"RPC {primary.url} failed on {method}: {e}")
+            return backup.make_request(method, params)
+
+        hedge = self.executor.submit(backup.make_request, method, params)
+        pending = {first, hedge}
+        last_error = None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                try:
+                    response = future.result()
+                except Exception as e:
+                    last_error = e
+                    continue
+                for other in pending:
+                    other.cancel()
+                self.record_hedge(hedged=True, hedge_won=future is hedge)
+                return response
+        self.record_hedge(hedged=True, hedge_won=False)
+        raise last_error
+
+    def record_hedge(self, hedged, hedge_won):
+        with self.hedge_lock:
+            self.hedge_stats["requests"] += 1
+            self.hedge_stats["hedged"] += hedged
+            self.hedge_stats["hedge_won"] += hedge_won
+            stats = dict(self.hedge_stats)
+        if hedged and stats["hedged"] % constants.rpc_hedge_log_every == 0:
+            logger.info(f"Hedged requests: {stats}")
+
+    def get_hedge_stats(self):
+        # hedge_won - сколько раз второй эндпоинт ответил раньше основного
+        with self.hedge_lock:
+            return dict(self.hedge_stats)
+
+    def probe_loop(self):
+        while self.running:
+            time.sleep(constants.rpc_probe_interval)
+            now = time.time()
+            for endpoint in self.endpoints:
+                if now - endpoint.last_used < constants.rpc_probe_interval:
+                    continue
+                try:
+                    endpoint.make_request("eth_blockNumber", [])
+                except Exception as e:
+                    logger.debug(f"RPC probe {endpoint.url} failed: {e}")
+
+    def get_stats(self):
+        return {endpoint.url: endpoint.get_stats() for endpoint in self.endpoints}
+
+
+class AsyncMultiEndpointProvider(AsyncJSONBaseProvider):
+    """
+    Асинхронный вариант MultiEndpointProvider для AsyncWeb3: чтение в самый
+    быстрый здоровый эндпоинт с переходом к следующему при ошибке,
+    eth_sendRawTransaction во все эндпоинты с первым успешным ответом.
+    Без хеджирования и фонового опроса: асинхронный движок шлет запросы
+    каждый скан, и статистика эндпоинтов не устаревает.
+    """
+
+    def __init__(self, urls):
+        super().__init__()
+        if not urls:
+            raise ValueError("No RPC URLs configured")
+        self.endpoints = [AsyncRPCEndpoint(url) for url in urls]
+
+    def __str__(self):
+        urls = [endpoint.url for endpoint in self.endpoints]
+        return f"AsyncMultiEndpointProvider({urls})"
+
+    def get_endpoints(self):
+        return sort_endpoints(self.endpoints)
+
+    async def make_request(self, method, params):
+        if method in BROADCAST_METHODS and len(self.endpoints) > 1:
+            return await self.broadcast(method, params)
+
+        last_error = None
+        for endpoint in self.get_endpoints():
+            try:
+                return await endpoint.make_request(method, params)
+            except Exception as e:
+                logger.warning(f"RPC {endpoint.url} failed on {method}: {e}")
+                last_error = e
+        raise last_error
+
+    async def broadcast(self, method, params):
+        # Остальные запросы не отменяются: транзакция должна дойти до всех нод
+        tasks = [
+            asyncio.ensure_future(endpoint.make_request(method, params))
+            for endpoint in self.endpoints
+        ]
+        # Ошибки опоздавших запросов уже учтены в статистике эндпоинта
+        for task in tasks:
+            task.add_done_callback(lambda task: task.cancelled() or task.exception())
+        responses = []
+        last_error = None
+        for task in asyncio.as_completed(tasks):
+            try:
+                response = await task
+            except Exception as e:
+                last_error = e
+                continue
+            if "error" not in response:
+                return response
+            responses.append(response)
+        if responses:
+            return responses[0]
+        raise last_error
+
+    def get_stats(self):
+        return {endpoint.url: endpoint.get_stats() for endpoint in self.endpoints}
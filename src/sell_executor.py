@@ -0,0 +1,238 @@
+import math
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal, ROUND_DOWN
+
+from binance.exceptions import BinanceAPIException
+from loguru import logger
+
+from config import constants
+
+
+def round_step(value, step):
+    # Округление вниз до шага фильтра (stepSize, tickSize)
+    step = Decimal(str(step))
+    return float((Decimal(str(value)) / step).to_integral_value(ROUND_DOWN) * step)
+
+
+class SellExecutor:
+    """
+    Продажа депозита на Binance частями. Фильтры символов (stepSize, minQty,
+    minNotional, tickSize) берутся из get_exchange_info один раз при старте.
+    Размер части подбирается по стакану: столько, сколько есть на бидах в
+    пределах sell_slice_max_impact от лучшего бида. Части уходят параллельно,
+    с паузой не меньше sell_order_interval между ордерами. В режиме "ioc" это
+    лимитные IOC ордера по цене не хуже средней цены части по стакану минус
+    sell_ioc_price_offset, непроданный остаток добивается маркетом.
+    Выручка каждой части сразу идет на обратную покупку базового токена.
+    """
+
+    def __init__(self, cex_client, order_books, mode=None):
+        self.cex_client = cex_client
+        self.order_books = order_books
+        self.mode = mode or constants.sell_mode
+        self.filters = {}
+        self.executor = ThreadPoolExecutor(
+            max_workers=constants.sell_max_parallel_orders,
+            thread_name_prefix="sell",
+        )
+        self.rate_lock = threading.Lock()
+        self.next_order_at = 0
+
+    def load_filters(self, symbols):
+        exchange_info = self.cex_client.get_exchange_info()
+        for symbol_info in exchange_info["symbols"]:
+            if symbol_info["symbol"] in symbols:
+                self.filters[symbol_info["symbol"]] = self.parse_filters(
+                    symbol_info["filters"]
+                )
+        missing = [symbol for symbol in symbols if symbol not in self.filters]
+        if missing:
+            logger.error(f"No filters for symbols: {missing}")
+
+    @staticmethod
+    def parse_filters(filters):
+        filters = {item["filterType"]: item for item in filters}
+        notional = filters.get("NOTIONAL") or filters.get("MIN_NOTIONAL") or {}
+        return {
+            "step_size": float(filters["LOT_SIZE"]["stepSize"]),
+            "min_qty": float(filters["LOT_SIZE"]["minQty"]),
+            "tick_size": float(filters["PRICE_FILTER"]["tickSize"]),
+            "min_notional": float(notional.get("minNotional", 0)),
+        }
+
+    def get_filters(self, symbol):
+        # Если символ не загрузился при старте, догружаем по REST один раз
+        if symbol not in self.filters:
+            self.load_filters([symbol])
+        return self.filters[symbol]
+
+    def wait_rate_limit(self):
+        # Ордера не чаще одного в sell_order_interval на весь процесс
+        with self.rate_lock:
+            now = time.time()
+            send_at = max(now, self.next_order_at)
+            self.next_order_at = send_at + constants.sell_order_interval
+        if send_at > now:
+            time.sleep(send_at - now)
+
+    def plan_slices(self, symbol, quantity):
+        # Список объемов частей. Если стакана нет, делим на sell_default_slices.
+        filters = self.get_filters(symbol)
+        quantity = round_step(quantity, filters["step_size"])
+        book = self.order_books.get_book(symbol)
+        levels = book.get_levels("bids", constants.sell_book_depth) if book else []
+
+        if levels:
+            best_bid = levels[0][0]
+            min_price = best_bid * (1 - constants.sell_slice_max_impact)
+            slice_depth = sum(qty for price, qty in levels if price >= min_price)
+            slices_count = math.ceil(quantity / slice_depth) if slice_depth else 1
+            price = best_bid
+        else:
+            slices_count = constants.sell_default_slices
+            price = None
+
+        # Каждая часть проходит minQty и minNotional
+        min_slice = filters["min_qty"]
+        if price:
+            min_slice = max(min_slice, filters["min_notional"] / price)
+        max_count = int(quantity // min_slice) if min_slice else slices_count
+        slices_count = max(1, min(slices_count, constants.sell_max_slices, max_count))
+
+        part = round_step(quantity / slices_count, filters["step_size"])
+        slices = [part] * (slices_count - 1)
+        rest = quantity - part * (slices_count - 1)
+        slices.append(round_step(rest, filters["step_size"]))
+        return [size for size in slices if size > 0]
+
+    def get_limit_price(self, symbol, quantity):
+        # Нижняя граница цены IOC ордера: VWAP объема по стакану минус запас
+        book = self.order_books.get_book(symbol)
+        vwap = book.get_sell_price(quantity) if book else None
+        if vwap is None:
+            return None
+        return round_step(
+            vwap * (1 - constants.sell_ioc_price_offset),
+            self.get_filters(symbol)["tick_size"],
+        )
+
+    def sell(self, symbol, quantity, rebuy_symbol=None, on_progress=None):
+        """
+        Продает quantity по symbol. Если задан rebuy_symbol, выручка каждой
+        части сразу идет на маркет покупку rebuy_symbol (по quoteOrderQty),
+        когда накопится больше minNotional. Не потраченное на покупку
+        (total_usdt - rebought_usdt) докупается отдельно.
+        Возвращает {"sold", "total_usdt", "rebought_usdt", "bought"}.
+        on_progress(result) вызывается с копией итогов после каждого
+        исполненного ордера, по одному за раз.
+        """
+        slices = self.plan_slices(symbol, quantity)
+        logger.info(f"{symbol}. Quantity: {quantity}. Slices: {slices}")
+
+        result = {"sold": 0, "total_usdt": 0, "rebought_usdt": 0, "bought": 0}
+        lock = threading.Lock()
+        pending_usdt = [0]
+
+        def report():
+            # Вызывается под lock
+            if on_progress is not None:
+                on_progress(dict(result))
+
+        def on_fill(order):
+            sold, proceeds = self.get_fill_totals(order)
+            with lock:
+                result["sold"] += sold
+                result["total_usdt"] += proceeds
+                report()
+                pending_usdt[0] += proceeds
+                amount = pending_usdt[0]
+                if rebuy_symbol is None or not self.can_buy(rebuy_symbol, amount):
+                    return
+                pending_usdt[0] = 0
+            self.rebuy(rebuy_symbol, amount, result, lock, report)
+
+        # Части уходят одновременно и едят один стакан, поэтому цену IOC
+        # части считаем по объему с начала стакана до ее конца
+        futures = [
+            self.executor.submit(
+                self.sell_slice, symbol, size, sum(slices[: i + 1]), on_fill
+            )
+            for i, size in enumerate(slices)
+        ]
+        errors = [future.exception() for future in futures if future.exception()]
+
+        # Остаток, который не набрал minNotional по частям
+        if rebuy_symbol is not None and pending_usdt[0] > 0:
+            if self.can_buy(rebuy_symbol, pending_usdt[0]):
+                self.rebuy(rebuy_symbol, pending_usdt[0], result, lock, report)
+
+        if errors and not result["sold"]:
+            raise errors[0]
+        for error in errors:
+            logger.error(f"Error when sent the sell order: {error}")
+        return result
+
+    def sell_slice(self, symbol, size, depth, on_fill):
+        if self.mode == "ioc":
+            price = self.get_limit_price(symbol, depth)
+            if price is not None:
+                self.wait_rate_limit()
+                order = self.cex_client.order_limit_sell(
+                    symbol=symbol,
+                    quantity=size,
+                    price=f"{price:.10f}".rstrip("0").rstrip("."),
+                    timeInForce="IOC",
+                    newOrderRespType="FULL",
+                )
+                logger.info(f"The IOC order sent: {order}")
+                on_fill(order)
+                size = round_step(
+                    size - float(order["executedQty"]),
+                    self.get_filters(symbol)["step_size"],
+                )
+                if size < self.get_filters(symbol)["min_qty"]:
+                    return
+
+        self.wait_rate_limit()
+        order = self.cex_client.order_market_sell(symbol=symbol, quantity=size)
+        logger.info(f"The market order sent: {order}")
+        on_fill(order)
+
+    @staticmethod
+    def get_fill_totals(order):
+        # (продано токенов, выручка в USDT за вычетом комиссии в USDT)
+        sold = 0
+        proceeds = 0
+        for fill in order["fills"]:
+            sold += float(fill["qty"])
+            proceeds += float(fill["price"]) * float(fill["qty"])
+            if fill.get("commissionAsset") == "USDT":
+                proceeds -= float(fill["commission"])
+        return sold, proceeds
+
+    def can_buy(self, symbol, amount):
+        return amount >= self.get_filters(symbol)["min_notional"]
+
+    def buy(self, symbol, amount):
+        # Маркет покупка на amount USDT с округлением вниз до центов.
+        # Возвращает (потрачено USDT, куплено).
+        amount = math.floor(amount * 100) / 100
+        self.wait_rate_limit()
+        order = self.cex_client.order_market_buy(symbol=symbol, quoteOrderQty=amount)
+        logger.info(f"The market order sent: {order}")
+        return amount, sum(float(fill["qty"]) for fill in order["fills"])
+
+    def rebuy(self, symbol, amount, result, lock, report=None):
+        try:
+            spent, bought = self.buy(symbol, amount)
+        except BinanceAPIException as e:
+            # Остаток докупит стадия buy_base
+            logger.error(f"Error when sent the buy order: {e}")
+            return
+        with lock:
+            result["rebought_usdt"] += spent
+            result["bought"] += bought
+            if report is not None:
+                report()
@@ -0,0 +1,338 @@
+# sharding.py
+
+import math
+import multiprocessing
+import queue
+import threading
+import time
+import traceback
+
+from loguru import logger
+
+from amm_arbitrage_lfg import AmmArbitrageLFG
+from binance_scheduler import WeightBudget
+from block_scheduler import BlockScheduler
+from helpful_functions import initialize_cex_object
+from multichain import (
+    SharedBookTickerCache,
+    SharedOrderBooks,
+    SharedPriceFeed,
+    get_cex_symbols,
+)
+from config import constants
+
+
+def split_tokens(tokens, shards_count):
+    # Токены по шардам по кругу, чтобы шарды были одного размера
+    shards = [tokens[i::shards_count] for i in range(shards_count)]
+    return [shard for shard in shards if shard]
+
+
+class SharedBalance:
+    """
+    Свободный баланс базового токена из процесса-исполнителя. Сканеру нужен
+    только available() для размеров свапа, резервы ведет исполнитель.
+    """
+
+    def __init__(self, value):
+        self.value = value
+
+    def available(self):
+        return self.value.value
+
+
+class SharedExchangeInfo:
+    """
+    Комиссия вывода базового токена сети из процесса-исполнителя. Сканеру
+    из данных биржи нужна только она (SizeOptimizer), поэтому своего
+    ExchangeInfoStore с REST запросами у него нет.
+    """
+
+    def __init__(self, value, currency, network):
+        self.value = value
+        self.currency = currency
+        self.network = network
+
+    def get_withdrawal_fee(self, currency, network):
+        if (currency, network) != (self.currency, self.network):
+            return None
+        fee = self.value.value
+        return None if math.isnan(fee) else fee
+
+
+class ShardScanner(AmmArbitrageLFG):
+    """
+    Процесс-сканер одного шарда токенов. Берет у AmmArbitrageLFG котирование,
+    выбор размера и скоринг, но не держит кошелек и не торгует: вместо сделки
+    ранжированные возможности уходят в очередь candidates исполнителю.
+    Цены и стаканы Binance, комиссию вывода и баланс сканер читает из общей
+    памяти координатора, REST Binance - только если стрим цен устарел, с
+    общим для всех процессов WeightBudget.
+    """
+
+    def __init__(
+        self,
+        shard_id,
+        tokens,
+        network,
+        book_ticker_cache,
+        order_books,
+        exchange_info,
+        balance,
+        candidates,
+        weight_budget,
+    ):
+        # Кошелек, резервы баланса и продажа на CEX есть только у исполнителя,
+        # поэтому вместо AmmArbitrageLFG.__init__ строим только состояние скана
+        self.running = False
+        self.shard_id = shard_id
+        self.candidates = candidates
+        self.network = network
+        self.tokens = tokens
+        self.cex = "binance"
+        self.cex_client = initialize_cex_object(self.cex, weight_budget)
+        self.exchange_info = exchange_info
+        self.balance_ledger = balance
+        self.init_scanning(book_ticker_cache, order_books)
+
+    def start(self, block_driven=True):
+        self.running = True
+        self.lfg_client.fee_oracle.start()
+        self.route_graph.start()
+
+        if block_driven:
+            BlockScheduler(
+                self.w3, lambda block_number: self.arbitrage(test_mode=True)
+            ).start()
+            return
+
+        while self.running:
+            try:
+                self.arbitrage(test_mode=True)
+            except Exception as e:
+                logger.error(e)
+                logger.error(traceback.format_exc())
+            time.sleep(constants.scan_interval)
+
+    def handle_prices(self, cex_prices, amm_prices, test_mode):
+        cex_prices = self.get_realizable_cex_prices(cex_prices, amm_prices)
+        opportunities = self.scorer.rank_opportunities(cex_prices, amm_prices)
+        if not opportunities:
+            return
+
+        # Очередь сериализует объекты в своем потоке, а записи буфера перезапишет
+        # следующий скан, поэтому отдаем копии
+        try:
+            self.candidates.put_nowait(
+                {
+                    "shard_id": self.shard_id,
+                    "time": time.time(),
+                    "opportunities": [
+                        opportunity.copy(with_candidates=True)
+                        for opportunity in opportunities
+                    ],
+                }
+            )
+        except queue.Full:
+            logger.warning(f"Shard {self.shard_id}: executor is behind, scan dropped.")
+
+
+def run_shard(shard_id, tokens, network, shared, candidates):
+    # Точка входа процесса-сканера. shared - общие объекты координатора
+    feed = SharedPriceFeed(shared["symbols"], name=shared["feed_name"])
+    scanner = ShardScanner(
+        shard_id,
+        tokens,
+        network,
+        SharedBookTickerCache(feed, get_cex_symbols(network, tokens)),
+        SharedOrderBooks(shared["symbols"], name=shared["order_books_name"]),
+        SharedExchangeInfo(
+            shared["withdrawal_fee"],
+            constants.network_base_token[network],
+            constants.cex_network_map[network],
+        ),
+        SharedBalance(shared["balance"]),
+        candidates,
+        shared["weight_budget"],
+    )
+    scanner.start()
+
+
+class ShardedArbitrageLFG:
+    """
+    Шардированный режим для больших списков токенов. Координатор делит токены
+    на shards_count шардов, каждый шард котирует и скорит свой процесс
+    (ShardScanner), так что декодирование ABI и скоринг не упираются в один GIL.
+    Кандидаты приходят по multiprocessing.Queue в этот процесс, который один
+    держит nonce кошелька, баланс и лимиты и отправляет сделки через обычный
+    AmmArbitrageLFG. Цены и стаканы Binance, комиссию вывода и свободный
+    баланс сканеры читают из общей памяти, которую этот процесс обновляет, а
+    вес REST Binance у всех процессов общий.
+    """
+
+    def __init__(self, tokens_to_arbitrage, shards_count=None, network="avalanche"):
+        self.network = network
+        self.shards = split_tokens(
+            tokens_to_arbitrage, shards_count or constants.shard_count
+        )
+
+        # spawn, а не fork: к моменту старта сканеров в процессе уже есть потоки
+        self.context = multiprocessing.get_context("spawn")
+        self.weight_budget = WeightBudget(self.context)
+
+        # Исполнитель: кошелек, nonce, лимиты экспозиции и продажа на CEX
+        self.engine = AmmArbitrageLFG(
+            tokens_to_arbitrage, network, weight_budget=self.weight_budget
+        )
+
+        self.feed = SharedPriceFeed(self.engine.cex_symbols)
+        self.order_books = SharedOrderBooks(self.engine.cex_symbols)
+        self.withdrawal_fee = self.context.Value("d", math.nan, lock=False)
+        self.balance = self.context.Value("d", 0, lock=False)
+        self.order_books_published = 0
+        self.candidates = self.context.Queue(maxsize=constants.shard_queue_size)
+        self.processes = {}
+        self.running = False
+
+    def start(self, test_mode=True):
+        self.running = True
+        self.engine.running = True
+        self.engine.start_services(test_mode, scanning=False)
+        self.publish()
+        for shard_id in range(len(self.shards)):
+            self.start_shard(shard_id)
+
+        threading.Thread(target=self.publish_loop, args=(), daemon=True).start()
+        try:
+            self.execute_loop(test_mode)
+        finally:
+            self.stop()
+
+    def start_shard(self, shard_id):
+        process = self.context.Process(
+            target=run_shard,
+            args=(
+                shard_id,
+                self.shards[shard_id],
+                self.network,
+                {
+                    "symbols": self.engine.cex_symbols,
+                    "feed_name": self.feed.name,
+                    "order_books_name": self.order_books.name,
+                    "withdrawal_fee": self.withdrawal_fee,
+                    "balance": self.balance,
+                    "weight_budget": self.weight_budget,
+                },
+                self.candidates,
+            ),
+            name=f"shard-{shard_id}",
+            daemon=True,
+        )
+        process.start()
+        self.processes[shard_id] = process
+        logger.info(
+            f"Shard {shard_id} started. Tokens: {len(self.shards[shard_id])}. "
+            f"PID: {process.pid}"
+        )
+
+    def publish(self):
+        self.feed.publish(
+            self.engine.book_ticker_cache.get_snapshot(),
+            self.engine.book_ticker_cache.last_message_time,
+        )
+        self.balance.value = self.engine.balance_ledger.available()
+
+        # Стаканы и комиссия вывода меняются реже и стоят дороже
+        now = time.time()
+        if now - self.order_books_published > constants.shared_order_book_interval:
+            self.order_books_published = now
+            self.order_books.publish(self.engine.order_books)
+            withdrawal_fee = self.engine.exchange_info.get_withdrawal_fee(
+                constants.network_base_token[self.network],
+                constants.cex_network_map[self.network],
+            )
+            self.withdrawal_fee.value = (
+                math.nan if withdrawal_fee is None else withdrawal_fee
+            )
+
+    def publish_loop(self):
+        # Цены, стаканы и баланс для сканеров, перезапуск упавших сканеров
+        last_check = 0
+        while self.running:
+            self.publish()
+
+            if time.time() - last_check > constants.multichain_check_interval:
+                last_check = time.time()
+                for shard_id, process in self.processes.items():
+                    if not process.is_alive():
+                        logger.error(f"Shard {shard_id} died. Restarting.")
+                        self.start_shard(shard_id)
+
+            time.sleep(constants.shared_feed_interval)
+
+    def execute_loop(self, test_mode):
+        while self.running:
+            try:
+                batch = [self.candidates.get(timeout=constants.shard_poll_interval)]
+            except queue.Empty:
+                continue
+            # Что успело прийти от других шардов, решаем вместе с первым
+            while True:
+                try:
+                    batch.append(self.candidates.get_nowait())
+                except queue.Empty:
+                    break
+
+            opportunities = self.merge(batch)
+            if not opportunities:
+                continue
+            try:
+                self.engine.prepare_swap_templates(
+                    {
+                        opportunity.token_name: opportunity
+                        for opportunity in opportunities
+                    }
+                )
+                self.engine.handle_opportunities(
+                    opportunities, self.engine.get_cex_prices(), test_mode
+                )
+            except Exception as e:
+                logger.error(e)
+                logger.error(traceback.format_exc())
+
+    @staticmethod
+    def merge(batch):
+        # Свежие возможности всех шардов одним списком по убыванию разницы.
+        # От каждого шарда берем только последний скан.
+        now = time.time()
+        latest = {}
+        for item in batch:
+            if now - item["time"] > constants.shard_candidate_max_age:
+                continue
+            if item["time"] >= latest.get(item["shard_id"], {"time": 0})["time"]:
+                latest[item["shard_id"]] = item
+
+        opportunities = [
+            opportunity
+            for item in latest.values()
+            for opportunity in item["opportunities"]
+        ]
+        opportunities.sort(
+            key=lambda opportunity: opportunity.difference,
+            reverse=True,
+        )
+        return opportunities[: constants.top_k_opportunities]
+
+    def stop(self):
+        self.running = False
+        for process in self.processes.values():
+            process.terminate()
+        for process in self.processes.values():
+            process.join()
+        self.feed.close()
+        self.order_books.close()
+
+
+if __name__ == "__main__":
+    tokens_to_arbitrage = ["QI", "JOE"]  # Список токенов для арбитража
+    ShardedArbitrageLFG(tokens_to_arbitrage).start(test_mode=False)
@@ -0,0 +1,68 @@
+from config import constants
+
+
+class SizeOptimizer:
+    """
+    Выбирает размер свапа по токену из набора кандидатов, котированных одним батчем.
+    Ожидаемый чистый профит считается в базовом токене сети: выход DEX продаем
+    на CEX по цене с учетом глубины стакана, USDT переводим обратно в базовый токен
+    и вычитаем комиссии Binance, комиссию вывода и газ свапа.
+    """
+
+    def __init__(self, network, exchange_info, fee_oracle):
+        self.network = network
+        self.base_token = constants.network_base_token[network]
+        self.exchange_info = exchange_info
+        self.fee_oracle = fee_oracle
+
+    def get_candidate_sizes(self, balance):
+        # Кандидаты в wei, которые помещаются в свободный баланс
+        sizes = [
+            size
+            for size in constants.chain[self.network]["swap_sizes"]
+            if size <= balance
+        ]
+        if not sizes and balance > 0:
+            sizes = [balance]
+        return [int(size * 10**18) for size in sizes]
+
+    def get_fixed_costs(self):
+        # Комиссия вывода базового токена с биржи + газ свапа, в базовом токене
+        withdrawal_fee = (
+            self.exchange_info.get_withdrawal_fee(
+                self.base_token, constants.cex_network_map[self.network]
+            )
+            or 0
+        )
+        max_fee_per_gas, _ = self.fee_oracle.get_fees()
+        gas_cost = constants.default_swap_gas * max_fee_per_gas / 10**18
+        return withdrawal_fee + gas_cost
+
+    def expected_profit(self, amount_in, amount_out, sell_price, base_price, costs):
+        taker_fee = constants.cex_taker_fee
+        proceeds_usdt = amount_out / 10**18 * sell_price * (1 - taker_fee)
+        proceeds_base = proceeds_usdt / base_price * (1 - taker_fee)
+        return proceeds_base - amount_in / 10**18 - costs
+
+    def select(self, token, candidates, cex_prices, get_sell_price):
+        """
+        candidates - список (amount_in, quote). get_sell_price(token, quantity) -
+        цена продажи quantity токенов на CEX. Возвращает (amount_in, quote, profit).
+        Если цены CEX нет, берем самый крупный размер без оценки профита.
+        """
+        base_price = cex_prices.get(self.base_token)
+        if token not in cex_prices or not base_price:
+            amount_in, quote = max(candidates, key=lambda candidate: candidate[0])
+            return amount_in, quote, None
+
+        costs = self.get_fixed_costs()
+        best = None
+        for amount_in, quote in candidates:
+            amount_out = quote["amounts"][-1]
+            sell_price = get_sell_price(token, amount_out / 10**18)
+            profit = self.expected_profit(
+                amount_in, amount_out, sell_price, base_price, costs
+            )
+            if best is None or profit > best[2]:
+                best = (amount_in, quote, profit)
+        return best
@@ -0,0 +1,177 @@
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+
+from loguru import logger
+
+from config import constants
+
+# Смещения аргументов в calldata swapExactNATIVEForTokens(amountOutMin, path, to, deadline):
+# 4 байта селектора, далее по 32 байта на amountOutMin, offset(path), to, deadline
+AMOUNT_OUT_MIN_SLICE = slice(4, 36)
+DEADLINE_SLICE = slice(100, 132)
+
+
+class SwapTemplate:
+    def __init__(self, calldata, amount_in, gas, estimated=True):
+        self.calldata = calldata
+        self.amount_in = amount_in
+        self.gas = gas
+        # False - газ по умолчанию, шаблон не кэшируется
+        self.estimated = estimated
+
+
+class SwapTemplateCache:
+    """
+    Заранее закодированные транзакции swapExactNATIVEForTokens по ключу
+    (маршрут, amount_in, recipient). При отправке в готовом calldata подменяются
+    только amountOutMin и deadline, а лимит газа берется из кэша по маршруту и
+    amount_in, поэтому остаются только подпись и отправка. Оба кэша - LRU
+    на constants.swap_template_cache_size записей. Если оценка газа не
+    удалась, шаблон с газом по умолчанию отдается, но не кэшируется.
+    """
+
+    def __init__(self, lfg_client):
+        self.lfg_client = lfg_client
+        self.web3 = lfg_client.web3
+        self.router_address = lfg_client.router.address
+        self.templates = OrderedDict()
+        # ((tokenPath, binSteps, versions), amount_in) -> лимит газа. Газ растет
+        # с размером: больший свап пересекает больше бинов LB
+        self.gas_limits = OrderedDict()
+        # Ключ шаблона -> Future, пока шаблон строится в другом потоке
+        self.in_flight = {}
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def get_key(token_path, bin_steps, versions, amount_in, recipient):
+        route = (tuple(token_path), tuple(bin_steps), tuple(versions))
+        return route, amount_in, recipient
+
+    def has_template(self, token_path, bin_steps, versions, amount_in, recipient):
+        key = self.get_key(token_path, bin_steps, versions, amount_in, recipient)
+        with self.lock:
+            return key in self.templates
+
+    def get_template(self, token_path, bin_steps, versions, amount_in, recipient):
+        key = self.get_key(token_path, bin_steps, versions, amount_in, recipient)
+        # Тот же шаблон уже строится - ждем его, а не оцениваем газ второй раз
+        with self.lock:
+            template = self.templates.get(key)
+            if template is not None:
+                self.templates.move_to_end(key)
+                return template
+            future = self.in_flight.get(key)
+            owner = future is None
+            if owner:
+                future = self.in_flight[key] = Future()
+        if not owner:
+            return future.result()
+
+        try:
+            template = self.build_template(key[0], amount_in, recipient)
+        except Exception as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(template)
+            if template.estimated:
+                with self.lock:
+                    self.remember(self.templates, key, template)
+            return template
+        finally:
+            with self.lock:
+                self.in_flight.pop(key, None)
+
+    @staticmethod
+    def remember(cache, key, value):
+        # Вызывается под self.lock
+        cache[key] = value
+        cache.move_to_end(key)
+        while len(cache) > constants.swap_template_cache_size:
+            cache.popitem(last=False)
+
+    def build_template(self, route, amount_in, recipient):
+        token_path, bin_steps, versions = route
+        path = {
+            "tokenPath": [self.web3.to_checksum_address(addr) for addr in token_path],
+            "pairBinSteps": list(bin_steps),
+            "versions": list(versions),
+        }
+        calldata = bytes.fromhex(
+            self.lfg_client.router.encodeABI(
+                fn_name="swapExactNATIVEForTokens",
+                args=[0, path, self.web3.to_checksum_address(recipient), 0],
+            )[2:]
+        )
+
+        gas_key = (route, amount_in)
+        with self.lock:
+            gas = self.gas_limits.get(gas_key)
+            if gas is not None:
+                self.gas_limits.move_to_end(gas_key)
+        if gas is None:
+            gas = self.estimate_gas(calldata, amount_in)
+            if gas is None:
+                return SwapTemplate(
+                    calldata, amount_in, constants.default_swap_gas, estimated=False
+                )
+            with self.lock:
+                self.remember(self.gas_limits, gas_key, gas)
+        return SwapTemplate(calldata, amount_in, gas)
+
+    def estimate_gas(self, calldata, amount_in):
+        # Оцениваем один раз на маршрут и размер с нулевым amountOutMin и живым
+        # deadline. None, если оценка не удалась
+        calldata = self.patch(calldata, 0, int(time.time()) + 60)
+        try:
+            gas_estimate = self.web3.eth.estimate_gas(
+                {
+                    "from": self.lfg_client.account.address,
+                    "to": self.router_address,
+                    "value": amount_in,
+                    "data": calldata,
+                }
+            )
+            return int(gas_estimate * 1.2)  # Add 20% buffer
+        except Exception as e:
+            logger.warning(f"Gas estimation failed: {e}")
+            return None
+
+    @staticmethod
+    def patch(calldata, min_amount_out, deadline):
+        data = bytearray(calldata)
+        data[AMOUNT_OUT_MIN_SLICE] = min_amount_out.to_bytes(32, "big")
+        data[DEADLINE_SLICE] = deadline.to_bytes(32, "big")
+        return bytes(data)
+
+    def sign(self, template, min_amount_out, deadline, nonce, fees):
+        max_fee_per_gas, max_priority_fee = fees
+        tx = {
+            "to": self.router_address,
+            "value": template.amount_in,
+            "data": self.patch(template.calldata, min_amount_out, deadline),
+            "gas": template.gas,
+            "maxFeePerGas": max_fee_per_gas,
+            "maxPriorityFeePerGas": max_priority_fee,
+            "nonce": nonce,
+            "chainId": self.lfg_client.chain_id,
+            "type": 2,
+        }
+        return self.lfg_client.account.sign_transaction(tx)
+
+    def prepare(self, quotes, recipient):
+        # Кодирует шаблоны для котировок, которых еще нет в кэше.
+        # quotes - список (amount_in, quote). Вызывается в фоне после скана.
+        for amount_in, quote in quotes:
+            try:
+                self.get_template(
+                    quote["route"],
+                    quote["bin_steps"],
+                    quote["versions"],
+                    amount_in,
+                    recipient,
+                )
+            except Exception as e:
+                logger.error(f"Error preparing swap template: {e}")
@@ -4,6 +4,8 @@ from config import constants
 import dotenv
 import os
 import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from loguru import logger
 
 dotenv.load_dotenv()
@@ -11,6 +13,13 @@ dotenv.load_dotenv()
 
 bot = telebot.TeleBot(token=os.environ.get("TELEGRAM_TOKEN"))
 
+# Отправка в фоне на фиксированном числе потоков. Если сообщений в очереди
+# больше telegram_queue_size, новые отбрасываются, а не копятся.
+executor = ThreadPoolExecutor(
+    max_workers=constants.telegram_workers, thread_name_prefix="telegram"
+)
+pending_messages = threading.BoundedSemaphore(constants.telegram_queue_size)
+
 
 def send_message(message, parse_mode="Markdown", message_type=None):
     """
@@ -41,6 +50,21 @@ def send_message(message, parse_mode="Markdown", message_type=None):
             sleep(sleep_time)
 
 
+def send_message_async(message, parse_mode="Markdown", message_type=None):
+    # Как send_message, но не блокирует вызывающий поток
+    if not pending_messages.acquire(blocking=False):
+        logger.warning(f"Telegram queue is full. Message dropped: {message}")
+        return
+
+    def send():
+        try:
+            send_message(message, parse_mode, message_type)
+        finally:
+            pending_messages.release()
+
+    executor.submit(send)
+
+
 def format_message_for_swap(message):
     # Удаляем часть "Network: {network}. "
     message_without_network = re.sub(r"Network: .+?\. ", "", message)
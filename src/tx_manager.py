@@ -0,0 +1,134 @@
+import threading
+import time
+
+from web3.exceptions import TransactionNotFound
+from loguru import logger
+
+from config import constants
+
+
+class NonceManager:
+    """
+    Выдает nonce локально, без get_transaction_count на каждую транзакцию.
+    После ошибки отправки или потерянной транзакции nonce перечитывается из сети
+    (с учетом pending) при следующем запросе.
+    """
+
+    def __init__(self, w3, address):
+        self.w3 = w3
+        self.address = address
+        self.lock = threading.Lock()
+        self.nonce = None
+
+    def get_nonce(self):
+        with self.lock:
+            if self.nonce is None:
+                self.nonce = self.w3.eth.get_transaction_count(self.address, "pending")
+            nonce = self.nonce
+            self.nonce += 1
+            return nonce
+
+    def resync(self):
+        with self.lock:
+            self.nonce = None
+
+
+class FeeOracle:
+    """
+    Кэш комиссии за газ. Обновляется в фоне раз в fee_oracle_ttl секунд,
+    поэтому на отправке транзакции запроса gas_price нет.
+    """
+
+    def __init__(self, w3, ttl=None):
+        self.w3 = w3
+        self.ttl = ttl or constants.fee_oracle_ttl
+        self.fees = None
+        self.updated_at = 0
+        self.running = False
+
+    def start(self):
+        self.running = True
+        threading.Thread(target=self.refresh_loop, args=(), daemon=True).start()
+
+    def stop(self):
+        self.running = False
+
+    def refresh_loop(self):
+        while self.running:
+            try:
+                self.refresh()
+            except Exception as e:
+                logger.error(f"Error updating gas price: {e}")
+            time.sleep(self.ttl)
+
+    def refresh(self):
+        base_fee = self.w3.eth.gas_price
+        max_priority_fee = int(
+            base_fee * constants.priority_fee_share
+        )  # Приоритетная комиссия как доля от baseFee
+        self.fees = (base_fee + max_priority_fee, max_priority_fee)
+        self.updated_at = time.time()
+
+    def get_fees(self):
+        # (maxFeePerGas, maxPriorityFeePerGas). Если фон не успел, запрашиваем сами.
+        if self.fees is None or time.time() - self.updated_at > self.ttl * 3:
+            self.refresh()
+        return self.fees
+
+
+class ConfirmationWatcher:
+    """
+    Отслеживает квитанции отправленных транзакций в отдельном потоке и вызывает
+    колбэки, чтобы сканер не ждал подтверждения. on_confirmed(receipt) вызывается
+    при status == 1, on_failed(receipt) - при status == 0 или с None по таймауту.
+    """
+
+    def __init__(self, w3, poll_interval=None, timeout=None):
+        self.w3 = w3
+        self.poll_interval = poll_interval or constants.receipt_poll_interval
+        self.timeout = timeout or constants.receipt_timeout
+        self.lock = threading.Lock()
+        # tx_hash -> (время отправки, on_confirmed, on_failed)
+        self.pending = {}
+        self.running = False
+
+    def start(self):
+        self.running = True
+        threading.Thread(target=self.watch_loop, args=(), daemon=True).start()
+
+    def stop(self):
+        self.running = False
+
+    def watch(self, tx_hash, on_confirmed, on_failed):
+        with self.lock:
+            self.pending[tx_hash] = (time.time(), on_confirmed, on_failed)
+
+    def watch_loop(self):
+        while self.running:
+            with self.lock:
+                pending = list(self.pending.items())
+
+            for tx_hash, (sent_at, on_confirmed, on_failed) in pending:
+                try:
+                    receipt = self.w3.eth.get_transaction_receipt(tx_hash)
+                except TransactionNotFound:
+                    if time.time() - sent_at > self.timeout:
+                        logger.error(f"Transaction {tx_hash} not mined in time.")
+                        self.finish(tx_hash, on_failed, None)
+                    continue
+                except Exception as e:
+                    logger.error(f"Error getting receipt for {tx_hash}: {e}")
+                    continue
+
+                callback = on_confirmed if receipt["status"] == 1 else on_failed
+                self.finish(tx_hash, callback, receipt)
+
+            time.sleep(self.poll_interval)
+
+    def finish(self, tx_hash, callback, receipt):
+        with self.lock:
+            self.pending.pop(tx_hash, None)
+        try:
+            callback(receipt)
+        except Exception as e:
+            logger.error(f"Error in confirmation callback for {tx_hash}: {e}")
@@ -0,0 +1,248 @@
+import heapq
+import json
+import queue
+import threading
+import time
+import traceback
+from collections import deque
+from concurrent.futures import Future
+
+from loguru import logger
+
+from helpful_functions import atomic_write_json
+from telegram import send_message_async
+from config import constants
+
+UNWIND_JOBS_FILE = "data/unwind_jobs_{network}.json"
+
+
+class UnwindPipeline:
+    """
+    Разворот позиции на CEX после свапа: ожидание депозита, продажа токена,
+    покупка базового токена, вывод. У каждой стадии своя ограниченная очередь и
+    фиксированное число воркеров. Если следующая очередь полна, воркер ждет.
+    has_capacity считает все незавершенные джобы, включая ждущие депозит
+    вне очередей, и при unwind_max_jobs новые сделки не берутся. submit не
+    блокирует: джоб сразу пишется на диск, а при полной очереди встает
+    в отложенные. Джобы пишутся на диск после каждой стадии и после рестарта
+    продолжаются с той стадии, на которой остановились; прогресс внутри
+    стадии обработчик сохраняет через save_jobs.
+
+    handlers - {стадия: функция(job)}. Функция дописывает результат в job и
+    возвращает True (стадия пройдена), False (джоб отменен), None (еще рано,
+    повторить через unwind_poll_interval) или Future (повторить, когда он
+    завершится; воркер при этом не занят). Исключение отменяет джоб.
+    """
+
+    STAGES = ("deposit", "sell", "buy_base", "withdraw")
+
+    def __init__(self, handlers, filename, on_finished=None):
+        self.handlers = handlers
+        # on_finished(job, success) после последней стадии или отмены
+        self.on_finished = on_finished
+        self.filename = filename
+
+        self.queues = {
+            stage: queue.Queue(maxsize=constants.unwind_queue_size)
+            for stage in self.STAGES
+        }
+        self.latencies = {
+            stage: deque(maxlen=constants.unwind_latency_window)
+            for stage in self.STAGES
+        }
+        self.lock = threading.Lock()
+        # tx_hash -> job
+        self.jobs = {}
+        # Джобы, которые ждут повтора: (время, номер, job)
+        self.delayed = []
+        self.delayed_count = 0
+        self.delayed_ready = threading.Condition(self.lock)
+        self.finished_count = 0
+        self.running = False
+
+    def start(self):
+        self.running = True
+        for stage in self.STAGES:
+            for _ in range(constants.unwind_workers[stage]):
+                threading.Thread(
+                    target=self.worker, args=(stage,), daemon=True
+                ).start()
+        threading.Thread(target=self.delay_loop, args=(), daemon=True).start()
+
+        # Незавершенные джобы прошлого запуска
+        for job in self.load_jobs():
+            logger.info(f'Resuming unwind at {job["stage"]}. TX: {job["tx_hash"]}')
+            self.schedule(job, 0)
+
+    def stop(self):
+        self.running = False
+        with self.lock:
+            self.delayed_ready.notify_all()
+
+    def load_jobs(self):
+        try:
+            with open(self.filename, "r") as file:
+                jobs = json.load(file)
+        except FileNotFoundError:
+            return []
+        except Exception as e:
+            logger.error(f"Error reading unwind jobs: {e}")
+            return []
+        with self.lock:
+            for job in jobs:
+                # id позиций в ExecutionScheduler живут только до рестарта
+                job.pop("position_id", None)
+                self.jobs[job["tx_hash"]] = job
+        return jobs
+
+    def save_jobs(self):
+        with self.lock:
+            jobs = [dict(job) for job in self.jobs.values()]
+        try:
+            atomic_write_json(self.filename, jobs)
+        except Exception as e:
+            logger.error(f"Error writing unwind jobs: {e}")
+
+    def has_capacity(self):
+        # Можно ли открывать новые позиции: незавершенные джобы по всем стадиям,
+        # в том числе ждущие Future и повтора, против unwind_max_jobs
+        with self.lock:
+            return len(self.jobs) < constants.unwind_max_jobs
+
+    def submit(self, tx_hash, amount_in, **fields):
+        # Не блокирует: вызывается из потока подтверждения свапов
+        now = time.time()
+        job = {
+            "tx_hash": tx_hash,
+            "amount_in": amount_in,
+            "stage": self.STAGES[0],
+            "created_at": now,
+            "stage_started_at": now,
+            **fields,
+        }
+        with self.lock:
+            self.jobs[tx_hash] = job
+        self.save_jobs()
+        if not self.enqueue(job):
+            logger.warning(
+                f"Unwind queue is full: {self.get_queue_sizes()}. TX: {tx_hash}"
+            )
+            send_message_async(f"Unwind queue is full. TX: #{tx_hash[:8]}")
+        return job
+
+    def enqueue(self, job):
+        # Без ожидания места: при полной очереди джоб повторится позже.
+        # Возвращает False, если джоб отложен.
+        try:
+            self.queues[job["stage"]].put_nowait(job)
+            return True
+        except queue.Full:
+            self.schedule(job, constants.unwind_poll_interval)
+            return False
+
+    def schedule(self, job, delay):
+        with self.lock:
+            self.delayed_count += 1
+            heapq.heappush(
+                self.delayed, (time.time() + delay, self.delayed_count, job)
+            )
+            self.delayed_ready.notify()
+
+    def delay_loop(self):
+        # Переносит джобы, время повтора которых пришло, в очереди стадий
+        while self.running:
+            with self.lock:
+                while self.running and (
+                    not self.delayed or self.delayed[0][0] > time.time()
+                ):
+                    if self.delayed:
+                        self.delayed_ready.wait(self.delayed[0][0] - time.time())
+                    else:
+                        self.delayed_ready.wait()
+                if not self.running:
+                    return
+                _, _, job = heapq.heappop(self.delayed)
+            self.enqueue(job)
+
+    def worker(self, stage):
+        handler = self.handlers[stage]
+        while self.running:
+            job = self.queues[stage].get()
+            try:
+                result = handler(job)
+            except Exception as e:
+                logger.error(f'Error in unwind {stage}: {e}. TX: {job["tx_hash"]}')
+                logger.error(traceback.format_exc())
+                send_message_async(f"Error in CEX selling: {str(e)}")
+                result = False
+
+            if isinstance(result, Future):
+                result.add_done_callback(lambda _, job=job: self.schedule(job, 0))
+            elif result is None:
+                self.schedule(job, constants.unwind_poll_interval)
+            elif result:
+                self.advance(job)
+            else:
+                self.finish(job, False)
+
+    def advance(self, job):
+        now = time.time()
+        stage = job["stage"]
+        self.latencies[stage].append(now - job["stage_started_at"])
+
+        index = self.STAGES.index(stage) + 1
+        if index == len(self.STAGES):
+            self.finish(job, True)
+            return
+
+        job["stage"] = self.STAGES[index]
+        job["stage_started_at"] = now
+        self.save_jobs()
+        self.queues[job["stage"]].put(job)
+
+    def finish(self, job, success):
+        with self.lock:
+            self.jobs.pop(job["tx_hash"], None)
+            self.finished_count += 1
+            finished_count = self.finished_count
+        self.save_jobs()
+
+        if self.on_finished is not None:
+            try:
+                self.on_finished(job, success)
+            except Exception as e:
+                logger.error(f"Error finishing unwind: {e}")
+
+        if finished_count % constants.unwind_latency_log_every == 0:
+            logger.info(f"Unwind stage latency: {self.get_latency_stats()}")
+
+    def get_latency_stats(self):
+        # Распределение времени каждой стадии в секундах, включая ожидание в очереди
+        stats = {}
+        for stage, latencies in self.latencies.items():
+            if not latencies:
+                continue
+            latencies = sorted(latencies)
+
+            def percentile(p):
+                return latencies[min(int(len(latencies) * p), len(latencies) - 1)]
+
+            stats[stage] = {
+                "count": len(latencies),
+                "p50": percentile(0.5),
+                "p90": percentile(0.9),
+                "p99": percentile(0.99),
+                "max": latencies[-1],
+            }
+        return stats
+
+    def get_jobs(self, stage=None):
+        with self.lock:
+            return [
+                dict(job)
+                for job in self.jobs.values()
+                if stage is None or job["stage"] == stage
+            ]
+
+    def get_queue_sizes(self):
+        return {stage: self.queues[stage].qsize() for stage in self.STAGES}
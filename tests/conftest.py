@@ -0,0 +1,15 @@
+import os
+import sys
+
+import pytest
+
+# Модули бота импортируются из src как верхнеуровневые и читают
+# config/ и data/ по путям относительно src
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SRC_DIR = os.path.join(ROOT_DIR, "src")
+sys.path.insert(0, SRC_DIR)
+
+
+@pytest.fixture(autouse=True)
+def src_cwd(monkeypatch):
+    monkeypatch.chdir(SRC_DIR)
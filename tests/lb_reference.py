@@ -0,0 +1,249 @@
+"""
+Построчный перенос математики Liquidity Book v2.1 из контрактов
+(Uint128x128Math.pow, BinHelper.getAmounts, FeeHelper, PairParameterHelper,
+LBPair.getSwapOut, LBQuoter.findBestPathFromAmountIn для одного пути), с
+фиксированной точкой 128.128 и округлениями как в Solidity. Независим от
+lb_simulator: им сверяется симулятор, где нет записей с ноды.
+
+python tests/lb_reference.py пишет tests/data/lb_quotes/reference_v21.jsonl
+в формате LBSimulator.record_case.
+"""
+
+import json
+import os
+
+SCALE_OFFSET = 128
+SCALE = 1 << SCALE_OFFSET
+BASIS_POINT_MAX = 10_000
+REAL_ID_SHIFT = 1 << 23
+PRECISION = 10**18
+UINT256_MAX = (1 << 256) - 1
+
+WAVAX = "0xB31f66AA3C1e785363F0875A1B74E27b85FD66c7"
+USDC = "0xB97EF9Ef8734C71904D8002F8b6Bc66Dd9c48a6E"
+# Синтетический адрес пары: в кейсе важно только состояние
+PAIR = "0x" + "5a" * 20
+
+
+def pow128(x, y):
+    # Uint128x128Math.pow: двоичное возведение с отбрасыванием младших бит
+    invert = y < 0
+    abs_y = -y if invert else y
+    if abs_y >= 0x100000:
+        raise OverflowError("Exponent is too large")
+    result = SCALE
+    squared = x
+    if x > (1 << 128) - 1:
+        squared = UINT256_MAX // squared
+        invert = not invert
+    for bit in range(20):
+        if abs_y & (1 << bit):
+            result = (result * squared) >> 128
+        squared = (squared * squared) >> 128
+    if result == 0:
+        raise OverflowError("Pow underflow")
+    return UINT256_MAX // result if invert else result
+
+
+def get_price_from_id(bin_id, bin_step):
+    # PriceHelper.getPriceFromId
+    base = SCALE + (bin_step << SCALE_OFFSET) // BASIS_POINT_MAX
+    return pow128(base, bin_id - REAL_ID_SHIFT)
+
+
+def ceil_div(x, y):
+    return -(-x // y)
+
+
+def get_total_fee(pair, volatility_accumulator):
+    # PairParameterHelper.getTotalFee
+    base_fee = pair["base_factor"] * pair["bin_step"] * 10**10
+    variable_fee = 0
+    if pair["variable_fee_control"] != 0:
+        prod = volatility_accumulator * pair["bin_step"]
+        variable_fee = (prod * prod * pair["variable_fee_control"] + 99) // 100
+    return base_fee + variable_fee
+
+
+def get_amounts(pair, bin_id, swap_for_y, amount_in_left, volatility_accumulator):
+    # BinHelper.getAmounts для стороны входа
+    reserve_x, reserve_y = pair["bins"][str(bin_id)]
+    reserve_out = reserve_y if swap_for_y else reserve_x
+    price = get_price_from_id(bin_id, pair["bin_step"])
+    if swap_for_y:
+        # shiftDivRoundUp
+        max_amount_in = ceil_div(reserve_out << SCALE_OFFSET, price)
+    else:
+        # mulShiftRoundUp
+        max_amount_in = ceil_div(reserve_out * price, SCALE)
+
+    total_fee = get_total_fee(pair, volatility_accumulator)
+    # FeeHelper.getFeeAmount
+    max_fee = ceil_div(max_amount_in * total_fee, PRECISION - total_fee)
+    max_amount_in += max_fee
+
+    if amount_in_left >= max_amount_in:
+        return max_amount_in, reserve_out, max_fee
+    # FeeHelper.getFeeAmountFrom
+    fee = ceil_div(amount_in_left * total_fee, PRECISION)
+    amount_in = amount_in_left - fee
+    if swap_for_y:
+        amount_out = (amount_in * price) >> SCALE_OFFSET
+    else:
+        amount_out = (amount_in << SCALE_OFFSET) // price
+    return amount_in_left, min(amount_out, reserve_out), fee
+
+
+def get_swap_out(pair, amount_in, swap_for_y, timestamp):
+    # LBPair.getSwapOut: (amountInLeft, amountOut, fee)
+    id_reference = pair["id_reference"]
+    volatility_reference = pair["volatility_reference"]
+    if timestamp - pair["time_of_last_update"] >= pair["filter_period"]:
+        # updateReferences
+        id_reference = pair["active_id"]
+        if timestamp - pair["time_of_last_update"] < pair["decay_period"]:
+            volatility_reference = (
+                pair["volatility_accumulator"]
+                * pair["reduction_factor"]
+                // BASIS_POINT_MAX
+            )
+        else:
+            volatility_reference = 0
+
+    non_empty = sorted(
+        int(bin_id)
+        for bin_id, (reserve_x, reserve_y) in pair["bins"].items()
+        if (reserve_y if swap_for_y else reserve_x) > 0
+    )
+    amount_in_left, amount_out, fee = amount_in, 0, 0
+    bin_id = pair["active_id"]
+    while True:
+        reserves = pair["bins"].get(str(bin_id), (0, 0))
+        if (reserves[1] if swap_for_y else reserves[0]) > 0:
+            # updateVolatilityAccumulator
+            volatility_accumulator = min(
+                volatility_reference + abs(id_reference - bin_id) * BASIS_POINT_MAX,
+                pair["max_volatility_accumulator"],
+            )
+            amount_in_with_fees, amount_out_of_bin, bin_fee = get_amounts(
+                pair, bin_id, swap_for_y, amount_in_left, volatility_accumulator
+            )
+            if amount_in_with_fees > 0:
+                amount_in_left -= amount_in_with_fees
+                amount_out += amount_out_of_bin
+                fee += bin_fee
+        if amount_in_left == 0:
+            break
+        # _getNextNonEmptyBin: ниже по цене для swapForY, выше иначе
+        if swap_for_y:
+            candidates = [other for other in non_empty if other < bin_id]
+            if not candidates:
+                break
+            bin_id = candidates[-1]
+        else:
+            candidates = [other for other in non_empty if other > bin_id]
+            if not candidates:
+                break
+            bin_id = candidates[0]
+    return amount_in_left, amount_out, fee
+
+
+def quote(pairs, route, amount_in, timestamp):
+    # LBQuoter.findBestPathFromAmountIn для заданных пар маршрута (v2.1)
+    amounts = [amount_in]
+    virtual_amounts = [amount_in]
+    fees = []
+    for i, pair in enumerate(pairs):
+        swap_for_y = route[i].lower() == pair["token_x"].lower()
+        amount_in_left, amount_out, fee = get_swap_out(
+            pair, amounts[-1], swap_for_y, timestamp
+        )
+        if amount_in_left != 0:
+            raise ValueError("Not enough liquidity for the quote")
+        fees.append(fee * PRECISION // amounts[-1])
+        price = get_price_from_id(pair["active_id"], pair["bin_step"])
+        virtual_in = virtual_amounts[-1] - fee
+        if swap_for_y:
+            virtual_amounts.append((virtual_in * price) >> SCALE_OFFSET)
+        else:
+            virtual_amounts.append((virtual_in << SCALE_OFFSET) // price)
+        amounts.append(amount_out)
+    return {
+        "route": list(route),
+        "pairs": [pair["address"] for pair in pairs],
+        "bin_steps": [pair["bin_step"] for pair in pairs],
+        "versions": [2] * len(pairs),
+        "amounts": amounts,
+        "virtual_amounts": virtual_amounts,
+        "fees": fees,
+    }
+
+
+def make_wavax_usdc_pair(timestamp):
+    # WAVAX/USDC, шаг 20, около 30 USDC за AVAX (цена 3e-11 в единицах токенов)
+    active_id = 8_376_480
+    bins = {}
+    for offset in range(-60, 61):
+        bin_id = active_id + offset
+        if offset < 0:
+            reserves = [0, 12_000 * 10**6 + offset * 37 * 10**6]
+        elif offset > 0:
+            reserves = [400 * 10**18 - offset * 10**18, 0]
+        else:
+            reserves = [173 * 10**18, 6_900 * 10**6]
+        bins[str(bin_id)] = reserves
+    return {
+        "address": PAIR,
+        "token_x": WAVAX,
+        "token_y": USDC,
+        "bin_step": 20,
+        "active_id": active_id,
+        "base_factor": 8000,
+        "filter_period": 30,
+        "decay_period": 600,
+        "reduction_factor": 5000,
+        "variable_fee_control": 40000,
+        "max_volatility_accumulator": 350000,
+        "volatility_accumulator": 42000,
+        "volatility_reference": 20000,
+        "id_reference": active_id + 2,
+        "time_of_last_update": timestamp - 100,
+        "min_cached_id": active_id - 60,
+        "max_cached_id": active_id + 60,
+        "synced_block": 0,
+        "bins": bins,
+    }
+
+
+def make_cases():
+    timestamp = 1_700_000_000
+    pair = make_wavax_usdc_pair(timestamp)
+    cases = [
+        # Внутри активного бина
+        (pair, (WAVAX, USDC), 10**18),
+        # Через несколько бинов вниз по цене
+        (pair, (WAVAX, USDC), 2_000 * 10**18),
+        # USDC -> WAVAX через бины вверх
+        (pair, (USDC, WAVAX), 50_000 * 10**6),
+    ]
+    return [
+        {
+            "timestamp": timestamp,
+            "pairs": [pair],
+            "quote": quote([pair], route, amount_in, timestamp),
+        }
+        for pair, route, amount_in in cases
+    ]
+
+
+if __name__ == "__main__":
+    filename = os.path.join(
+        os.path.dirname(os.path.abspath(__file__)),
+        "data",
+        "lb_quotes",
+        "reference_v21.jsonl",
+    )
+    os.makedirs(os.path.dirname(filename), exist_ok=True)
+    with open(filename, "w") as file:
+        for case in make_cases():
+            file.write(json.dumps(case) + "\n")
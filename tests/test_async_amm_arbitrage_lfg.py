@@ -0,0 +1,91 @@
+import asyncio
+from collections import deque
+from types import SimpleNamespace
+
+from async_amm_arbitrage_lfg import AsyncAmmArbitrageLFG
+from binance_scheduler import BinanceScheduler, WeightBudget
+from config import constants
+
+
+def make_engine(get_cex_prices, get_amm_quotes):
+    # Только то, что нужно async_arbitrage, без RPC и ключей Binance
+    engine = AsyncAmmArbitrageLFG.__new__(AsyncAmmArbitrageLFG)
+    engine.stage_latencies = {
+        stage: deque(maxlen=10) for stage in AsyncAmmArbitrageLFG.STAGES
+    }
+    engine.last_cycle_latency = {}
+    engine.async_get_cex_prices = get_cex_prices
+    engine.async_get_amm_quotes = get_amm_quotes
+    engine.select_amm_prices = lambda amm_quotes, cex_prices: amm_quotes
+    engine.decisions = []
+    engine.handle_prices = lambda cex_prices, amm_prices, test_mode: (
+        engine.decisions.append((cex_prices, amm_prices))
+    )
+    return engine
+
+
+def test_cex_and_amm_are_fetched_concurrently():
+    # Каждая стадия ждет старта другой: последовательно это таймаут
+    async def run():
+        cex_started, amm_started = asyncio.Event(), asyncio.Event()
+
+        async def get_cex_prices():
+            cex_started.set()
+            await amm_started.wait()
+            return {"binance": {"AAA": 1.0}}
+
+        async def get_amm_quotes():
+            amm_started.set()
+            await cex_started.wait()
+            return {"AAA": [(10**18, None)]}
+
+        engine = make_engine(get_cex_prices, get_amm_quotes)
+        await engine.async_arbitrage(test_mode=True)
+        return engine
+
+    engine = asyncio.run(run())
+
+    assert engine.decisions == [
+        ({"binance": {"AAA": 1.0}}, {"AAA": [(10**18, None)]})
+    ]
+    assert set(engine.last_cycle_latency) == {"cex", "amm", "decision"}
+
+
+def test_stage_timeout_skips_decision(monkeypatch):
+    monkeypatch.setattr(constants, "stage_timeout", {"cex": 0.05, "amm": 1})
+
+    async def get_cex_prices():
+        await asyncio.sleep(5)
+
+    async def get_amm_quotes():
+        return {"AAA": [(10**18, None)]}
+
+    engine = make_engine(get_cex_prices, get_amm_quotes)
+    asyncio.run(engine.async_arbitrage(test_mode=True))
+
+    assert engine.decisions == []
+    assert engine.last_cycle_latency["cex"] < 1
+    assert len(engine.stage_latencies["amm"]) == 1
+    assert "decision" not in engine.last_cycle_latency
+
+
+def test_rest_fallback_counts_weight():
+    # Устаревший поток: запрос идет через BinanceScheduler и общий бюджет
+    class Client:
+        def get_orderbook_tickers(self):
+            return [{"symbol": "AAAUSDT", "bidPrice": "2.0"}]
+
+    budget = WeightBudget()
+    engine = AsyncAmmArbitrageLFG.__new__(AsyncAmmArbitrageLFG)
+    engine.network = "avalanche"
+    engine.tokens = ["AAA"]
+    engine.cex = "binance"
+    engine.book_ticker_cache = SimpleNamespace(get_tickers=lambda: None)
+    engine.cex_client = BinanceScheduler(Client(), budget)
+
+    prices = asyncio.run(engine.async_get_cex_prices())
+
+    assert prices["binance"]["AAA"] == 2.0
+    assert budget.get_used_weight() == constants.binance_request_weights[
+        "get_orderbook_tickers"
+    ]
@@ -0,0 +1,28 @@
+import json
+import threading
+
+from helpful_functions import atomic_write_json
+
+
+def test_concurrent_writers_leave_a_whole_file(tmp_path):
+    # Несколько писателей одного файла, как ExchangeInfoStore в процессах сетей
+    filename = str(tmp_path / "exchange_info.json")
+    errors = []
+
+    def write(writer):
+        try:
+            for i in range(50):
+                atomic_write_json(filename, {"writer": writer, "data": [i] * 100})
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=write, args=(writer,)) for writer in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert not errors
+    with open(filename) as file:
+        assert json.load(file)["data"] == [49] * 100
+    assert [path.name for path in tmp_path.iterdir()] == ["exchange_info.json"]
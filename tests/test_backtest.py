@@ -0,0 +1,117 @@
+import numpy as np
+import pytest
+
+from backtest import Backtester
+from helpful_functions import calculate_slippage
+from config import constants
+
+TOKENS = ["AAA", "BBB", "CCC", "DDD"]
+SYMBOLS = [f"{token}USDT" for token in TOKENS] + ["AVAXUSDT"]
+SIZES = [1.0, 2.0, 5.0]
+
+
+def make_tickers(rows):
+    # rows - список (time, symbol_id, bid_price)
+    time, symbol, bid = (np.array(column) for column in zip(*rows))
+    return {
+        "time": time.astype(float),
+        "symbol": symbol.astype(np.int32),
+        "bid_price": bid.astype(float),
+        "bid_qty": np.full(len(rows), 1000.0),
+        "ask_price": bid * 1.001,
+        "ask_qty": np.full(len(rows), 1000.0),
+    }
+
+
+def make_quotes(rows):
+    # rows - список (time, token_id, amount_in, amount_out) в порядке записи
+    time, token, amount_in, amount_out = (np.array(column) for column in zip(*rows))
+    return {
+        "time": time.astype(float),
+        "token": token.astype(np.int32),
+        "amount_in": amount_in.astype(float),
+        "amount_out": amount_out.astype(float),
+    }
+
+
+def random_backtester(scans=300, **kwargs):
+    rng = np.random.default_rng(7)
+    tickers = []
+    for scan in range(scans):
+        for symbol_id in range(len(SYMBOLS)):
+            base = 30.0 if symbol_id == len(TOKENS) else 1.0
+            tickers.append((scan - 0.5, symbol_id, base * rng.normal(1, 0.003)))
+    quotes = [
+        (scan, token_id, size, size * 30 * rng.normal(1, 0.01) * (1 - 0.001 * size))
+        for scan in range(scans)
+        for token_id in range(len(TOKENS))
+        for size in SIZES
+    ]
+    return Backtester(
+        make_tickers(tickers), SYMBOLS, make_quotes(quotes), TOKENS, **kwargs
+    )
+
+
+def vectorized_decisions(backtester):
+    rows, _ = backtester.decide()
+    quotes = backtester.quotes
+    return {
+        int(backtester.scan_ids[row]): (
+            TOKENS[quotes["token"][row]],
+            quotes["amount_in"][row],
+        )
+        for row in rows
+    }
+
+
+def test_decide_matches_reference():
+    backtester = random_backtester()
+    reference = backtester.reference_decisions()
+
+    assert reference
+    assert vectorized_decisions(backtester) == reference
+
+
+def test_ties_pick_first_token_like_reference():
+    # Одинаковые цены у всех токенов: живой код берет первый токен скана
+    tickers = make_tickers(
+        [(0, symbol_id, 1.0) for symbol_id in range(len(TOKENS))]
+        + [(0, len(TOKENS), 30.0)]
+    )
+    quotes = make_quotes(
+        [(1, token_id, size, size * 31) for token_id in (1, 2, 0) for size in SIZES]
+    )
+    backtester = Backtester(tickers, SYMBOLS, quotes, TOKENS)
+
+    assert backtester.reference_decisions() == {0: ("BBB", 5.0)}
+    assert vectorized_decisions(backtester) == {0: ("BBB", 5.0)}
+
+
+def test_no_passing_scans():
+    strict = {token: 1.0 for token in TOKENS}
+    backtester = random_backtester(scans=50, min_differences=strict)
+
+    rows, difference = backtester.decide()
+    assert len(rows) == len(difference) == 0
+    for report in backtester.run(latencies=[0, 1]):
+        assert report["trades"] == 0
+        assert report["pnl"] == 0.0
+
+
+@pytest.mark.parametrize(
+    "slippage_function, reverted", [(None, True), (calculate_slippage, False)]
+)
+def test_revert_uses_live_slippage(slippage_function, reverted):
+    # На исполнении выход на 0.8% хуже: больше фиксированного constants.slippage,
+    # но меньше calculate_slippage при разнице больше 6%
+    tickers = make_tickers([(0, 0, 1.0), (0, len(TOKENS), 30.0)])
+    quotes = make_quotes([(1, 0, 1.0, 40.0), (2, 0, 1.0, 40.0 * 0.992)])
+    backtester = Backtester(
+        tickers, SYMBOLS, quotes, TOKENS, slippage_function=slippage_function
+    )
+
+    rows, difference = backtester.decide()
+    assert difference[0] > 0.06
+    assert constants.slippage < 0.008 < calculate_slippage(difference[0] * 100)
+    _, flags, _ = backtester.simulate(rows[:1], difference[:1], latency=1)
+    assert bool(flags[0]) is reverted
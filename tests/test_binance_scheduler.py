@@ -0,0 +1,37 @@
+import multiprocessing
+
+from binance_scheduler import BinanceScheduler, WeightBudget
+from config import constants
+
+
+def reserve_in_child(budget, weight):
+    assert budget.reserve(weight, constants.binance_weight_limit) == 0
+
+
+def test_budget_is_shared_between_processes():
+    budget = WeightBudget()
+    process = multiprocessing.Process(target=reserve_in_child, args=(budget, 100))
+    process.start()
+    process.join()
+
+    assert process.exitcode == 0
+    assert budget.get_used_weight() == 100
+
+
+def test_schedulers_share_one_limit(monkeypatch):
+    # Два процесса сети на одном IP: второй планировщик видит вес первого
+    class Client:
+        def get_all_tickers(self):
+            return []
+
+    monkeypatch.setattr(constants, "binance_weight_limit", 10)
+    budget = WeightBudget()
+    first = BinanceScheduler(Client(), budget)
+    second = BinanceScheduler(Client(), budget)
+
+    first.get_all_tickers()
+    assert budget.get_used_weight() == constants.binance_request_weights[
+        "get_all_tickers"
+    ]
+    assert budget.reserve(10, constants.binance_weight_limit) > 0
+    assert second.get_stats()["used_weight"] == budget.get_used_weight()
@@ -0,0 +1,166 @@
+import asyncio
+import json
+import threading
+import time
+from types import SimpleNamespace
+
+import pytest
+import websockets
+
+from amm_arbitrage_lfg import AmmArbitrageLFG
+from binance_streams import BookTickerCache
+
+STALE_AFTER = 0.3
+
+
+class StreamStandIn:
+    """
+    Локальный websocket вместо combined stream Binance. Крутится в своем
+    потоке с отдельным event loop, send() рассылает сообщение всем клиентам.
+    """
+
+    def __init__(self):
+        self.connections = set()
+        self.loop = asyncio.new_event_loop()
+        threading.Thread(target=self.loop.run_forever, daemon=True).start()
+        self.server = self.call(self.serve())
+        self.url = f"ws://127.0.0.1:{self.server.sockets[0].getsockname()[1]}"
+
+    async def serve(self):
+        # websockets.serve возвращает awaitable, а не корутину
+        return await websockets.serve(self.handler, "127.0.0.1", 0)
+
+    def call(self, coroutine):
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop).result(5)
+
+    async def handler(self, websocket, *args):
+        self.connections.add(websocket)
+        try:
+            await websocket.wait_closed()
+        finally:
+            self.connections.discard(websocket)
+
+    async def broadcast(self, message):
+        for websocket in list(self.connections):
+            await websocket.send(message)
+
+    def send_ticker(self, symbol, bid_price, ask_price=None):
+        data = {
+            "s": symbol,
+            "b": str(bid_price),
+            "B": "10",
+            "a": str(ask_price or bid_price * 1.001),
+            "A": "10",
+        }
+        message = {"stream": f"{symbol.lower()}@bookTicker", "data": data}
+        self.call(self.broadcast(json.dumps(message)))
+
+    def close(self):
+        self.server.close()
+        self.call(self.server.wait_closed())
+        self.loop.call_soon_threadsafe(self.loop.stop)
+
+
+def wait_for(condition, timeout=5):
+    deadline = time.time() + timeout
+    while not condition():
+        if time.time() > deadline:
+            raise TimeoutError("Condition not met")
+        time.sleep(0.01)
+
+
+@pytest.fixture
+def stand_in():
+    stand_in = StreamStandIn()
+    yield stand_in
+    stand_in.close()
+
+
+@pytest.fixture
+def cache(stand_in):
+    cache = BookTickerCache(
+        ["AAAUSDT", "BBBUSDT"], url=stand_in.url, stale_after=STALE_AFTER
+    )
+    cache.start()
+    wait_for(lambda: stand_in.connections)
+    yield cache
+    cache.stop()
+
+
+def test_snapshot_is_replaced_not_mutated(stand_in, cache):
+    stand_in.send_ticker("AAAUSDT", 1.0)
+    wait_for(lambda: "AAAUSDT" in cache.get_snapshot())
+    snapshot = cache.get_snapshot()
+
+    stand_in.send_ticker("AAAUSDT", 2.0)
+    stand_in.send_ticker("BBBUSDT", 3.0)
+    wait_for(lambda: "BBBUSDT" in cache.get_snapshot())
+
+    # Читатель старого снапшота не видит обновлений
+    assert snapshot is not cache.get_snapshot()
+    assert snapshot["AAAUSDT"].bid_price == 1.0
+    assert "BBBUSDT" not in snapshot
+    assert cache.get_snapshot()["AAAUSDT"].bid_price == 2.0
+    assert cache.get_snapshot()["BBBUSDT"].ask_qty == 10.0
+
+
+def test_stale_until_every_symbol_arrives(stand_in, cache):
+    assert cache.is_stale()
+
+    stand_in.send_ticker("AAAUSDT", 1.0)
+    wait_for(lambda: "AAAUSDT" in cache.get_snapshot())
+    assert cache.is_stale()
+    assert cache.get_tickers() is None
+
+    stand_in.send_ticker("BBBUSDT", 3.0)
+    wait_for(lambda: "BBBUSDT" in cache.get_snapshot())
+    assert not cache.is_stale()
+    tickers = {ticker["symbol"]: ticker for ticker in cache.get_tickers()}
+    assert tickers["BBBUSDT"]["bidPrice"] == 3.0
+
+
+def test_stale_after_silence(stand_in, cache):
+    stand_in.send_ticker("AAAUSDT", 1.0)
+    stand_in.send_ticker("BBBUSDT", 3.0)
+    wait_for(lambda: not cache.is_stale())
+
+    time.sleep(STALE_AFTER * 1.5)
+
+    assert cache.is_stale()
+    assert cache.get_tickers() is None
+
+
+def make_engine(cache, rest_tickers):
+    # Только то, что нужно get_cex_prices, без RPC и ключей Binance
+    engine = AmmArbitrageLFG.__new__(AmmArbitrageLFG)
+    engine.network = "avalanche"
+    engine.tokens = ["AAA", "BBB"]
+    engine.cex = "binance"
+    engine.book_ticker_cache = cache
+    engine.rest_calls = 0
+
+    def get_orderbook_tickers():
+        engine.rest_calls += 1
+        return rest_tickers
+
+    engine.cex_client = SimpleNamespace(get_orderbook_tickers=get_orderbook_tickers)
+    return engine
+
+
+def test_rest_fallback_when_stream_is_stale(stand_in, cache):
+    rest_tickers = [
+        {"symbol": "AAAUSDT", "bidPrice": "5.0"},
+        {"symbol": "BBBUSDT", "bidPrice": "6.0"},
+    ]
+    engine = make_engine(cache, rest_tickers)
+
+    prices = engine.get_cex_prices()["binance"]
+    assert engine.rest_calls == 1
+    assert prices["AAA"] == 5.0
+
+    stand_in.send_ticker("AAAUSDT", 1.0)
+    stand_in.send_ticker("BBBUSDT", 3.0)
+    wait_for(lambda: not cache.is_stale())
+    prices = engine.get_cex_prices()["binance"]
+    assert engine.rest_calls == 1
+    assert prices == {"AAA": 1.0, "BBB": 3.0}
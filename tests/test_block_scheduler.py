@@ -0,0 +1,92 @@
+import time
+from types import SimpleNamespace
+
+import pytest
+
+from block_scheduler import BlockScheduler
+
+POLL_INTERVAL = 0.0001
+# Блоки в скрипте старше времени скана на столько секунд
+BLOCK_AGE = 2
+
+
+class ScriptedEth:
+    """
+    eth_blockNumber по скрипту: None в скрипте - ошибка RPC. Когда скрипт
+    закончился, останавливает планировщик.
+    """
+
+    def __init__(self, block_numbers):
+        self.block_numbers = list(block_numbers)
+        self.scheduler = None
+        self.get_block_error = None
+
+    @property
+    def block_number(self):
+        if not self.block_numbers:
+            self.scheduler.stop()
+            raise RuntimeError("script finished")
+        block_number = self.block_numbers.pop(0)
+        if block_number is None:
+            raise ConnectionError("RPC unavailable")
+        return block_number
+
+    def get_block(self, block_number):
+        if self.get_block_error:
+            raise self.get_block_error
+        return {"number": block_number, "timestamp": time.time() - BLOCK_AGE}
+
+
+def run_script(block_numbers, on_block=None, get_block_error=None):
+    eth = ScriptedEth(block_numbers)
+    eth.get_block_error = get_block_error
+    scanned = []
+
+    def scan(block_number):
+        scanned.append(block_number)
+        if on_block is not None:
+            on_block(block_number)
+
+    scheduler = BlockScheduler(SimpleNamespace(eth=eth), scan, POLL_INTERVAL)
+    eth.scheduler = scheduler
+    scheduler.start()
+    return scheduler, scanned
+
+
+def test_one_scan_per_new_block():
+    scheduler, scanned = run_script([10, 10, 11, 11, 11, 12, 15, 15, 14])
+
+    # Блоки 13 и 14 пришли за время скана 12 - один скан по самому свежему
+    assert scanned == [10, 11, 12, 15]
+    assert scheduler.scans_count == 4
+    assert len(scheduler.latencies) == 4
+    for latency in scheduler.latencies:
+        assert latency == pytest.approx(BLOCK_AGE, abs=0.5)
+    assert scheduler.get_latency_stats()["count"] == 4
+
+
+def test_rpc_errors_do_not_skip_blocks():
+    scheduler, scanned = run_script([None, 10, None, None, 10, 11])
+
+    assert scanned == [10, 11]
+    assert len(scheduler.latencies) == 2
+
+
+def test_failed_scan_records_latency():
+    def on_block(block_number):
+        raise ValueError("scan failed")
+
+    scheduler, scanned = run_script([10, 11], on_block)
+
+    assert scanned == [10, 11]
+    assert len(scheduler.latencies) == 2
+
+
+def test_missing_block_header_skips_latency():
+    scheduler, scanned = run_script(
+        [10, 11], get_block_error=ConnectionError("RPC unavailable")
+    )
+
+    assert scanned == [10, 11]
+    assert scheduler.scans_count == 0
+    assert scheduler.get_latency_stats() == {}
@@ -0,0 +1,65 @@
+import time
+
+import pytest
+
+from deposit_matcher import DepositMatcher, DepositTimeout
+
+
+class StubClient:
+    def __init__(self, deposits):
+        self.deposits = deposits
+        self.calls = 0
+
+    def get_deposit_history(self, startTime):
+        self.calls += 1
+        return self.deposits
+
+
+def test_confirmed_deposit_is_collected_by_next_watch():
+    deposit = {"txId": "0xaa", "status": 1, "coin": "QI", "amount": "10"}
+    matcher = DepositMatcher(StubClient([deposit]))
+
+    future = matcher.watch("0xaa", since=time.time())
+    assert not future.done()
+    matcher.poll()
+
+    # Стадия deposit после повтора вызывает watch заново
+    again = matcher.watch("0xaa")
+    assert again is future
+    assert again.result() == deposit
+    assert matcher.get_pending_count() == 0
+    assert not matcher.finished
+
+
+def test_pending_deposit_keeps_waiting():
+    deposit = {"txId": "0xaa", "status": 0, "coin": "QI", "amount": "10"}
+    matcher = DepositMatcher(StubClient([deposit]))
+
+    future = matcher.watch("0xaa", since=time.time())
+    assert matcher.poll()
+    assert not future.done()
+    assert matcher.watch("0xaa") is future
+
+
+def test_expired_deposit_fails_once():
+    matcher = DepositMatcher(StubClient([]))
+
+    future = matcher.watch("0xaa", since=time.time(), timeout=0.001)
+    time.sleep(0.01)
+    matcher.poll()
+
+    again = matcher.watch("0xaa")
+    assert again is future
+    with pytest.raises(DepositTimeout):
+        again.result()
+    assert matcher.get_pending_count() == 0
+
+
+def test_cancel_drops_finished_result():
+    deposit = {"txId": "0xaa", "status": 1, "coin": "QI", "amount": "10"}
+    matcher = DepositMatcher(StubClient([deposit]))
+
+    matcher.watch("0xaa", since=time.time())
+    matcher.poll()
+    matcher.cancel("0xaa")
+    assert not matcher.finished
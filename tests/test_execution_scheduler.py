@@ -0,0 +1,122 @@
+from types import SimpleNamespace
+
+from execution_scheduler import ExecutionScheduler
+from records import Opportunity, Quote
+from size_optimizer import SizeOptimizer
+
+NETWORK = "avalanche"
+BASE_PRICE = 30.0
+TOKEN_ADDRESS = "0x" + "11" * 20
+
+
+def make_opportunity(token, amount_in, amount_out, pair):
+    quote = Quote(
+        ("0x" + "22" * 20, TOKEN_ADDRESS),
+        (pair,),
+        (20,),
+        (2,),
+        (amount_in, amount_out),
+    )
+    opportunity = Opportunity(token, NETWORK, TOKEN_ADDRESS)
+    opportunity.set_quote(amount_in, quote)
+    opportunity.candidates = [(amount_in, quote)]
+    return opportunity
+
+
+def make_scheduler(sell_prices, available=1000):
+    # Без комиссии вывода и газа профит зависит только от цены продажи
+    size_optimizer = SizeOptimizer(
+        NETWORK,
+        SimpleNamespace(get_withdrawal_fee=lambda token, network: 0),
+        SimpleNamespace(get_fees=lambda: (0, 0)),
+    )
+    trades = []
+
+    def make_trade(opportunity, position_id):
+        trades.append(opportunity)
+        return f"0x{position_id:064x}"
+
+    scheduler = ExecutionScheduler(
+        NETWORK,
+        SimpleNamespace(available=lambda: available),
+        size_optimizer,
+        lambda token, quantity: sell_prices[token],
+        make_trade,
+    )
+    return scheduler, trades
+
+
+def test_skips_opportunities_without_profit():
+    # 10 AVAX -> 300 токенов. По 1.01 USDT профит есть, по 0.99 - нет
+    amount_in, amount_out = 10 * 10**18, 300 * 10**18
+    opportunities = [
+        make_opportunity("AAA", amount_in, amount_out, "0x" + "a1" * 20),
+        make_opportunity("BBB", amount_in, amount_out, "0x" + "b1" * 20),
+        make_opportunity("CCC", amount_in, amount_out, "0x" + "c1" * 20),
+    ]
+    scheduler, trades = make_scheduler({"AAA": 0.99, "BBB": 1.01, "CCC": 1.01})
+    cex_prices = {"AVAX": BASE_PRICE, "AAA": 1.0, "BBB": 1.0}
+
+    tx_hashes = scheduler.execute(opportunities, cex_prices)
+
+    # У CCC нет цены CEX, профит не оценить
+    assert [trade.token_name for trade in trades] == ["BBB"]
+    assert len(tx_hashes) == 1
+    assert trades[0].expected_profit > 0
+    assert scheduler.get_exposure() == 10
+
+
+def test_profit_rechecked_for_smaller_size():
+    # Лимит на токен не пускает выбранный размер, меньший тоже убыточен
+    opportunity = make_opportunity("AAA", 200 * 10**18, 6000 * 10**18, "0x" + "a1" * 20)
+    small_quote = Quote(
+        opportunity.quote.route,
+        opportunity.quote.pairs,
+        (20,),
+        (2,),
+        (50 * 10**18, 1400 * 10**18),
+    )
+    opportunity.candidates.append((50 * 10**18, small_quote))
+    scheduler, trades = make_scheduler({"AAA": 1.01})
+    cex_prices = {"AVAX": BASE_PRICE, "AAA": 1.0}
+
+    assert scheduler.execute([opportunity], cex_prices) == []
+    assert trades == []
+    assert scheduler.get_exposure() == 0
+
+
+def test_size_selected_outside_lock():
+    # select может ходить в RPC за газом, планировщик при этом не заблокирован
+    opportunity = make_opportunity("AAA", 10 * 10**18, 300 * 10**18, "0x" + "a1" * 20)
+    scheduler, trades = make_scheduler({"AAA": 1.01})
+    select = scheduler.size_optimizer.select
+    locked = []
+
+    def select_unlocked(*args):
+        locked.append(scheduler.lock.locked())
+        return select(*args)
+
+    scheduler.size_optimizer.select = select_unlocked
+
+    scheduler.execute([opportunity], {"AVAX": BASE_PRICE, "AAA": 1.0})
+
+    assert locked == [False]
+    assert len(trades) == 1
+
+
+def test_limits_rechecked_after_sizing():
+    # Пока выбирался размер, другой поток занял лимит токена
+    opportunity = make_opportunity("AAA", 10 * 10**18, 300 * 10**18, "0x" + "a1" * 20)
+    scheduler, trades = make_scheduler({"AAA": 1.01})
+    select = scheduler.size_optimizer.select
+
+    def select_and_race(*args):
+        with scheduler.lock:
+            scheduler.positions[0] = ("AAA", scheduler.max_token_exposure - 5)
+        return select(*args)
+
+    scheduler.size_optimizer.select = select_and_race
+
+    assert scheduler.execute([opportunity], {"AVAX": BASE_PRICE, "AAA": 1.0}) == []
+    assert trades == []
+    assert scheduler.get_exposure("AAA") == scheduler.max_token_exposure - 5
@@ -0,0 +1,70 @@
+from contextlib import nullcontext
+from types import SimpleNamespace
+
+from web3 import Web3
+
+from amm_arbitrage_lfg import AmmArbitrageLFG
+from lfg_client import QUOTE_OUTPUT_TYPE, LFGclient
+
+WAVAX = "0xB31f66AA3C1e785363F0875A1B74E27b85FD66c7"
+TOKEN_A = "0x" + "aa" * 20
+TOKEN_B = "0x" + "bb" * 20
+PAIR = "0x" + "5a" * 20
+
+
+def encode_quote(token, amount_in, amount_out):
+    quote = (
+        [WAVAX, token],
+        [PAIR],
+        [20],
+        [2],
+        [amount_in, amount_out],
+        [amount_in, amount_out],
+        [10**15],
+    )
+    return Web3().codec.encode([QUOTE_OUTPUT_TYPE], [quote])
+
+
+def make_client(results):
+    # Только то, что нужно get_best_paths_from_amount_in, без RPC
+    client = LFGclient.__new__(LFGclient)
+    client.web3 = Web3()
+    client.quoter = SimpleNamespace(
+        address="0x" + "cc" * 20, encodeABI=lambda fn_name, args: b""
+    )
+    client.hedged = nullcontext
+    client.aggregate3 = lambda calls: results
+    return client
+
+
+def test_reverted_subcall_decodes_to_none():
+    client = make_client([])
+
+    assert client.decode_quote_result(False, b"") is None
+    # Ревертнувший подвызов может вернуть данные ошибки
+    assert client.decode_quote_result(False, b"\x08\xc3\x79\xa0") is None
+
+
+def test_reverted_subcall_skips_only_its_token():
+    amount_in = 10**18
+    client = make_client(
+        [(False, b""), (True, encode_quote(TOKEN_B, amount_in, 30 * 10**18))]
+    )
+    requests = [
+        ("AAA", [WAVAX, TOKEN_A], amount_in),
+        ("BBB", [WAVAX, TOKEN_B], amount_in),
+    ]
+
+    quotes = client.get_best_paths_from_amount_in(
+        [(token_path, amount) for _, token_path, amount in requests]
+    )
+    assert quotes[0] is None
+    assert quotes[1].amount_out == 30 * 10**18
+
+    engine = AmmArbitrageLFG.__new__(AmmArbitrageLFG)
+    engine.lb_simulator = SimpleNamespace(running=False)
+    engine.recorder = None
+    amm_quotes = engine.group_quotes(requests, quotes)
+
+    assert list(amm_quotes) == ["BBB"]
+    assert amm_quotes["BBB"] == [(amount_in, quotes[1])]
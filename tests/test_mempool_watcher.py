@@ -0,0 +1,131 @@
+import json
+import time
+from types import SimpleNamespace
+
+import pytest
+from web3 import Web3
+
+from config import constants
+from lb_simulator import LBPairState, LBSimulator
+from mempool_watcher import MempoolWatcher
+from records import Opportunity, Quote
+
+ROUTER = constants.chain["avalanche"]["lfg_router"]
+WAVAX = constants.chain["avalanche"]["network_base_token"]
+TOKEN = Web3.to_checksum_address("0x" + "11" * 20)
+PAIR = Web3.to_checksum_address("0x" + "22" * 20)
+SENDER = Web3.to_checksum_address("0x" + "33" * 20)
+BIN_STEP = 20
+ACTIVE_ID = 1 << 23
+
+
+def make_pair():
+    # TOKEN/WAVAX по цене 1, по 10 токенов в каждом бине
+    state = LBPairState(PAIR)
+    state.token_x, state.token_y = TOKEN, WAVAX
+    state.bin_step = BIN_STEP
+    state.active_id = ACTIVE_ID
+    state.base_factor = 5000
+    state.filter_period = 30
+    state.decay_period = 600
+    state.reduction_factor = 5000
+    state.max_volatility_accumulator = 350000
+    state.time_of_last_update = time.time()
+    state.min_cached_id = ACTIVE_ID - 50
+    state.max_cached_id = ACTIVE_ID + 50
+    for bin_id in range(state.min_cached_id, state.max_cached_id + 1):
+        if bin_id < ACTIVE_ID:
+            state.bins[bin_id] = [0, 10 * 10**18]
+        elif bin_id > ACTIVE_ID:
+            state.bins[bin_id] = [10 * 10**18, 0]
+        else:
+            state.bins[bin_id] = [5 * 10**18, 5 * 10**18]
+    return state
+
+
+@pytest.fixture
+def watcher():
+    w3 = Web3()
+    with open(constants.ROUTER_ABI_PATH) as file:
+        router = w3.eth.contract(address=ROUTER, abi=json.load(file))
+    lfg_client = SimpleNamespace(web3=w3, router=router)
+
+    lb_simulator = LBSimulator(lfg_client)
+    lb_simulator.pairs[PAIR.lower()] = make_pair()
+
+    watcher = MempoolWatcher(
+        "avalanche",
+        lfg_client,
+        lb_simulator,
+        lambda: {"AVAX": 30.0, "TEST": 30.0},
+        lambda token, quantity: 30.0,
+        lambda opportunity: None,
+    )
+    watcher.running = True
+
+    # Скан до чужого свапа: 1 WAVAX -> TEST дороже цены CEX
+    amount_in = 10**18
+    amount_out = make_pair().swap(amount_in, False)
+    quote = Quote((WAVAX, TOKEN), (PAIR,), (BIN_STEP,), (2,), (amount_in, amount_out))
+    opportunity = Opportunity("TEST", "avalanche", TOKEN).set_quote(amount_in, quote)
+    watcher.publish({"TEST": opportunity})
+    return watcher
+
+
+def make_tx(watcher, nonce, fn_name, token_path, amount_in):
+    path = ([BIN_STEP], [2], list(token_path))
+    if fn_name == "swapExactNATIVEForTokens":
+        args, value = [0, path, SENDER, 2**32], amount_in
+    else:
+        args, value = [amount_in, 0, path, SENDER, 2**32], 0
+    return {
+        "hash": Web3.keccak(nonce.to_bytes(32, "big")),
+        "to": ROUTER,
+        "value": value,
+        "input": watcher.lfg_client.router.encodeABI(fn_name=fn_name, args=args),
+    }
+
+
+def test_replay_recorded_stream(watcher, tmp_path, monkeypatch):
+    stream = tmp_path / "mempool.jsonl"
+    monkeypatch.setattr(constants, "mempool_record_file", str(stream))
+
+    # Крупная продажа TEST двигает цену вниз, покупка за AVAX - вверх
+    sell = make_tx(watcher, 1, "swapExactTokensForTokens", (TOKEN, WAVAX), 100 * 10**18)
+    buy = make_tx(watcher, 2, "swapExactNATIVEForTokens", (WAVAX, TOKEN), 10**18)
+    for tx in (sell, buy):
+        watcher.record(tx)
+
+    results = watcher.replay(str(stream))
+
+    assert [tx_hash for tx_hash, _ in results] == [Web3.to_hex(sell["hash"])]
+    (backrun,) = results[0][1]
+    scan = watcher.opportunities["TEST"]
+    assert backrun.token_name == "TEST"
+    assert backrun.amount_in == scan.amount_in
+    assert backrun.quote.amounts[-1] > scan.quote.amounts[-1]
+    assert backrun.difference > 0.01
+
+
+def test_simulation_does_not_touch_cached_pairs(watcher):
+    sell = make_tx(watcher, 1, "swapExactTokensForTokens", (TOKEN, WAVAX), 100 * 10**18)
+    assert watcher.process_transaction(sell)
+
+    state = watcher.lb_simulator.pairs[PAIR.lower()]
+    assert state.active_id == ACTIVE_ID
+    assert state.bins == make_pair().bins
+
+
+def test_publish_snapshot_is_independent_of_scan_records(watcher):
+    record = Opportunity("TEST", "avalanche", TOKEN).set_quote(
+        10**18, Quote((WAVAX, TOKEN), (PAIR,), (BIN_STEP,), (2,), (10**18, 10**18))
+    )
+    watcher.publish({"TEST": record})
+    snapshot = watcher.opportunities["TEST"]
+
+    # Следующий скан перезаписывает запись scan_buffer на месте
+    record.quote.load(((), (), (), (), (5 * 10**18, 1), (), ()))
+    record.set_quote(5 * 10**18, record.quote)
+
+    assert snapshot.amount_in == 10**18
+    assert snapshot.quote.amounts == (10**18, 10**18)
@@ -0,0 +1,38 @@
+import pytest
+
+from opportunity_scoring import OpportunityScorer
+from records import Opportunity
+
+
+def make_dex_prices(prices):
+    dex_prices = {}
+    for token, price in prices.items():
+        dex_prices[token] = Opportunity(token, "avalanche", token_address="0x0")
+        dex_prices[token].price = price
+    return dex_prices
+
+
+def test_missing_base_price_is_not_ranked():
+    # На okx нет цены AVAX: разница по okx не считается, а не равна 100%
+    scorer = OpportunityScorer(["AAA", "BBB"], ["binance", "okx"])
+    cex_prices = {
+        "binance": {"AVAX": 30.0, "AAA": 1.1, "BBB": 1.0},
+        "okx": {"AAA": 5.0, "BBB": 5.0},
+    }
+    dex_prices = make_dex_prices({"AAA": 1 / 30, "BBB": 1 / 30})
+
+    opportunities = scorer.rank_opportunities(cex_prices, dex_prices, top_k=2)
+
+    assert [opportunity.token_name for opportunity in opportunities] == ["AAA"]
+    assert opportunities[0].cex == "binance"
+    assert opportunities[0].difference == pytest.approx(0.1 / 1.1)
+
+
+def test_tokens_without_prices_are_skipped():
+    scorer = OpportunityScorer(["AAA", "BBB", "CCC"], ["binance"])
+    cex_prices = {"binance": {"AVAX": 30.0, "AAA": 1.5, "BBB": 1.2}}
+    # У CCC нет цены CEX, у BBB нет котировки DEX, AAA нет в скане
+    dex_prices = make_dex_prices({"BBB": None, "CCC": 1 / 30})
+
+    assert scorer.rank_opportunities(cex_prices, dex_prices) == []
+    assert scorer.score()[0].tolist() == [-float("inf")] * 3
@@ -0,0 +1,121 @@
+import time
+
+from order_book import OrderBook, OrderBookMirror
+
+SYMBOL = "AAAUSDT"
+
+
+def make_snapshot(last_update_id, bids, asks=()):
+    return {
+        "lastUpdateId": last_update_id,
+        "bids": [[str(price), str(quantity)] for price, quantity in bids],
+        "asks": [[str(price), str(quantity)] for price, quantity in asks],
+    }
+
+
+def make_diff(first_id, last_id, bids=(), asks=()):
+    return {
+        "s": SYMBOL,
+        "U": first_id,
+        "u": last_id,
+        "b": [[str(price), str(quantity)] for price, quantity in bids],
+        "a": [[str(price), str(quantity)] for price, quantity in asks],
+    }
+
+
+def wait_for(condition, timeout=5):
+    deadline = time.time() + timeout
+    while not condition():
+        if time.time() > deadline:
+            raise TimeoutError("Condition not met")
+        time.sleep(0.01)
+
+
+def test_buffered_diffs_applied_from_snapshot_id():
+    book = OrderBook(SYMBOL)
+    # Пришли до снапшота: первый целиком старше lastUpdateId, второй его перекрывает
+    book.apply_diff(make_diff(90, 99, bids=[(1.0, 7)]))
+    book.apply_diff(make_diff(100, 105, bids=[(1.1, 3)]))
+    assert book.get_sell_price(1) is None
+
+    assert book.apply_snapshot(make_snapshot(101, bids=[(1.0, 5)], asks=[(1.2, 4)]))
+
+    assert book.last_update_id == 105
+    assert book.get_levels("bids", 5) == [(1.1, 3.0), (1.0, 5.0)]
+    assert book.get_levels("asks", 5) == [(1.2, 4.0)]
+
+
+def test_stale_diff_is_dropped():
+    book = OrderBook(SYMBOL)
+    book.apply_snapshot(make_snapshot(100, bids=[(1.0, 5)]))
+    assert book.apply_diff(make_diff(101, 102, bids=[(1.0, 2)]))
+
+    # u не больше lastUpdateId: событие уже учтено
+    assert book.apply_diff(make_diff(95, 102, bids=[(1.0, 9), (0.9, 1)]))
+
+    assert book.last_update_id == 102
+    assert book.get_levels("bids", 5) == [(1.0, 2.0)]
+
+
+def test_zero_quantity_removes_level():
+    book = OrderBook(SYMBOL)
+    book.apply_snapshot(make_snapshot(100, bids=[(1.0, 5), (0.9, 5)]))
+
+    assert book.apply_diff(make_diff(101, 101, bids=[(1.0, 0)]))
+
+    assert book.get_levels("bids", 5) == [(0.9, 5.0)]
+    assert book.get_sell_price(5) == 0.9
+
+
+def test_gap_stops_the_book():
+    book = OrderBook(SYMBOL)
+    book.apply_snapshot(make_snapshot(100, bids=[(1.0, 5)]))
+
+    # Пропущены события 101-102
+    assert not book.apply_diff(make_diff(103, 104, bids=[(1.0, 1)]))
+
+    assert not book.synced
+    assert book.get_sell_price(1) is None
+    assert book.get_levels("bids", 5) == [(1.0, 5.0)]
+
+
+def test_gap_after_snapshot_needs_resync():
+    book = OrderBook(SYMBOL)
+    book.apply_diff(make_diff(110, 112))
+
+    assert not book.apply_snapshot(make_snapshot(100, bids=[(1.0, 5)]))
+    assert not book.synced
+
+
+class StubClient:
+    def __init__(self, snapshots):
+        self.snapshots = list(snapshots)
+        self.requests = []
+
+    def get_order_book(self, symbol, limit):
+        self.requests.append(symbol)
+        return self.snapshots.pop(0)
+
+
+def test_mirror_resyncs_on_gap():
+    client = StubClient(
+        [
+            make_snapshot(100, bids=[(1.0, 5)]),
+            make_snapshot(200, bids=[(2.0, 5)]),
+        ]
+    )
+    mirror = OrderBookMirror(client, [SYMBOL])
+    book = mirror.get_book(SYMBOL)
+
+    mirror.on_connect()
+    wait_for(lambda: book.synced)
+    mirror.on_message(make_diff(101, 101, bids=[(1.0, 4)]))
+    assert book.get_sell_price(4) == 1.0
+
+    mirror.on_message(make_diff(150, 151, bids=[(1.0, 1)]))
+    wait_for(lambda: book.synced and book.last_update_id >= 200)
+
+    assert client.requests == [SYMBOL, SYMBOL]
+    assert book.get_levels("bids", 5) == [(2.0, 5.0)]
+    mirror.on_message(make_diff(201, 201, bids=[(2.0, 3)]))
+    assert book.get_levels("bids", 5) == [(2.0, 3.0)]
@@ -0,0 +1,165 @@
+import asyncio
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from config import constants
+from rpc_provider import AsyncMultiEndpointProvider, MultiEndpointProvider
+
+
+class StubRPC:
+    """
+    Локальный JSON-RPC. Отвечает result через delay секунд, JSON-RPC ошибкой
+    (error), либо HTTP 500 (fail). Поведение можно менять между запросами.
+    """
+
+    def __init__(self, result="0x1", delay=0, error=None, fail=False):
+        self.result = result
+        self.delay = delay
+        self.error = error
+        self.fail = fail
+        self.methods = []
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_POST(self):
+                length = int(self.headers["Content-Length"])
+                request = json.loads(self.rfile.read(length))
+                stub.methods.append(request["method"])
+                time.sleep(stub.delay)
+                if stub.fail:
+                    body = b"{}"
+                    self.send_response(500)
+                else:
+                    response = {"jsonrpc": "2.0", "id": request["id"]}
+                    if stub.error:
+                        response["error"] = {"code": -32000, "message": stub.error}
+                    else:
+                        response["result"] = stub.result
+                    body = json.dumps(response).encode()
+                    self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self.server.server_port}"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+@pytest.fixture
+def stubs():
+    started = []
+
+    def start(**kwargs):
+        stub = StubRPC(**kwargs)
+        started.append(stub)
+        return stub
+
+    yield start
+    for stub in started:
+        stub.close()
+
+
+def test_read_fails_over_to_next_endpoint(stubs):
+    broken, working = stubs(fail=True), stubs(result="0x2")
+    provider = MultiEndpointProvider([broken.url, working.url])
+
+    response = provider.make_request("eth_blockNumber", [])
+
+    assert response["result"] == "0x2"
+    assert broken.methods == working.methods == ["eth_blockNumber"]
+    assert provider.get_stats()[broken.url]["error_rate"] == constants.rpc_ewma_alpha
+
+
+def test_error_rate_demotes_endpoint(stubs):
+    broken, working = stubs(fail=True), stubs()
+    provider = MultiEndpointProvider([broken.url, working.url])
+    endpoint = provider.endpoints[0]
+
+    while endpoint.is_healthy():
+        provider.make_request("eth_blockNumber", [])
+    # Нездоровый эндпоинт уходит в конец и больше не получает чтения
+    requests_sent = len(broken.methods)
+    provider.make_request("eth_blockNumber", [])
+
+    assert provider.get_endpoints()[-1] is endpoint
+    assert len(broken.methods) == requests_sent
+    expected = 1 - (1 - constants.rpc_ewma_alpha) ** requests_sent
+    assert endpoint.error_rate == pytest.approx(expected)
+    assert endpoint.error_rate >= constants.rpc_max_error_rate
+
+
+def test_error_rate_recovers(stubs):
+    stub = stubs(fail=True)
+    provider = MultiEndpointProvider([stub.url, stubs().url])
+    endpoint = provider.endpoints[0]
+    with pytest.raises(Exception):
+        endpoint.make_request("eth_blockNumber", [])
+
+    stub.fail = False
+    endpoint.make_request("eth_blockNumber", [])
+
+    alpha = constants.rpc_ewma_alpha
+    assert endpoint.error_rate == pytest.approx(alpha * (1 - alpha))
+    assert endpoint.latency is not None
+
+
+def test_broadcast_returns_first_success(stubs):
+    # Быстрый эндпоинт отвечает ошибкой, медленный принимает транзакцию
+    rejecting = stubs(error="already known")
+    accepting = stubs(result="0xabc", delay=0.05)
+    broken = stubs(fail=True)
+    provider = MultiEndpointProvider([rejecting.url, broken.url, accepting.url])
+
+    response = provider.make_request("eth_sendRawTransaction", ["0x00"])
+
+    assert response["result"] == "0xabc"
+    for stub in (rejecting, accepting, broken):
+        assert stub.methods == ["eth_sendRawTransaction"]
+
+
+def test_broadcast_returns_error_when_nobody_accepts(stubs):
+    rejecting, broken = stubs(error="nonce too low"), stubs(fail=True)
+    provider = MultiEndpointProvider([rejecting.url, broken.url])
+
+    response = provider.make_request("eth_sendRawTransaction", ["0x00"])
+
+    assert response["error"]["message"] == "nonce too low"
+
+
+def test_async_read_fails_over(stubs):
+    broken, working = stubs(fail=True), stubs(result="0x2")
+    provider = AsyncMultiEndpointProvider([broken.url, working.url])
+
+    response = asyncio.run(provider.make_request("eth_blockNumber", []))
+
+    assert response["result"] == "0x2"
+    assert broken.methods == working.methods == ["eth_blockNumber"]
+    assert provider.get_stats()[broken.url]["error_rate"] == constants.rpc_ewma_alpha
+
+
+def test_async_broadcast_returns_first_success(stubs):
+    rejecting = stubs(error="already known")
+    accepting = stubs(result="0xabc", delay=0.05)
+    provider = AsyncMultiEndpointProvider([rejecting.url, accepting.url])
+
+    response = asyncio.run(
+        provider.make_request("eth_sendRawTransaction", ["0x00"])
+    )
+
+    assert response["result"] == "0xabc"
+    assert rejecting.methods == accepting.methods == ["eth_sendRawTransaction"]
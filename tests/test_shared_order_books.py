@@ -0,0 +1,55 @@
+import pytest
+
+from multichain import SharedOrderBooks
+from order_book import OrderBook
+
+
+class Mirror:
+    # Интерфейс OrderBookMirror, который нужен publish
+    def __init__(self, books):
+        self.books = books
+
+    def get_book(self, symbol):
+        return self.books.get(symbol)
+
+
+def make_book(symbol, bids):
+    book = OrderBook(symbol)
+    book.apply_snapshot({"bids": bids, "asks": [], "lastUpdateId": 1})
+    return book
+
+
+@pytest.fixture
+def shared():
+    books = SharedOrderBooks(["QIUSDT", "JOEUSDT", "AVAXUSDT"], depth=3)
+    yield books
+    books.close()
+
+
+def test_sell_price_matches_order_book(shared):
+    book = make_book("QIUSDT", [["1.00", "10"], ["0.99", "5"], ["0.98", "20"]])
+    shared.publish(Mirror({"QIUSDT": book}))
+
+    for quantity in (1, 10, 12, 35, 100):
+        assert shared.get_book("QIUSDT").get_sell_price(quantity) == pytest.approx(
+            book.get_sell_price(quantity)
+        )
+
+
+def test_only_best_levels_are_published(shared):
+    book = make_book(
+        "JOEUSDT", [["0.5", "1"], ["0.6", "1"], ["0.7", "1"], ["0.8", "1"]]
+    )
+    shared.publish(Mirror({"JOEUSDT": book}))
+
+    # Уровень 0.5 не влез в depth=3 и оценивается в 0
+    assert shared.get_book("JOEUSDT").get_sell_price(4) == pytest.approx(2.1 / 4)
+
+
+def test_unsynced_books_are_missing(shared):
+    book = OrderBook("AVAXUSDT")
+    shared.publish(Mirror({"AVAXUSDT": book}))
+
+    assert shared.get_book("AVAXUSDT") is None
+    assert shared.get_book("QIUSDT") is None
+    assert shared.get_book("STGUSDT") is None
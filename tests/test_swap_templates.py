@@ -0,0 +1,122 @@
+import threading
+from types import SimpleNamespace
+
+from config import constants
+from swap_templates import SwapTemplateCache
+
+ROUTE = (["0x" + "11" * 20, "0x" + "22" * 20], [20], [2])
+RECIPIENT = "0x" + "33" * 20
+
+
+class StubRouter:
+    address = "0x" + "44" * 20
+
+    def encodeABI(self, fn_name, args):
+        # Селектор и четыре слова аргументов, как у swapExactNATIVEForTokens
+        return "0x" + "00" * (4 + 32 * 4)
+
+
+def make_cache(estimate_gas=None):
+    # estimate_gas: газ растет с amount_in, как при пересечении бинов
+    estimates = []
+
+    def default_estimate_gas(tx):
+        return 100_000 + tx["value"] // 10**15
+
+    def record_estimate(tx):
+        estimates.append(tx["value"])
+        return (estimate_gas or default_estimate_gas)(tx)
+
+    web3 = SimpleNamespace(
+        to_checksum_address=lambda address: address,
+        eth=SimpleNamespace(estimate_gas=record_estimate),
+    )
+    lfg_client = SimpleNamespace(
+        web3=web3,
+        router=StubRouter(),
+        account=SimpleNamespace(address=RECIPIENT),
+    )
+    return SwapTemplateCache(lfg_client), estimates
+
+
+def test_gas_limit_per_amount_in():
+    cache, estimates = make_cache()
+
+    small = cache.get_template(*ROUTE, 10**18, RECIPIENT)
+    large = cache.get_template(*ROUTE, 100 * 10**18, RECIPIENT)
+
+    assert estimates == [10**18, 100 * 10**18]
+    assert large.gas > small.gas
+    assert large.gas == int((100_000 + 100_000) * 1.2)
+
+
+def test_gas_estimated_once_per_route_and_size():
+    cache, estimates = make_cache()
+
+    cache.get_template(*ROUTE, 10**18, RECIPIENT)
+    cache.get_template(*ROUTE, 10**18, "0x" + "55" * 20)
+
+    assert estimates == [10**18]
+
+
+def test_failed_estimate_is_not_cached():
+    # Первая оценка падает, вторая проходит
+    failures = [ValueError("execution reverted")]
+
+    def estimate_gas(tx):
+        if failures:
+            raise failures.pop()
+        return 100_000
+
+    cache, estimates = make_cache(estimate_gas)
+
+    fallback = cache.get_template(*ROUTE, 10**18, RECIPIENT)
+    assert fallback.gas == constants.default_swap_gas
+    assert not cache.has_template(*ROUTE, 10**18, RECIPIENT)
+
+    template = cache.get_template(*ROUTE, 10**18, RECIPIENT)
+    assert estimates == [10**18, 10**18]
+    assert template.gas == 120_000
+    assert cache.has_template(*ROUTE, 10**18, RECIPIENT)
+
+
+def test_cache_is_bounded(monkeypatch):
+    monkeypatch.setattr(constants, "swap_template_cache_size", 2)
+    cache, estimates = make_cache()
+
+    for amount_in in (1, 2, 1, 3):
+        cache.get_template(*ROUTE, amount_in * 10**18, RECIPIENT)
+
+    # 2 вытеснен как самый давний, 1 недавно использовался
+    assert len(cache.templates) == len(cache.gas_limits) == 2
+    assert cache.has_template(*ROUTE, 10**18, RECIPIENT)
+    assert not cache.has_template(*ROUTE, 2 * 10**18, RECIPIENT)
+    assert estimates == [10**18, 2 * 10**18, 3 * 10**18]
+
+
+def test_concurrent_callers_build_once():
+    release = threading.Event()
+
+    def estimate_gas(tx):
+        assert release.wait(5)
+        return 100_000
+
+    cache, estimates = make_cache(estimate_gas)
+    templates = []
+    threads = [
+        threading.Thread(
+            target=lambda: templates.append(
+                cache.get_template(*ROUTE, 10**18, RECIPIENT)
+            )
+        )
+        for _ in range(4)
+    ]
+    for thread in threads:
+        thread.start()
+    release.set()
+    for thread in threads:
+        thread.join(5)
+
+    assert estimates == [10**18]
+    assert len(templates) == 4
+    assert all(template is templates[0] for template in templates)
@@ -0,0 +1,162 @@
+import json
+import threading
+import time
+from concurrent.futures import Future
+from types import SimpleNamespace
+
+import pytest
+
+from amm_arbitrage_lfg import AmmArbitrageLFG
+from config import constants
+from unwind_pipeline import UnwindPipeline
+
+
+def wait_for(condition, timeout=5):
+    deadline = time.time() + timeout
+    while not condition():
+        if time.time() > deadline:
+            raise TimeoutError("Condition not met")
+        time.sleep(0.01)
+
+
+def make_pipeline(tmp_path, handlers=None):
+    handlers = handlers or {}
+    return UnwindPipeline(
+        {
+            stage: handlers.get(stage, lambda job: True)
+            for stage in UnwindPipeline.STAGES
+        },
+        str(tmp_path / "unwind_jobs.json"),
+    )
+
+
+def test_capacity_counts_jobs_waiting_for_deposit(tmp_path, monkeypatch):
+    # Джобы, ждущие депозит на Future, уже не в очереди, но в работе
+    monkeypatch.setattr(constants, "unwind_max_jobs", 2)
+    deposit = Future()
+    pipeline = make_pipeline(
+        tmp_path, {"deposit": lambda job: deposit.done() or deposit}
+    )
+    pipeline.start()
+    try:
+        pipeline.submit("0x1", 10**18)
+        assert pipeline.has_capacity()
+        pipeline.submit("0x2", 10**18)
+        wait_for(lambda: pipeline.get_queue_sizes()["deposit"] == 0)
+
+        assert not pipeline.has_capacity()
+        deposit.set_result(None)
+        wait_for(pipeline.has_capacity)
+    finally:
+        pipeline.stop()
+
+
+def test_submit_does_not_block_on_full_queue(tmp_path, monkeypatch):
+    # Без воркеров очередь депозитов заполняется первым же джобом
+    monkeypatch.setattr(constants, "unwind_queue_size", 1)
+    sent = []
+    monkeypatch.setattr(
+        "unwind_pipeline.send_message_async", lambda message: sent.append(message)
+    )
+    pipeline = make_pipeline(tmp_path)
+
+    done = threading.Event()
+
+    def submit_all():
+        for tx_hash in ("0x1", "0x2", "0x3"):
+            pipeline.submit(tx_hash, 10**18)
+        done.set()
+
+    threading.Thread(target=submit_all, daemon=True).start()
+
+    assert done.wait(5)
+    assert pipeline.get_queue_sizes()["deposit"] == 1
+    # Не влезшие в очередь джобы отложены и сохранены на диск
+    assert len(pipeline.delayed) == 2
+    with open(pipeline.filename) as file:
+        assert {job["tx_hash"] for job in json.load(file)} == {"0x1", "0x2", "0x3"}
+    assert len(sent) == 2
+
+
+class Restart(Exception):
+    pass
+
+
+class StubSellExecutor:
+    # Продает по 1 USDT за токен, ордерами по 2 токена. fail_after - сколько
+    # ордеров исполнить перед "рестартом"
+    def __init__(self, fail_after=None):
+        self.fail_after = fail_after
+        self.quantities = []
+
+    def sell(self, symbol, quantity, rebuy_symbol=None, on_progress=None):
+        self.quantities.append(quantity)
+        result = {"sold": 0, "total_usdt": 0, "rebought_usdt": 0, "bought": 0}
+        orders = 0
+        while result["sold"] < quantity:
+            if orders == self.fail_after:
+                raise Restart()
+            size = min(2, quantity - result["sold"])
+            result["sold"] += size
+            result["total_usdt"] += size
+            result["rebought_usdt"] += size
+            result["bought"] += size / 30
+            orders += 1
+            on_progress(dict(result))
+        return result
+
+
+def make_engine(tmp_path, sell_executor):
+    # Только то, что нужно стадии sell
+    engine = AmmArbitrageLFG.__new__(AmmArbitrageLFG)
+    engine.network = "avalanche"
+    engine.sell_executor = sell_executor
+    engine.unwind_pipeline = make_pipeline(tmp_path)
+    return engine
+
+
+def test_sell_resumes_from_persisted_progress(tmp_path, monkeypatch):
+    monkeypatch.setattr("amm_arbitrage_lfg.send_message_async", lambda message: None)
+    job = {"tx_hash": "0x1", "token": "TEST", "quantity": 10, "stage": "sell"}
+
+    engine = make_engine(tmp_path, StubSellExecutor(fail_after=3))
+    engine.unwind_pipeline.jobs[job["tx_hash"]] = job
+    with pytest.raises(Restart):
+        engine.binance_sell_token(job)
+
+    # Рестарт: джоб читается с диска, продается только остаток
+    engine = make_engine(tmp_path, StubSellExecutor())
+    (job,) = engine.unwind_pipeline.load_jobs()
+    assert job["sold_qty"] == 6
+    assert engine.binance_sell_token(job)
+
+    assert engine.sell_executor.quantities == [4]
+    assert job["sold_qty"] == 10
+    assert job["total_usdt"] == job["rebought_usdt"] == 10
+    assert job["bought"] == pytest.approx(10 / 30)
+
+
+@pytest.mark.parametrize(
+    "total_usdt, rebought_usdt, expected",
+    [(10.239, 0, 10.13), (10.239, 10.1, None), (25.0, 5.0, 19.9)],
+)
+def test_rebuy_leftover_never_rounds_up(
+    tmp_path, monkeypatch, total_usdt, rebought_usdt, expected
+):
+    monkeypatch.setattr("amm_arbitrage_lfg.send_message_async", lambda message: None)
+    bought = []
+    sell_executor = SimpleNamespace(
+        can_buy=lambda symbol, amount: amount >= 5,
+        buy=lambda symbol, amount: bought.append(amount) or (amount, amount / 30),
+    )
+    engine = make_engine(tmp_path, sell_executor)
+    job = {
+        "tx_hash": "0x1",
+        "amount_in": 10**18,
+        "total_usdt": total_usdt,
+        "rebought_usdt": rebought_usdt,
+    }
+
+    assert engine.binance_buy_network_base_token(job)
+
+    assert bought == ([] if expected is None else [pytest.approx(expected)])